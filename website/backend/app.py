@@ -5,19 +5,45 @@
 """
 
 import os
+import hmac
 import secrets
 import time
 import json
 from datetime import datetime, timedelta, date
 from functools import wraps
+from contextlib import contextmanager
 
-from flask import Flask, request, jsonify, g, send_file, make_response
+from flask import (
+    Flask, Response, request, jsonify, g, send_file, make_response,
+    has_request_context, stream_with_context
+)
 from flask_cors import CORS
-import psycopg2
-from psycopg2.extras import RealDictCursor
 import requests
 from dotenv import load_dotenv
 
+from psycopg2 import OperationalError
+from psycopg2.pool import PoolError
+
+import database
+from database import (
+    DB_CONFIG, DB_STREAM_FETCH_SIZE, get_pool, get_service_pool, get_replica_monitor,
+    execute, iter_rows, is_read_only
+)
+from prepared import PREPARED
+from session_store import SESSIONS
+from passwords import PASSWORDS, PasswordHasherBusy
+from rate_limit import RATE_LIMITER
+from telegram_auth import INIT_DATA, TELEGRAM_ACCOUNTS, ACCOUNT_NOTIFY_SQL, account_payload
+from reference_data import REFERENCE_DATA
+from medcenter_directory import MEDCENTERS
+from center_needs import CENTER_NEEDS
+from static_snapshots import SNAPSHOTS
+from geo_index import NEARBY, MEDCENTERS_JSON
+from search_index import SEARCH
+from compact_rows import Record
+from query_stats import RequestQueryLog, QUERY_STATS
+from slow_queries import SlowQueryLog
+
 # Импорт функции уведомлений из telegram_bot
 try:
     from telegram_bot import send_notification, send_urgent_blood_request
@@ -36,11 +62,14 @@ load_dotenv()
 # Импорт нового сервиса авторизации
 from auth_service import (
     generate_access_token, generate_refresh_token, hash_token,
-    verify_access_token, verify_refresh_token,
-    create_session, rotate_refresh_token, invalidate_session, invalidate_all_sessions,
+    verify_access_token, verify_refresh_token, revoke_sessions_query, get_access_session, get_legacy_session,
+    forget_session_token, ACCESS_TOKENS, LEGACY_SESSIONS, UNKNOWN_TOKENS, REFRESH_STATS,
+    REVOCATIONS, SESSION_COMPACTOR,
+    create_session, rotate_refresh_session,
+    invalidate_session, invalidate_all_sessions,
     get_active_sessions, set_refresh_cookie, clear_refresh_cookie,
     get_refresh_token_from_request, get_client_info, require_auth_jwt,
-    ACCESS_TOKEN_EXPIRES, REFRESH_TOKEN_EXPIRES
+    ACCESS_TOKEN_EXPIRES, REFRESH_TOKEN_EXPIRES, COOKIE_NAME
 )
 
 app = Flask(__name__)
@@ -85,51 +114,294 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', secrets.token_hex(32))
 # URL приложения для ссылок
 APP_URL = os.getenv('APP_URL', 'http://localhost:8080')
 
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'database': os.getenv('DB_NAME', 'your_donor'),
-    'user': os.getenv('DB_USER', 'postgres'),
-    'password': os.getenv('DB_PASSWORD', 'vadamahjkl'),
-    'port': os.getenv('DB_PORT', 5432)
-}
-
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 MASTER_PASSWORD = os.getenv('MASTER_PASSWORD', 'doctor2024')
 
+# Пул соединений (свой в каждом воркере, размеры задаются DB_POOL_MIN/DB_POOL_MAX)
+DB_POOL = get_pool()
+
+# Реплика для чтения (None, если DB_REPLICA_HOST не задан)
+REPLICA = get_replica_monitor()
+
+# Медленные запросы: лог + выборочный EXPLAIN ANALYZE (порог SLOW_QUERY_MS);
+# EXPLAIN из фонового потока - через служебный пул, не занимая соединения запросов
+SLOW_QUERIES = SlowQueryLog(get_service_pool())
+
+# ============================================
+# Лимиты на вход и обновление токенов (до обращений к БД)
+# ============================================
+
+def request_field(*names):
+    """Поля JSON-тела запроса без обращения к БД (для ключей лимитов)"""
+    data = request.get_json(silent=True) or {}
+    values = [data.get(name) for name in names]
+    return '|'.join(str(v).strip().lower() for v in values) if any(values) else None
+
+def refresh_token_key():
+    data = request.get_json(silent=True) or {}
+    return (request.headers.get('X-Refresh-Token') or request.cookies.get(COOKIE_NAME)
+            or data.get('refresh_token'))
+
+@app.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    """Очередь хэширования паролей заполнена (всплеск входов)"""
+    response = jsonify({'error': 'Сервер перегружен, повторите через несколько секунд', 'code': 'BUSY'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+
 # ============================================
 # Утилиты БД
 # ============================================
 
 def get_db():
     if 'db' not in g:
-        g.db = psycopg2.connect(**DB_CONFIG)
+        g.db = DB_POOL.getconn()
     return g.db
 
+def get_replica_db():
+    if 'replica_db' not in g:
+        g.replica_db = REPLICA.pool.getconn()
+    return g.replica_db
+
 @app.teardown_appcontext
 def close_db(error):
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        DB_POOL.putconn(db)
+    replica_db = g.pop('replica_db', None)
+    if replica_db is not None:
+        REPLICA.pool.putconn(replica_db)
 
-def query_db(query, args=(), one=False, commit=False):
-    conn = get_db()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+def use_primary():
+    """Все дальнейшие чтения этого запроса - с основного сервера"""
+    g.read_your_writes = True
+
+def can_use_replica(query):
+    """
+    Чтение уходит на реплику, только если она настроена и не отстаёт,
+    запрос ничего не меняет, и в этом запросе ещё не было записей
+    (read-your-writes)
+    """
+    if REPLICA is None or g.get('read_your_writes') or g.get('uow') is not None:
+        return False
+    return is_read_only(query) and REPLICA.is_available()
+
+def query_replica(query, args, one, compact=False):
+    """Чтение с реплики; при сбое соединения - None (читаем с основного)"""
+    try:
+        rv = execute(get_replica_db(), query, args, one=one, compact=compact)
+    except (OperationalError, PoolError) as e:
+        app.logger.warning(f"[REPLICA] Чтение перенесено на основной сервер: {e}")
+        REPLICA.mark_failed(e)
+        replica_db = g.pop('replica_db', None)
+        if replica_db is not None:
+            REPLICA.pool.putconn(replica_db, close=True)
+        return None, False
+    REPLICA.routed += 1
+    return rv, True
+
+def query_db(query, args=(), one=False, commit=False, compact=False):
+    uow = g.get('uow')
+    started = time.perf_counter()
     try:
-        cur.execute(query, args)
+        if uow is not None:
+            # Внутри unit of work фиксирует только transaction()
+            rv = execute(get_db(), query, args, one=one, compact=compact)
+            if commit:
+                uow['writes'] += 1
+        else:
+            rv, routed = None, False
+            if not commit and can_use_replica(query):
+                rv, routed = query_replica(query, args, one, compact)
+            if not routed:
+                rv = execute(get_db(), query, args, one=one, commit=commit, compact=compact)
         if commit:
-            conn.commit()
-            if cur.description:
-                rv = cur.fetchall()
-                return (rv[0] if rv else None) if one else rv
-            return cur.rowcount
-        rv = cur.fetchall()
-        return (rv[0] if rv else None) if one else rv
+            use_primary()
     except Exception as e:
-        conn.rollback()
         print(f"DB Error: {e}")
+        if uow is not None and uow['writes'] and uow['error'] is None:
+            # Откат уже стёр записи этого запроса - фиксировать остальное нельзя
+            uow['error'] = e
         raise e
+    record_query(query, args, started, rv)
+    return rv
+
+def query_primary(query, args=(), one=False):
+    """
+    Чтение только с основного сервера, без переключения на него
+    остальных чтений запроса (в отличие от use_primary)
+
+    Для проверки токенов: сессия, только что созданная на основном
+    сервере, может ещё не дойти до реплики.
+    """
+    if g.get('uow') is not None:
+        return query_db(query, args, one=one)
+    started = time.perf_counter()
+    rv = execute(get_db(), query, args, one=one)
+    record_query(query, args, started, rv)
+    return rv
+
+_row_encoder = None
+
+def encode_row(row):
+    """
+    JSON одной строки в том же формате, что и jsonify
+    (один кэшированный JSONEncoder вместо нового на каждый вызов)
+    """
+    global _row_encoder
+    if _row_encoder is None:
+        _row_encoder = json.JSONEncoder(
+            default=app.json.default,
+            ensure_ascii=app.json.ensure_ascii,
+            sort_keys=app.json.sort_keys,
+            separators=(',', ':')
+        )
+    return _row_encoder.encode(row.as_dict() if isinstance(row, Record) else row)
+
+def stream_json(query, args=(), fetch_size=DB_STREAM_FETCH_SIZE):
+    """
+    Ответ-массив JSON, который пишется частями по мере чтения строк
+    из серверного курсора: память не растёт с размером результата
+    """
+    conn = None
+    if can_use_replica(query):
+        try:
+            conn = get_replica_db()
+        except (OperationalError, PoolError) as e:
+            REPLICA.mark_failed(e)
+    if conn is None:
+        conn = get_db()
+    
+    started = time.perf_counter()
+    rows = iter_rows(conn, query, args, fetch_size, compact=True)
+    # Первая строка читается сразу: ошибка SQL станет обычным 500, а не обрывом потока
+    first = next(rows, None)
+    
+    def generate():
+        count = 0
+        chunk = ['[']
+        if first is not None:
+            chunk.append(encode_row(first))
+            count = 1
+            for row in rows:
+                chunk.append(',')
+                chunk.append(encode_row(row))
+                count += 1
+                if count % fetch_size == 0:
+                    yield ''.join(chunk)
+                    chunk = []
+        chunk.append(']')
+        yield ''.join(chunk)
+        record_query(query, args, started, count)
+    
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# ============================================
+# Инструментирование запросов (N+1, бюджеты)
+# ============================================
+
+# Добавлять X-Query-Count / X-Query-Time-Ms в ответы
+QUERY_DEBUG = os.getenv('QUERY_DEBUG', 'false').lower() == 'true'
+
+def record_query(query, args, started, rv):
+    """Записать выполненный SQL в журнал текущего API-запроса"""
+    duration_ms = (time.perf_counter() - started) * 1000
+    log = g.get('query_log')
+    if log is None:
+        log = g.query_log = RequestQueryLog(request.endpoint if has_request_context() else None)
+    SLOW_QUERIES.observe(query, args, duration_ms, log.endpoint)
+    if isinstance(rv, list):
+        rows = len(rv)
+    elif isinstance(rv, int):
+        rows = rv
+    else:
+        rows = 1 if rv else 0
+    log.record(query, duration_ms, rows)
+
+@app.after_request
+def add_query_headers(response):
+    log = g.get('query_log')
+    if QUERY_DEBUG and log is not None:
+        response.headers['X-Query-Count'] = str(log.count)
+        response.headers['X-Query-Time-Ms'] = f"{log.total_ms:.1f}"
+    return response
+
+@app.teardown_request
+def finish_query_log(error):
+    log = g.pop('query_log', None)
+    if log is None:
+        return
+    repeated, over_budget = QUERY_STATS.finish_request(log)
+    for fp, count in repeated.items():
+        app.logger.warning(f"[N+1] {log.endpoint}: {count}× {fp[:200]}")
+    if over_budget:
+        app.logger.warning(f"[QUERY BUDGET] {log.endpoint}: {log.count} запросов при бюджете {log.budget}")
+
+# ============================================
+# Unit of work: одна транзакция на API-запрос
+# ============================================
+
+@contextmanager
+def transaction():
+    """
+    Все записи внутри блока - одна транзакция и один COMMIT в конце
+
+    query_db(..., commit=True) внутри блока только выполняет запрос
+    (RETURNING работает как обычно), фиксация - при выходе из блока.
+    Исключение откатывает всё. Вложенные блоки сливаются с внешним.
+    """
+    if g.get('uow') is not None:
+        yield g.uow
+        return
+    
+    conn = get_db()
+    g.uow = {'writes': 0, 'error': None, 'rollback_only': False, 'after_commit': []}
+    try:
+        yield g.uow
+        if g.uow['error'] is not None:
+            raise g.uow['error']
+        if g.uow['rollback_only']:
+            conn.rollback()
+            return
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
-        cur.close()
+        uow = g.pop('uow')
+    
+    for callback in uow['after_commit']:
+        try:
+            callback()
+        except Exception as e:
+            app.logger.error(f"❌ Ошибка в after_commit ({getattr(callback, '__name__', callback)}): {e}")
+
+def after_commit(callback):
+    """
+    Выполнить callback после успешного COMMIT текущей транзакции
+    (уведомления, Telegram). Вне transaction() - выполняется сразу.
+    """
+    uow = g.get('uow')
+    if uow is None:
+        callback()
+    else:
+        uow['after_commit'].append(callback)
+
+def unit_of_work(f):
+    """
+    Декоратор: весь обработчик - одна транзакция
+
+    Ответ с кодом >= 400 откатывает сделанные записи.
+    """
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        with transaction() as uow:
+            rv = f(*args, **kwargs)
+            status = rv[1] if isinstance(rv, tuple) and len(rv) > 1 else getattr(rv, 'status_code', 200)
+            if isinstance(status, int) and status >= 400:
+                uow['rollback_only'] = True
+        return rv
+    return decorated
 
 def generate_token():
     return secrets.token_urlsafe(64)
@@ -257,22 +529,11 @@ def require_auth(user_type=None):
             
             session = None
             
-            # Сначала пробуем JWT токен (новая система)
-            payload = verify_access_token(token)
-            if payload:
-                # JWT валиден - создаём виртуальную сессию
-                session = {
-                    'user_type': payload.get('type'),
-                    'user_id': int(payload['sub']) if payload.get('type') == 'donor' else None,
-                    'medical_center_id': int(payload['sub']) if payload.get('type') == 'medcenter' else None
-                }
-            else:
-                # Fallback: ищем legacy session_token в БД
-                session = query_db(
-                    """SELECT * FROM user_sessions 
-                       WHERE session_token = %s AND is_active = TRUE AND expires_at > NOW()""",
-                    (token,), one=True
-                )
+            # Сначала пробуем JWT токен (новая система, с кэшем проверенных токенов)
+            session = get_access_session(token)
+            if not session:
+                # Fallback: legacy session_token (кэш, затем основной сервер - не реплика)
+                session = get_legacy_session(token, query_primary)
             
             if not session:
                 app.logger.warning(f"❌ Сессия не найдена или истекла для {f.__name__}, token={token[:10] if len(token) > 10 else token}..., путь: {request.path}")
@@ -285,6 +546,9 @@ def require_auth(user_type=None):
                 app.logger.warning(f"❌ 403 FORBIDDEN: {f.__name__} требует '{user_type}', но user_type='{session['user_type']}', user_id={session.get('user_id')}, путь: {request.path}")
                 return jsonify({'error': f'Доступ запрещён. Требуется роль: {user_type}'}), 403
             
+            # last_used_at пишется пачкой в фоне, а не отдельным UPDATE на каждый запрос
+            SESSIONS.touch(session.get('session_id') or session.get('id'))
+            
             g.session = session
             return f(*args, **kwargs)
         return decorated
@@ -294,69 +558,100 @@ def require_auth(user_type=None):
 # API: Регионы и районы
 # ============================================
 
+# Справочник загружается один раз на процесс и отдаётся с ETag (reference_data.py)
+
 @app.route('/api/regions', methods=['GET'])
 def get_regions():
-    regions = query_db("SELECT id, name FROM regions ORDER BY id")
-    return jsonify(regions)
+    REFERENCE_DATA.ensure_loaded(encode=encode_row)
+    return REFERENCE_DATA.regions()
 
 @app.route('/api/regions/<int:region_id>/districts', methods=['GET'])
 def get_districts(region_id):
-    districts = query_db(
-        "SELECT id, name FROM districts WHERE region_id = %s ORDER BY name",
-        (region_id,)
-    )
-    return jsonify(districts)
+    REFERENCE_DATA.ensure_loaded(encode=encode_row)
+    return REFERENCE_DATA.districts(region_id)
 
 # ============================================
 # API: Медцентры
 # ============================================
 
+# Справочник медцентров в памяти (medcenter_directory.py): после изменения
+# medical_centers обязателен MEDCENTERS.invalidate(mc_id)
+
+# Названия районов и областей в справочнике берутся из districts/regions
+REFERENCE_DATA.on_reload.append(MEDCENTERS.invalidate)
+# Список /api/medical-centers зависит и от медцентров, и от светофора; медцентр
+# мог сменить район или активность - тогда он появляется в чужих записях кэша
+MEDCENTERS.on_invalidate.append(lambda mc_id: CENTER_NEEDS.invalidate(mc_id, moved=True))
+# Поиск перестраивает документ изменённого медцентра
+MEDCENTERS.on_invalidate.append(SEARCH.invalidate)
+
 @app.route('/api/medcenters', methods=['GET'])
 def get_medcenters():
     district_id = request.args.get('district_id')
     region_id = request.args.get('region_id')
     include_pending = request.args.get('include_pending', 'false').lower() == 'true'
     
-    query = """
-        SELECT mc.id, mc.name, mc.address, mc.email, mc.is_blood_center,
-               mc.district_id, d.name as district_name, r.name as region_name, r.id as region_id
-        FROM medical_centers mc
-        LEFT JOIN districts d ON mc.district_id = d.id
-        LEFT JOIN regions r ON d.region_id = r.id
-        WHERE mc.is_active = TRUE
-    """
-    params = []
-    
-    # По умолчанию показываем только подтверждённые медцентры
-    if not include_pending:
-        query += " AND (mc.approval_status = 'approved' OR mc.approval_status IS NULL)"
-    
-    if district_id:
-        query += " AND mc.district_id = %s"
-        params.append(district_id)
-    elif region_id:
-        query += " AND d.region_id = %s"
-        params.append(region_id)
-    
-    query += " ORDER BY mc.name"
+    try:
+        district_id = int(district_id) if district_id else None
+        region_id = int(region_id) if region_id else None
+    except ValueError:
+        return jsonify({'error': 'Некорректный district_id или region_id'}), 400
     
-    medcenters = query_db(query, tuple(params))
-    return jsonify(medcenters)
+    MEDCENTERS.ensure_loaded(encode=encode_row)
+    body = MEDCENTERS.list_json(district_id, region_id, include_pending)
+    return Response(body, mimetype='application/json')
 
 @app.route('/api/medcenters/<int:mc_id>', methods=['GET'])
 def get_medcenter(mc_id):
-    mc = query_db(
-        """SELECT mc.*, d.name as district_name, r.name as region_name, r.id as region_id
-           FROM medical_centers mc
-           LEFT JOIN districts d ON mc.district_id = d.id
-           LEFT JOIN regions r ON d.region_id = r.id
-           WHERE mc.id = %s""",
-        (mc_id,), one=True
-    )
+    MEDCENTERS.ensure_loaded(encode=encode_row)
+    mc = MEDCENTERS.get(mc_id)
     if not mc:
         return jsonify({'error': 'Медцентр не найден'}), 404
     return jsonify(mc)
 
+@app.route('/api/medcenters/nearby', methods=['GET'])
+def get_nearby_medcenters():
+    """
+    Ближайшие медучреждения к точке (геолокация Telegram Mini App)
+    
+    Параметры: lat, lon, radius_km (по умолчанию 25, до 200), limit (до 50).
+    Поиск по индексу в памяти из medcenters.json (geo_index.py), без запросов к БД.
+    Учитываются только учреждения с lat/lon (geocode_medcenters.py).
+    """
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if lat is None or lon is None or not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return jsonify({'error': 'Укажите корректные lat и lon'}), 400
+    
+    radius_km = min(max(request.args.get('radius_km', 25, type=float), 0.1), 200)
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 50)
+    
+    try:
+        found = NEARBY.nearest(lat, lon, k=limit, radius_km=radius_km)
+    except (OSError, ValueError) as e:
+        app.logger.error(f"[GEO] Индекс медучреждений недоступен: {e}")
+        return jsonify({'error': 'Справочник медучреждений недоступен'}), 503
+    
+    return jsonify([
+        dict(item, distance_km=round(distance, 2)) for distance, item in found
+    ])
+
+@app.route('/api/search', methods=['GET'])
+def search_directory():
+    """
+    Поиск медцентров и районов по мере ввода
+    
+    Параметры: q, limit (до 30), types - через запятую из medcenter, district, institution.
+    Индекс в памяти (search_index.py): регистр и ё/е не различаются, опечатки - по триграммам.
+    """
+    query = request.args.get('q', '')[:100]
+    limit = min(max(request.args.get('limit', 10, type=int), 1), 30)
+    kinds = {k for k in request.args.get('types', '').split(',') if k} or None
+    
+    REFERENCE_DATA.ensure_loaded(encode=encode_row)
+    MEDCENTERS.ensure_loaded(encode=encode_row)
+    return jsonify(SEARCH.search(query, limit=limit, kinds=kinds))
+
 @app.route('/api/medcenters', methods=['POST'])
 def register_medcenter():
     """Регистрация нового медцентра"""
@@ -401,6 +696,7 @@ def register_medcenter():
             "INSERT INTO blood_needs (medical_center_id, blood_type, status) VALUES (%s, %s, 'normal')",
             (mc['id'], bt), commit=True
         )
+    MEDCENTERS.invalidate(mc['id'])
     
     # Создаём сессию
     token = generate_token()
@@ -474,9 +770,8 @@ def register_donor():
     if not mc:
         return jsonify({'error': 'Медцентр не найден'}), 404
     
-    # Хешируем пароль
-    import hashlib
-    password_hash = hashlib.sha256(data['password'].encode()).hexdigest()
+    # Хешируем пароль (bcrypt в пуле процессов)
+    password_hash = PASSWORDS.hash(data['password'])
     
     query_db(
         """INSERT INTO users 
@@ -551,6 +846,8 @@ def register_donor():
     return response
 
 @app.route('/api/donor/login', methods=['POST'])
+@RATE_LIMITER.limit('donor_login', ip='20/60/10',
+                    account=('5/300', lambda: request_field('full_name', 'birth_year', 'medical_center_id')))
 def login_donor():
     data = request.json
     
@@ -573,14 +870,16 @@ def login_donor():
         return jsonify({'error': 'Донор не найден. Сначала зарегистрируйтесь.'}), 404
     
     # Проверка пароля
-    import hashlib
     if user.get('password_hash'):
-        password_hash = hashlib.sha256(data['password'].encode()).hexdigest()
-        if user['password_hash'] != password_hash:
+        ok, new_hash = PASSWORDS.verify(data['password'], user['password_hash'])
+        if not ok:
             return jsonify({'error': 'Неверный пароль'}), 401
+        if new_hash:
+            # Старый sha256 / слабый bcrypt - заменяем при входе
+            query_db("UPDATE users SET password_hash = %s WHERE id = %s", (new_hash, user['id']), commit=True)
     else:
         # Если пароль не установлен, сохраняем его
-        password_hash = hashlib.sha256(data['password'].encode()).hexdigest()
+        password_hash = PASSWORDS.hash(data['password'])
         query_db("UPDATE users SET password_hash = %s WHERE id = %s", (password_hash, user['id']), commit=True)
     
     # ============================================
@@ -671,20 +970,17 @@ def change_donor_password():
         return jsonify({'error': 'У вас не установлен пароль. Обратитесь к администратору.'}), 400
     
     # Проверяем текущий пароль
-    import hashlib
-    current_password_hash = hashlib.sha256(data['current_password'].encode()).hexdigest()
-    
-    # СТРОГАЯ ПРОВЕРКА: хеши должны ТОЧНО совпадать
-    if user['password_hash'] != current_password_hash:
+    ok, _ = PASSWORDS.verify(data['current_password'], user['password_hash'])
+    if not ok:
         app.logger.warning(f"[PASSWORD] ❌ Донор ID={user_id} ввел неверный текущий пароль")
         return jsonify({'error': 'Неверный текущий пароль'}), 401
     
     # Проверяем что новый пароль отличается от текущего
-    new_password_hash = hashlib.sha256(data['new_password'].encode()).hexdigest()
-    if new_password_hash == current_password_hash:
+    if data['new_password'] == data['current_password']:
         return jsonify({'error': 'Новый пароль должен отличаться от текущего'}), 400
     
     # Устанавливаем новый пароль
+    new_password_hash = PASSWORDS.hash(data['new_password'])
     query_db("UPDATE users SET password_hash = %s, updated_at = NOW() WHERE id = %s", 
              (new_password_hash, user_id), commit=True)
     
@@ -994,7 +1290,7 @@ def register_medcenter_with_password():
                VALUES (%s, %s, %s, %s, %s, %s, %s, 'pending')""",
             (data['name'], data.get('district_id'), data.get('address'), 
              data['email'], data.get('phone'), data.get('is_blood_center', False), 
-             data['password']), commit=True
+             PASSWORDS.hash(data['password'])), commit=True
         )
         
         # Получаем созданный медцентр
@@ -1010,6 +1306,7 @@ def register_medcenter_with_password():
         
         if not mc:
             return jsonify({'error': 'Ошибка создания медцентра'}), 500
+        MEDCENTERS.invalidate(mc['id'])
         
         app.logger.info(f"[MEDCENTER] Новая заявка на регистрацию: {mc['name']} (ID={mc['id']})")
         
@@ -1107,6 +1404,8 @@ def send_medcenter_approval_request(mc):
         return False
 
 @app.route('/api/medcenter/login', methods=['POST'])
+@RATE_LIMITER.limit('medcenter_login', ip='20/60/10',
+                    account=('5/300', lambda: request_field('medical_center_id')))
 def login_medcenter():
     data = request.json
     
@@ -1139,8 +1438,14 @@ def login_medcenter():
         }), 403
     
     # Проверяем пароль (индивидуальный или мастер)
-    if data['password'] != mc.get('master_password', MASTER_PASSWORD) and data['password'] != MASTER_PASSWORD:
-        return jsonify({'error': 'Неверный пароль'}), 401
+    if not hmac.compare_digest(data['password'].encode(), MASTER_PASSWORD.encode()):
+        # Пароль в открытом виде (старые записи) заменяется хэшем при входе
+        ok, new_hash = PASSWORDS.verify(data['password'], mc.get('master_password'), allow_plaintext=True)
+        if not ok:
+            return jsonify({'error': 'Неверный пароль'}), 401
+        if new_hash:
+            query_db("UPDATE medical_centers SET master_password = %s WHERE id = %s",
+                     (new_hash, mc['id']), commit=True)
     
     # ============================================
     # НОВАЯ СИСТЕМА: JWT + Refresh Token
@@ -1230,6 +1535,7 @@ def approve_medcenter(mc_id):
                VALUES (%s, %s, 'normal') ON CONFLICT DO NOTHING""",
             (mc_id, bt), commit=True
         )
+    MEDCENTERS.invalidate(mc_id)
     
     app.logger.info(f"[ADMIN] Медцентр #{mc_id} ({mc['name']}) подтверждён")
     
@@ -1266,6 +1572,7 @@ def reject_medcenter(mc_id):
         "UPDATE medical_centers SET approval_status = 'rejected', is_active = FALSE, updated_at = NOW() WHERE id = %s",
         (mc_id,), commit=True
     )
+    MEDCENTERS.invalidate(mc_id)
     
     app.logger.info(f"[ADMIN] Медцентр #{mc_id} ({mc['name']}) отклонён")
     
@@ -1327,21 +1634,20 @@ def change_medcenter_password():
         return jsonify({'error': 'У медцентра не установлен пароль. Обратитесь к администратору.'}), 400
     
     # Проверяем текущий пароль - СТРОГОЕ СРАВНЕНИЕ
-    current_password_input = data['current_password']
-    stored_password = mc['master_password']
-    
     # НЕ ИСПОЛЬЗУЕМ ДЕФОЛТНЫЙ MASTER_PASSWORD!
-    if current_password_input != stored_password:
+    ok, _ = PASSWORDS.verify(data['current_password'], mc['master_password'], allow_plaintext=True)
+    if not ok:
         app.logger.warning(f"[PASSWORD] ❌ Медцентр ID={mc_id} ввел неверный текущий пароль")
         return jsonify({'error': 'Неверный текущий пароль'}), 401
     
     # Проверяем что новый пароль отличается от текущего
-    if data['new_password'] == stored_password:
+    if data['new_password'] == data['current_password']:
         return jsonify({'error': 'Новый пароль должен отличаться от текущего'}), 400
     
     # Устанавливаем новый пароль
     query_db("UPDATE medical_centers SET master_password = %s, updated_at = NOW() WHERE id = %s", 
-             (data['new_password'], mc_id), commit=True)
+             (PASSWORDS.hash(data['new_password']), mc_id), commit=True)
+    MEDCENTERS.invalidate(mc_id)
     
     app.logger.info(f"[PASSWORD] ✅ Медцентр ID={mc_id} сменил пароль")
     
@@ -1374,6 +1680,7 @@ def update_medcenter_profile():
         f"UPDATE medical_centers SET {', '.join(updates)} WHERE id = %s",
         tuple(params), commit=True
     )
+    MEDCENTERS.invalidate(mc_id)
     
     return jsonify({'message': 'Профиль обновлён'})
 
@@ -1410,6 +1717,7 @@ def get_blood_needs(mc_id):
 
 @app.route('/api/blood-needs/<int:mc_id>', methods=['PUT'])
 @require_auth('medcenter')
+@unit_of_work
 def update_blood_needs(mc_id):
     app.logger.info(f"✅ update_blood_needs вызван для mc_id={mc_id}, session_mc_id={g.session.get('medical_center_id')}")
     if g.session['medical_center_id'] != mc_id:
@@ -1424,22 +1732,15 @@ def update_blood_needs(mc_id):
     if not blood_type or status not in ['normal', 'needed', 'urgent', 'critical']:
         return jsonify({'error': 'Неверные данные'}), 400
     
-    # Upsert
-    existing = query_db(
-        "SELECT id FROM blood_needs WHERE medical_center_id = %s AND blood_type = %s",
-        (mc_id, blood_type), one=True
+    # Upsert (UNIQUE(medical_center_id, blood_type))
+    query_db(
+        """INSERT INTO blood_needs (medical_center_id, blood_type, status) VALUES (%s, %s, %s)
+           ON CONFLICT (medical_center_id, blood_type)
+           DO UPDATE SET status = EXCLUDED.status, last_updated = NOW()""",
+        (mc_id, blood_type, status), commit=True
     )
-    
-    if existing:
-        query_db(
-            "UPDATE blood_needs SET status = %s, last_updated = NOW() WHERE medical_center_id = %s AND blood_type = %s",
-            (status, mc_id, blood_type), commit=True
-        )
-    else:
-        query_db(
-            "INSERT INTO blood_needs (medical_center_id, blood_type, status) VALUES (%s, %s, %s)",
-            (mc_id, blood_type, status), commit=True
-        )
+    # Кэш /api/medical-centers сбрасываем после COMMIT - иначе его успеют заполнить старыми данными
+    after_commit(lambda: CENTER_NEEDS.invalidate(mc_id))
     
     # ═══════════════════════════════════════════════════════════════
     # ЛОГИКА СВЕТОФОРА → ЗАПРОСЫ КРОВИ
@@ -1447,6 +1748,16 @@ def update_blood_needs(mc_id):
     
     mc = query_db("SELECT name, address FROM medical_centers WHERE id = %s", (mc_id,), one=True)
     
+    def notify_donors(log_message):
+        """Уведомления донорам уходят только после COMMIT"""
+        if not mc:
+            return
+        def send():
+            from telegram_bot import send_blood_status_notification
+            send_blood_status_notification(blood_type, status, mc['name'], medical_center_id=mc_id)
+            print(log_message)
+        after_commit(send)
+    
     # ───────────────────────────────────────────────────────────────
     # СТАТУС: NORMAL (🟢 Норма)
     # ───────────────────────────────────────────────────────────────
@@ -1497,13 +1808,7 @@ def update_blood_needs(mc_id):
             print(f"[TRAFFIC LIGHT] 🟡 Статус NEEDED → Создан запрос ID {request_id} для {blood_type}")
             
             # 3. Отправляем уведомления
-            if mc:
-                try:
-                    from telegram_bot import send_blood_status_notification
-                    send_blood_status_notification(blood_type, 'needed', mc['name'], medical_center_id=mc_id)
-                    print(f"[TRAFFIC LIGHT] 📤 Уведомления отправлены донорам ({blood_type})")
-                except Exception as e:
-                    logger.error(f"[TRAFFIC LIGHT] ❌ Ошибка отправки уведомлений: {e}")
+            notify_donors(f"[TRAFFIC LIGHT] 📤 Уведомления отправлены донорам ({blood_type})")
         else:
             # Запрос уже существует
             if active_request['urgency'] != 'needed':
@@ -1543,13 +1848,7 @@ def update_blood_needs(mc_id):
             print(f"[TRAFFIC LIGHT] 🟠 Статус URGENT → Создан запрос ID {request_id} для {blood_type}")
             
             # 3. Отправляем СРОЧНЫЕ уведомления
-            if mc:
-                try:
-                    from telegram_bot import send_blood_status_notification
-                    send_blood_status_notification(blood_type, 'urgent', mc['name'], medical_center_id=mc_id)
-                    print(f"[TRAFFIC LIGHT] 📤 СРОЧНЫЕ уведомления отправлены донорам ({blood_type})")
-                except Exception as e:
-                    logger.error(f"[TRAFFIC LIGHT] ❌ Ошибка отправки уведомлений: {e}")
+            notify_donors(f"[TRAFFIC LIGHT] 📤 СРОЧНЫЕ уведомления отправлены донорам ({blood_type})")
         else:
             # Запрос существует - повышаем срочность
             if active_request['urgency'] != 'urgent':
@@ -1560,13 +1859,7 @@ def update_blood_needs(mc_id):
                 print(f"[TRAFFIC LIGHT] 🟠 Статус URGENT → Повышена срочность запроса ID {active_request['id']}")
                 
                 # Отправляем дополнительные уведомления при повышении срочности
-                if mc:
-                    try:
-                        from telegram_bot import send_blood_status_notification
-                        send_blood_status_notification(blood_type, 'urgent', mc['name'], medical_center_id=mc_id)
-                        print(f"[TRAFFIC LIGHT] 📤 Дополнительные СРОЧНЫЕ уведомления отправлены")
-                    except Exception as e:
-                        logger.error(f"[TRAFFIC LIGHT] ❌ Ошибка отправки уведомлений: {e}")
+                notify_donors(f"[TRAFFIC LIGHT] 📤 Дополнительные СРОЧНЫЕ уведомления отправлены")
             else:
                 print(f"[TRAFFIC LIGHT] 🟠 Статус URGENT → Запрос ID {active_request['id']} уже срочный")
     
@@ -1597,13 +1890,7 @@ def update_blood_needs(mc_id):
             print(f"[TRAFFIC LIGHT] 🔴 Статус CRITICAL → Создан КРИТИЧЕСКИЙ запрос ID {request_id} для {blood_type}")
             
             # 3. Отправляем КРИТИЧЕСКИЕ уведомления ВСЕМ
-            if mc:
-                try:
-                    from telegram_bot import send_blood_status_notification
-                    send_blood_status_notification(blood_type, 'critical', mc['name'], medical_center_id=mc_id)
-                    print(f"[TRAFFIC LIGHT] 📤 КРИТИЧЕСКИЕ уведомления отправлены ВСЕМ донорам ({blood_type})")
-                except Exception as e:
-                    logger.error(f"[TRAFFIC LIGHT] ❌ Ошибка отправки уведомлений: {e}")
+            notify_donors(f"[TRAFFIC LIGHT] 📤 КРИТИЧЕСКИЕ уведомления отправлены ВСЕМ донорам ({blood_type})")
         else:
             # Запрос существует - повышаем до критического
             if active_request['urgency'] != 'critical':
@@ -1614,30 +1901,64 @@ def update_blood_needs(mc_id):
                 print(f"[TRAFFIC LIGHT] 🔴 Статус CRITICAL → Повышена срочность запроса ID {active_request['id']} до КРИТИЧЕСКОЙ")
                 
                 # Отправляем дополнительные КРИТИЧЕСКИЕ уведомления
-                if mc:
-                    try:
-                        from telegram_bot import send_blood_status_notification
-                        send_blood_status_notification(blood_type, 'critical', mc['name'], medical_center_id=mc_id)
-                        print(f"[TRAFFIC LIGHT] 📤 Дополнительные КРИТИЧЕСКИЕ уведомления отправлены")
-                    except Exception as e:
-                        logger.error(f"[TRAFFIC LIGHT] ❌ Ошибка отправки уведомлений: {e}")
+                notify_donors(f"[TRAFFIC LIGHT] 📤 Дополнительные КРИТИЧЕСКИЕ уведомления отправлены")
             else:
                 print(f"[TRAFFIC LIGHT] 🔴 Статус CRITICAL → Запрос ID {active_request['id']} уже критический")
     
     return jsonify({'message': 'Статус обновлён', 'blood_type': blood_type, 'status': status})
 
+PUBLIC_BLOOD_NEEDS_QUERY = """
+    SELECT mc.id as medical_center_id, mc.name as medical_center_name,
+           bn.blood_type, bn.status, bn.last_updated
+    FROM blood_needs bn
+    JOIN medical_centers mc ON bn.medical_center_id = mc.id
+    WHERE mc.is_blood_center = TRUE AND mc.is_active = TRUE
+    ORDER BY mc.name, bn.blood_type
+"""
+
 @app.route('/api/blood-needs/public', methods=['GET'])
 def get_public_blood_needs():
-    """Публичный статус крови для главной страницы"""
-    needs = query_db(
-        """SELECT mc.id as medical_center_id, mc.name as medical_center_name,
-                  bn.blood_type, bn.status, bn.last_updated
-           FROM blood_needs bn
-           JOIN medical_centers mc ON bn.medical_center_id = mc.id
-           WHERE mc.is_blood_center = TRUE AND mc.is_active = TRUE
-           ORDER BY mc.name, bn.blood_type"""
-    )
-    return jsonify(needs)
+    """
+    Публичный статус крови для главной страницы
+    
+    В продакшене nginx отдаёт статический снимок (static_snapshots.py),
+    сюда запрос доходит, только если снимка ещё нет
+    """
+    return stream_json(PUBLIC_BLOOD_NEEDS_QUERY)
+
+# ============================================
+# Статические снимки публичных данных
+# ============================================
+
+def public_blood_needs_snapshot():
+    rows = database.query_db(PUBLIC_BLOOD_NEEDS_QUERY)
+    return encode_row([dict(row) for row in rows]).encode('utf-8')
+
+def regions_snapshot():
+    REFERENCE_DATA.ensure_loaded(encode=encode_row)
+    return REFERENCE_DATA.body('regions')
+
+def medcenters_json_snapshot():
+    """website/data/medcenters.json (build_medical_json.py) без отступов"""
+    with open(MEDCENTERS_JSON, encoding='utf-8') as f:
+        data = json.load(f)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+SNAPSHOTS.register('blood-needs-public', public_blood_needs_snapshot)
+SNAPSHOTS.register('regions', regions_snapshot)
+# Пересобирается при изменении mtime medcenters.json (как NEARBY и SEARCH)
+SNAPSHOTS.register('medcenters', medcenters_json_snapshot, watch_path=MEDCENTERS_JSON)
+
+# Светофор и медцентры меняются -> CENTER_NEEDS.invalidate -> пересборка снимка
+CENTER_NEEDS.on_invalidate.append(lambda mc_id: SNAPSHOTS.mark_dirty('blood-needs-public'))
+REFERENCE_DATA.on_reload.append(lambda: SNAPSHOTS.mark_dirty('regions'))
+
+@app.route('/api/snapshots/manifest', methods=['GET'])
+def get_snapshots_manifest():
+    """Текущие хэши статических снимков из общего manifest.json (клиент сравнивает со своей версией)"""
+    response = jsonify(SNAPSHOTS.manifest())
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 # ============================================
 # API: Запросы на донацию
@@ -1679,8 +2000,7 @@ def get_requests():
     
     query += " ORDER BY dr.created_at DESC"
     
-    reqs = query_db(query, tuple(params))
-    return jsonify(reqs)
+    return stream_json(query, tuple(params))
 
 @app.route('/api/requests', methods=['POST'])
 @require_auth('medcenter')
@@ -1808,8 +2128,7 @@ def get_blood_requests():
     
     query += " ORDER BY created_at DESC"
     
-    requests_list = query_db(query, tuple(params))
-    return jsonify(requests_list or [])
+    return stream_json(query, tuple(params))
 
 @app.route('/api/blood-requests', methods=['POST'])
 @require_auth('medcenter')
@@ -1859,6 +2178,7 @@ def create_blood_request():
                DO UPDATE SET status = %s, last_updated = NOW()""",
             (mc_id, data['blood_type'], status_to_set, status_to_set), commit=True
         )
+        CENTER_NEEDS.invalidate(mc_id)
     
     # Отправляем уведомления для ВСЕХ запросов (не только urgent)
     mc = query_db("SELECT name, address FROM medical_centers WHERE id = %s", (mc_id,), one=True)
@@ -2104,6 +2424,7 @@ def create_response():
 
 @app.route('/api/medical-center/donations', methods=['POST'])
 @require_auth('medcenter')
+@unit_of_work
 def record_donation():
     """Записать успешную донацию"""
     from datetime import date
@@ -2167,6 +2488,7 @@ def record_donation():
 
 @app.route('/api/responses/<int:response_id>', methods=['PUT'])
 @require_auth('medcenter')
+@unit_of_work
 def update_response(response_id):
     resp = query_db("SELECT * FROM donation_responses WHERE id = %s", (response_id,), one=True)
     
@@ -2297,16 +2619,12 @@ def update_response(response_id):
             
             if not conversation:
                 app.logger.info(f"Создание нового диалога: donor_id={resp['user_id']}, medical_center_id={resp['medical_center_id']}")
-                query_db(
+                conversation = query_db(
                     """INSERT INTO conversations 
                        (donor_id, medical_center_id, status, created_at, updated_at)
-                       VALUES (%s, %s, 'active', NOW(), NOW())""",
-                    (resp['user_id'], resp['medical_center_id']), commit=True
-                )
-                conversation = query_db(
-                    """SELECT * FROM conversations 
-                       WHERE donor_id = %s AND medical_center_id = %s""",
-                    (resp['user_id'], resp['medical_center_id']), one=True
+                       VALUES (%s, %s, 'active', NOW(), NOW())
+                       RETURNING *""",
+                    (resp['user_id'], resp['medical_center_id']), commit=True, one=True
                 )
                 app.logger.info(f"✅ Диалог создан: conversation_id={conversation['id']}")
             
@@ -2351,8 +2669,7 @@ def update_response(response_id):
             )
             
             if donor_telegram and donor_telegram.get('telegram_id'):
-                try:
-                    telegram_text = f"""✅ <b>Ваша заявка на донацию одобрена!</b>
+                telegram_text = f"""✅ <b>Ваша заявка на донацию одобрена!</b>
 
 📅 {donation_date}, {donation_time}
 🏥 {medical_center['name']}
@@ -2361,12 +2678,14 @@ def update_response(response_id):
 ⚠️ <b>Важно:</b> За 48 часов исключите алкоголь и жирную пищу.
 
 📋 Полные правила подготовки на платформе"""
-                    
+                
+                def notify_donor():
                     send_telegram_message(donor_telegram['telegram_id'], telegram_text, 
                                          with_miniapp_button=True, button_text="📋 Подробнее")
                     app.logger.info(f"✅ Telegram отправлен донору {donor['id']}")
-                except Exception as e:
-                    app.logger.error(f"❌ Ошибка отправки в Telegram: {e}")
+                
+                # Отправляем только после COMMIT
+                after_commit(notify_donor)
         
         # АВТОЗАКРЫТИЕ: проверяем, достигнут ли лимит
         blood_request = query_db(
@@ -2519,8 +2838,7 @@ def get_medcenter_donors():
     
     query += " ORDER BY full_name"
     
-    donors = query_db(query, tuple(params))
-    return jsonify(donors if donors else [])
+    return stream_json(query, tuple(params))
 
 
 @app.route('/api/donor/<int:donor_id>', methods=['GET'])
@@ -2933,6 +3251,9 @@ def unlink_telegram():
         "UPDATE users SET telegram_id = NULL, telegram_username = NULL WHERE id = %s",
         (donor_id,), commit=True
     )
+    TELEGRAM_ACCOUNTS.invalidate(user_id=donor_id)
+    # Остальные процессы API сбросят запись по NOTIFY
+    query_db(ACCOUNT_NOTIFY_SQL, (account_payload(user_id=donor_id),), commit=True)
     
     return jsonify({'message': 'Telegram отвязан'})
 
@@ -3828,47 +4149,18 @@ def get_unread_count():
 
 @app.route('/api/medical-centers', methods=['GET'])
 def get_medical_centers_with_needs():
-    """Получить список медцентров с данными о потребности в крови"""
-    district_id = request.args.get('district_id', type=int)
-    
-    # Базовый запрос
-    query = """
-        SELECT 
-            mc.id,
-            mc.name,
-            mc.address,
-            mc.phone,
-            mc.email,
-            mc.district_id,
-            d.name as district_name,
-            r.name as region_name
-        FROM medical_centers mc
-        LEFT JOIN districts d ON mc.district_id = d.id
-        LEFT JOIN regions r ON d.region_id = r.id
-        WHERE mc.is_active = TRUE
     """
+    Получить список медцентров с данными о потребности в крови
     
-    params = []
-    if district_id:
-        query += " AND mc.district_id = %s"
-        params.append(district_id)
-    
-    query += " ORDER BY mc.name"
-    
-    centers = query_db(query, tuple(params) if params else ())
-    
-    # Для каждого медцентра получаем данные о потребности в крови
-    for center in centers:
-        blood_needs = query_db(
-            """SELECT blood_type, status, last_updated 
-               FROM blood_needs 
-               WHERE medical_center_id = %s
-               ORDER BY blood_type""",
-            (center['id'],)
-        )
-        center['blood_needs'] = blood_needs or []
-    
-    return jsonify(centers or [])
+    Один запрос с JOIN blood_needs и кэш по району (center_needs.py).
+    Кэш заполняется с основного сервера: запись с отстающей реплики
+    отдавалась бы после invalidate до истечения TTL.
+    """
+    district_id = request.args.get('district_id', type=int)
+    body = CENTER_NEEDS.get_json(district_id, database.query_db)
+    return Response(body, mimetype='application/json')
+
+CENTER_NEEDS.encode = encode_row
 
 # ============================================
 # Выход
@@ -3878,7 +4170,10 @@ def get_medical_centers_with_needs():
 def logout():
     token = request.headers.get('Authorization', '').replace('Bearer ', '')
     if token:
-        query_db("UPDATE user_sessions SET is_active = FALSE WHERE session_token = %s", (token,), commit=True)
+        revoked = query_db(revoke_sessions_query("session_token = %s"), (token,), commit=True)
+        for row in revoked or []:
+            REVOCATIONS.revoke_session(row['id'])
+        forget_session_token(token)
     return jsonify({'message': 'Выход выполнен'})
 
 # ============================================
@@ -3887,6 +4182,7 @@ def logout():
 
 @app.route('/api/health', methods=['GET'])
 def health():
+    """Публичная проверка: только доступность API и БД"""
     try:
         query_db("SELECT 1", one=True)
         db_status = 'ok'
@@ -3895,6 +4191,43 @@ def health():
     
     return jsonify({'status': 'ok', 'database': db_status})
 
+@app.route('/api/debug/health', methods=['GET'])
+def debug_health():
+    """Внутренняя статистика воркера: пулы, реплика, кэши, отзывы сессий, лимиты"""
+    if request.headers.get('X-Admin-Secret') != os.getenv('SECRET_KEY', 'default-secret'):
+        return jsonify({'error': 'Неавторизованный доступ'}), 401
+    
+    return jsonify({
+        'pool': DB_POOL.stats(),
+        'service_pool': get_service_pool().stats(),
+        'replica': REPLICA.stats() if REPLICA else None,
+        'prepared_statements': PREPARED.stats(),
+        'auth_cache': [cache.stats() for cache in (ACCESS_TOKENS, LEGACY_SESSIONS, UNKNOWN_TOKENS)],
+        'sessions': dict(SESSIONS.stats(), refresh=REFRESH_STATS, compaction=SESSION_COMPACTOR.stats()),
+        'revocations': REVOCATIONS.stats(),
+        'passwords': PASSWORDS.stats(),
+        'rate_limit': RATE_LIMITER.stats(),
+        'telegram_auth': [INIT_DATA.stats(), TELEGRAM_ACCOUNTS.stats()],
+        'reference_data': REFERENCE_DATA.stats(),
+        'medcenters': MEDCENTERS.stats(),
+        'center_needs': CENTER_NEEDS.stats(),
+        'snapshots': SNAPSHOTS.stats(),
+        'nearby': NEARBY.stats(),
+        'search': SEARCH.stats()
+    })
+
+@app.route('/api/debug/queries', methods=['GET'])
+def debug_queries():
+    """Сводка по SQL-запросам воркера: N+1, бюджеты, тяжёлые запросы"""
+    if request.headers.get('X-Admin-Secret') != os.getenv('SECRET_KEY', 'default-secret'):
+        return jsonify({'error': 'Неавторизованный доступ'}), 401
+    
+    report = QUERY_STATS.report(top=request.args.get('top', 20, type=int))
+    report['slow_queries'] = SLOW_QUERIES.stats()
+    if request.args.get('reset') == 'true':
+        QUERY_STATS.reset()
+    return jsonify(report)
+
 # ============================================
 # API: Учёт донаций медцентром
 # ============================================
@@ -4244,7 +4577,7 @@ def get_conversations():
                          WHERE cm.conversation_id = c.id AND cm.deleted_at IS NULL 
                          ORDER BY cm.created_at DESC LIMIT 1) DESC NULLS LAST
                LIMIT %s OFFSET %s""",
-            (user_id, status, limit, offset)
+            (user_id, status, limit, offset), compact=True
         )
         
         result = []
@@ -4286,7 +4619,7 @@ def get_conversations():
                          WHERE cm.conversation_id = c.id AND cm.deleted_at IS NULL 
                          ORDER BY cm.created_at DESC LIMIT 1) DESC NULLS LAST
                LIMIT %s OFFSET %s""",
-            (medical_center_id, status, limit, offset)
+            (medical_center_id, status, limit, offset), compact=True
         )
         
         app.logger.info(f"📊 Найдено диалогов: {len(conversations) if conversations else 0}")
@@ -4499,7 +4832,7 @@ def get_conversation_messages(conversation_id):
                  AND id < %s
                ORDER BY created_at DESC 
                LIMIT %s""",
-            (conversation_id, before_id, limit)
+            (conversation_id, before_id, limit), compact=True
         )
     else:
         messages = query_db(
@@ -4507,7 +4840,7 @@ def get_conversation_messages(conversation_id):
                WHERE conversation_id = %s 
                ORDER BY created_at DESC 
                LIMIT %s""",
-            (conversation_id, limit)
+            (conversation_id, limit), compact=True
         )
     
     result = [format_message(msg) for msg in messages]
@@ -4518,6 +4851,7 @@ def get_conversation_messages(conversation_id):
 
 @app.route('/api/messages/conversations/<int:conversation_id>/messages', methods=['POST'])
 @require_auth()
+@unit_of_work
 def send_conversation_message(conversation_id):
     """Отправить сообщение"""
     data = request.json
@@ -4553,12 +4887,13 @@ def send_conversation_message(conversation_id):
         return jsonify({'error': 'Диалог не найден'}), 404
     
     # Вставляем в chat_messages, а не в messages
-    query_db(
+    message = query_db(
         """INSERT INTO chat_messages 
            (conversation_id, sender_id, sender_type, message_text, message_type, created_at)
-           VALUES (%s, %s, %s, %s, %s, NOW())""",
+           VALUES (%s, %s, %s, %s, %s, NOW())
+           RETURNING *""",
         (conversation_id, sender_id, sender_type, content, message_type),
-        commit=True
+        commit=True, one=True
     )
     
     # 🔔 УВЕЛИЧИВАЕМ СЧЁТЧИК НЕПРОЧИТАННЫХ для получателя!
@@ -4583,14 +4918,6 @@ def send_conversation_message(conversation_id):
         )
         app.logger.info(f"📬 Увеличен donor_unread_count для диалога {conversation_id}")
     
-    message = query_db(
-        """SELECT * FROM chat_messages 
-           WHERE conversation_id = %s 
-           ORDER BY created_at DESC 
-           LIMIT 1""",
-        (conversation_id,), one=True
-    )
-    
     app.logger.info(f"✅ Сообщение отправлено: {sender_type} -> conversation {conversation_id}")
     
     # Отправка в Telegram если сообщение от медцентра донору
@@ -4605,29 +4932,30 @@ def send_conversation_message(conversation_id):
         )
         
         if donor and donor.get('telegram_id'):
-            try:
-                # Получаем название медцентра
-                mc = query_db(
-                    """SELECT mc.name 
-                       FROM medical_centers mc
-                       JOIN conversations c ON mc.id = c.medical_center_id
-                       WHERE c.id = %s""",
-                    (conversation_id,), one=True
-                )
-                
-                mc_name = mc['name'] if mc else 'Медицинский центр'
-                
-                # Формируем сообщение для Telegram
-                preview = content[:150] + '...' if len(content) > 150 else content
-                telegram_text = f"""💬 <b>Новое сообщение от {mc_name}</b>
+            # Получаем название медцентра
+            mc = query_db(
+                """SELECT mc.name 
+                   FROM medical_centers mc
+                   JOIN conversations c ON mc.id = c.medical_center_id
+                   WHERE c.id = %s""",
+                (conversation_id,), one=True
+            )
+            
+            mc_name = mc['name'] if mc else 'Медицинский центр'
+            
+            # Формируем сообщение для Telegram
+            preview = content[:150] + '...' if len(content) > 150 else content
+            telegram_text = f"""💬 <b>Новое сообщение от {mc_name}</b>
 
 <i>{preview}</i>"""
-                
+            
+            def notify_donor():
                 send_telegram_message(donor['telegram_id'], telegram_text,
                                      with_miniapp_button=True, button_text="💬 Ответить")
                 app.logger.info(f"📱 Telegram отправлен донору {donor['full_name']}")
-            except Exception as e:
-                app.logger.error(f"❌ Ошибка отправки в Telegram: {e}")
+            
+            # Отправляем только после COMMIT
+            after_commit(notify_donor)
     
     return jsonify(format_message(message)), 201
 
@@ -4884,6 +5212,7 @@ def create_message_template():
 # ============================================
 
 @app.route('/api/auth/refresh', methods=['POST'])
+@RATE_LIMITER.limit('auth_refresh', ip='60/60/20', account=('10/60', refresh_token_key))
 def auth_refresh():
     """
     Обновление access token через refresh token из cookie
@@ -4911,8 +5240,8 @@ def auth_refresh():
     
     print(f"[AUTH REFRESH] ✅ refresh_token найден (длина: {len(refresh_token)})")
     
-    # Проверяем и ротируем токен
-    new_access, new_refresh = rotate_refresh_token(query_db, refresh_token)
+    # Проверяем и ротируем токен (сессия возвращается тем же запросом)
+    new_access, new_refresh, session = rotate_refresh_session(query_db, refresh_token)
     
     if not new_access:
         response = make_response(jsonify({
@@ -4923,11 +5252,6 @@ def auth_refresh():
         return response
     
     # Получаем данные пользователя
-    token_hash = hash_token(new_refresh)
-    session = query_db(
-        "SELECT * FROM user_sessions WHERE refresh_token_hash = %s",
-        (token_hash,), one=True
-    )
     
     user_data = None
     if session:
@@ -4978,6 +5302,10 @@ def auth_logout():
     if refresh_token:
         invalidate_session(query_db, refresh_token)
     
+    access_token = request.headers.get('Authorization', '').replace('Bearer ', '')
+    if access_token:
+        forget_session_token(access_token)
+    
     response = make_response(jsonify({'message': 'Выход выполнен'}))
     clear_refresh_cookie(response)
     
@@ -5024,7 +5352,7 @@ def auth_check():
     
     if refresh_token:
         # Проверяем токен в БД
-        session = verify_refresh_token(refresh_token, query_db)
+        session = verify_refresh_token(refresh_token, query_primary)
         if session:
             result['is_authenticated'] = True
             result['session'] = {
@@ -5072,56 +5400,16 @@ def validate_telegram_init_data(init_data, bot_token):
     """
     Валидация Telegram initData с проверкой HMAC-SHA256 подписи
     https://core.telegram.org/bots/webapps#validating-data-received-via-the-mini-app
-    """
-    import hmac
-    import hashlib
-    import urllib.parse
     
-    try:
-        # Парсим initData
-        parsed = dict(urllib.parse.parse_qsl(init_data))
-        received_hash = parsed.pop('hash', None)
-        
-        if not received_hash:
-            return False, "hash не найден в initData"
-        
-        # Сортируем параметры и создаём data_check_string
-        sorted_params = sorted(parsed.items())
-        data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted_params)
-        
-        # Создаём secret_key: HMAC-SHA256("WebAppData", bot_token)
-        secret_key = hmac.new(
-            b"WebAppData", 
-            bot_token.encode(), 
-            hashlib.sha256
-        ).digest()
-        
-        # Вычисляем ожидаемый hash: HMAC-SHA256(data_check_string, secret_key)
-        expected_hash = hmac.new(
-            secret_key, 
-            data_check_string.encode(), 
-            hashlib.sha256
-        ).hexdigest()
-        
-        # Сравниваем
-        if not hmac.compare_digest(expected_hash, received_hash):
-            return False, "Неверная подпись initData"
-        
-        # Проверяем auth_date (не старше 5 минут)
-        auth_date = int(parsed.get('auth_date', 0))
-        import time
-        if time.time() - auth_date > 300:  # 5 минут
-            # Временно отключаем для тестирования
-            print(f"[TELEGRAM AUTH] ⚠️ initData старше 5 минут (auth_date={auth_date})")
-            # return False, "initData устарел (>5 минут)"
-        
-        return True, parsed
-        
-    except Exception as e:
-        return False, f"Ошибка валидации: {str(e)}"
+    secret_key считается один раз, проверенный initData кэшируется
+    до истечения окна auth_date (TELEGRAM_INIT_DATA_MAX_AGE)
+    """
+    return INIT_DATA.validate(init_data, bot_token)
 
 
 @app.route('/api/auth/telegram', methods=['POST'])
+@RATE_LIMITER.limit('auth_telegram', ip='30/60/15',
+                    account=('10/60', lambda: request_field('telegram_id', 'init_data')))
 def auth_telegram():
     """
     Автоматическая авторизация через Telegram
@@ -5143,7 +5431,14 @@ def auth_telegram():
     # Если telegram_id не передан напрямую, парсим из initData
     if not telegram_id and init_data:
         try:
-            parsed = dict(urllib.parse.parse_qsl(init_data))
+            if TELEGRAM_BOT_TOKEN:
+                # Подпись проверяется, повторный initData берётся из кэша
+                valid, parsed = validate_telegram_init_data(init_data, TELEGRAM_BOT_TOKEN)
+                if not valid:
+                    print(f"[TELEGRAM AUTH] ❌ initData отклонён: {parsed}")
+                    return jsonify({'error': 'Недействительный initData'}), 401
+            else:
+                parsed = dict(urllib.parse.parse_qsl(init_data))
             user_data_str = parsed.get('user', '{}')
             user_data = json.loads(user_data_str) if user_data_str else {}
             telegram_id = user_data.get('id')
@@ -5167,11 +5462,8 @@ def auth_telegram():
     
     print(f"[TELEGRAM AUTH] 🔍 Ищем пользователя с telegram_id={telegram_id}")
     
-    # Ищем пользователя по telegram_id
-    user = query_db(
-        "SELECT id, full_name, blood_type FROM users WHERE telegram_id = %s AND is_active = TRUE",
-        (telegram_id,), one=True
-    )
+    # Ищем пользователя по telegram_id (кэш привязок, затем основной сервер - привязка могла не дойти до реплики)
+    user = TELEGRAM_ACCOUNTS.lookup(telegram_id, query_primary)
     
     if user:
         print(f"[TELEGRAM AUTH] ✅ Найден донор: {user['full_name']}")
@@ -5209,6 +5501,7 @@ def auth_telegram():
 
 
 @app.route('/api/auth/refresh-telegram', methods=['POST'])
+@RATE_LIMITER.limit('auth_refresh', ip='60/60/20', account=('10/60', refresh_token_key))
 def auth_refresh_telegram():
     """
     Обновление токена для Telegram Mini App
@@ -5222,19 +5515,14 @@ def auth_refresh_telegram():
     
     print(f"[TELEGRAM REFRESH] 🔄 Обновление токена")
     
-    # Проверяем и ротируем токен
-    new_access, new_refresh = rotate_refresh_token(query_db, refresh_token)
+    # Проверяем и ротируем токен (сессия возвращается тем же запросом)
+    new_access, new_refresh, session = rotate_refresh_session(query_db, refresh_token)
     
     if not new_access:
         print(f"[TELEGRAM REFRESH] ❌ Токен невалиден или истёк")
         return jsonify({'error': 'Сессия истекла'}), 401
     
     # Получаем данные пользователя
-    token_hash = hash_token(new_refresh)
-    session = query_db(
-        "SELECT * FROM user_sessions WHERE refresh_token_hash = %s",
-        (token_hash,), one=True
-    )
     
     user_data = None
     if session:
@@ -5270,6 +5558,32 @@ def auth_refresh_telegram():
     })
 
 
+# ============================================
+# Фоновые службы процесса
+# ============================================
+
+def start_background_services():
+    """
+    Запуск при инициализации приложения (python app.py и WSGI-сервер),
+    а не по первому запросу
+    """
+    # Процессы хэширования паролей - первыми, пока в процессе нет других потоков
+    PASSWORDS.start()
+    # Статические снимки для nginx: первая публикация и слежение за medcenters.json
+    # (в фоне; файл пишется, только если содержимое изменилось)
+    SNAPSHOTS.mark_dirty()
+    # Без миграции revoked_at - понятная ошибка в логе сразу при старте
+    try:
+        REVOCATIONS.revoked_at_available()
+    except Exception as e:
+        print(f"⚠️ Не удалось проверить user_sessions.revoked_at: {e}")
+    # Очистка истёкших сессий по расписанию (advisory lock - одна очистка на все процессы)
+    SESSION_COMPACTOR.ensure_started()
+    # Сброс кэша telegram_id -> донор при привязке в процессе бота
+    TELEGRAM_ACCOUNTS.start_listener()
+
+start_background_services()
+
 # ============================================
 # Запуск сервера
 # ============================================
@@ -5285,4 +5599,16 @@ if __name__ == '__main__':
     print(f"БД: {DB_CONFIG['database']}")
     print("=" * 50)
     
+    # Справочник регионов - до первого запроса; без БД загрузится при первом обращении
+    try:
+        REFERENCE_DATA.ensure_loaded(encode=encode_row)
+    except Exception as e:
+        print(f"⚠️ Справочник регионов не загружен: {e}")
+    
+    # Индекс ближайших медучреждений (medcenters.json)
+    try:
+        NEARBY.ensure_loaded()
+    except (OSError, ValueError) as e:
+        print(f"⚠️ Индекс медучреждений не построен: {e}")
+    
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -11,12 +11,19 @@ JWT + Refresh Token система авторизации
 
 import os
 import jwt
+import time
 import secrets
+import threading
 import hashlib
 from datetime import datetime, timedelta
 from functools import wraps
 from flask import request, jsonify, g, make_response
 
+from token_cache import TokenCache
+from session_store import SESSIONS
+from revocation import RevocationFilter
+from session_compaction import SessionCompactor
+
 # ============================================
 # Конфигурация
 # ============================================
@@ -47,6 +54,31 @@ COOKIE_SECURE = IS_PRODUCTION  # Secure только для HTTPS
 # - 'Strict': максимальная безопасность, но ломает cross-site
 COOKIE_SAMESITE = 'None' if IS_PRODUCTION else 'Lax'  # None для cross-origin в production
 
+# Сколько проверенных access token держать в памяти воркера (0 - без кэша)
+ACCESS_TOKEN_CACHE_SIZE = int(os.getenv('ACCESS_TOKEN_CACHE_SIZE', 10000))
+
+ACCESS_TOKENS = TokenCache(ACCESS_TOKEN_CACHE_SIZE, name='access_tokens')
+
+# Legacy session_token: найденные сессии живут в кэше до expires_at,
+# но не дольше LEGACY_SESSION_CACHE_MAX_TTL (другие воркеры не видят logout);
+# неизвестные токены - LEGACY_SESSION_NEGATIVE_TTL секунд
+LEGACY_SESSION_CACHE_SIZE = int(os.getenv('LEGACY_SESSION_CACHE_SIZE', 10000))
+LEGACY_SESSION_CACHE_MAX_TTL = int(os.getenv('LEGACY_SESSION_CACHE_MAX_TTL', 300))
+LEGACY_SESSION_NEGATIVE_TTL = int(os.getenv('LEGACY_SESSION_NEGATIVE_TTL', 30))
+
+LEGACY_SESSIONS = TokenCache(LEGACY_SESSION_CACHE_SIZE, name='legacy_sessions')
+UNKNOWN_TOKENS = TokenCache(LEGACY_SESSION_CACHE_SIZE, name='unknown_tokens')
+
+# Сколько секунд одновременные refresh с тем же токеном (несколько вкладок,
+# Mini App) получают результат уже выполненной ротации вместо 401
+REFRESH_GRACE_SECONDS = float(os.getenv('REFRESH_GRACE_SECONDS', 10))
+
+# Отозванные сессии и пользователи (logout / logout-all) для проверки JWT без БД
+REVOCATIONS = RevocationFilter(ttl=ACCESS_TOKEN_EXPIRES.total_seconds())
+
+# Фоновая очистка user_sessions (отозванные храним столько же, сколько фильтр)
+SESSION_COMPACTOR = SessionCompactor(retention=ACCESS_TOKEN_EXPIRES.total_seconds())
+
 
 # ============================================
 # Генерация токенов
@@ -66,7 +98,8 @@ def generate_access_token(user_id, user_type, extra_claims=None):
     payload = {
         'sub': str(user_id),           # Subject (ID)
         'type': user_type,              # Тип пользователя
-        'iat': now,                     # Issued At
+        # Issued At с миллисекундами: logout-all отзывает токены той же секунды (revocation.py)
+        'iat': round(time.time(), 3),
         'exp': now + ACCESS_TOKEN_EXPIRES,  # Expiration
         'jti': secrets.token_hex(16)    # JWT ID (уникальный идентификатор)
     }
@@ -116,6 +149,94 @@ def verify_access_token(token):
         return None  # Невалидный токен
 
 
+def session_from_payload(payload):
+    """Сессия для g.session из payload access token"""
+    user_type = payload.get('type')
+    return {
+        'user_type': user_type,
+        'user_id': int(payload['sub']) if user_type == 'donor' else None,
+        'medical_center_id': int(payload['sub']) if user_type == 'medcenter' else None,
+        'session_id': payload.get('sid')
+    }
+
+
+def get_access_session(token):
+    """
+    Сессия по JWT access token с кэшем проверенных токенов
+    
+    Подпись и claims проверяются один раз, дальше до exp токена
+    сессия берётся из ACCESS_TOKENS. Отзыв (logout, logout-all)
+    проверяется по REVOCATIONS в памяти - без запроса к БД.
+    
+    @param token: JWT строка
+    @return: Копия сессии или None
+    """
+    cached = ACCESS_TOKENS.get(token)
+    if cached is None:
+        payload = verify_access_token(token)
+        if not payload:
+            return None
+        session = session_from_payload(payload)
+        cached = (session, (session['user_type'], int(payload['sub'])), payload.get('iat'))
+        ACCESS_TOKENS.put(token, cached, payload['exp'], subject=cached[1])
+    
+    session, subject, issued_at = cached
+    if REVOCATIONS.is_revoked(subject, session['session_id'], issued_at):
+        ACCESS_TOKENS.discard(token)
+        return None
+    return dict(session)
+
+
+def session_subject(session):
+    """Владелец сессии для кэшей: ('donor', user_id) | ('medcenter', medical_center_id)"""
+    if session.get('user_type') == 'donor':
+        return ('donor', session.get('user_id'))
+    return (session.get('user_type'), session.get('medical_center_id'))
+
+
+def get_legacy_session(token, query_db_func):
+    """
+    Сессия по legacy session_token с двусторонним кэшем
+    
+    Найденная сессия кэшируется до expires_at, отсутствующая
+    (мусорный или истёкший токен) - на LEGACY_SESSION_NEGATIVE_TTL,
+    так что повторы одного и того же токена не доходят до БД.
+    
+    @param query_db_func: Функция запросов к основному серверу - промах
+                          на отстающей реплике закэшировался бы как мусорный токен
+    @return: Копия строки user_sessions или None
+    """
+    session = LEGACY_SESSIONS.get(token)
+    if session is not None:
+        if REVOCATIONS.is_session_revoked(session['id']):
+            LEGACY_SESSIONS.discard(token)
+            return None
+        return dict(session)
+    if UNKNOWN_TOKENS.get(token):
+        return None
+    
+    session = query_db_func(
+        """SELECT * FROM user_sessions 
+           WHERE session_token = %s AND is_active = TRUE AND expires_at > NOW()""",
+        (token,), one=True
+    )
+    
+    now = time.time()
+    if not session:
+        UNKNOWN_TOKENS.put(token, True, now + LEGACY_SESSION_NEGATIVE_TTL)
+        return None
+    
+    expires_at = min(session['expires_at'].timestamp(), now + LEGACY_SESSION_CACHE_MAX_TTL)
+    LEGACY_SESSIONS.put(token, dict(session), expires_at, subject=session_subject(session))
+    return dict(session)
+
+
+def forget_session_token(token):
+    """Убрать токен из кэшей авторизации (logout)"""
+    ACCESS_TOKENS.discard(token)
+    LEGACY_SESSIONS.discard(token)
+
+
 def verify_refresh_token(token, query_db_func):
     """
     Проверка refresh token в БД
@@ -149,79 +270,136 @@ def create_session(query_db_func, user_id=None, medical_center_id=None,
     
     @return: (access_token, refresh_token, session_id)
     """
-    # Генерируем токены
-    entity_id = user_id if user_type == 'donor' else medical_center_id
-    access_token = generate_access_token(entity_id, user_type)
     refresh_token = generate_refresh_token()
     refresh_hash = hash_token(refresh_token)
     
     expires_at = datetime.utcnow() + REFRESH_TOKEN_EXPIRES
     
-    # Сохраняем в БД
-    query_db_func(
-        """INSERT INTO user_sessions 
-           (user_id, medical_center_id, refresh_token_hash, user_type, 
-            device_info, ip_address, platform, expires_at, last_used_at, is_active)
-           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), TRUE)""",
-        (user_id, medical_center_id, refresh_hash, user_type,
-         device_info, ip_address, platform, expires_at),
-        commit=True
+    # Сохраняем в БД (INSERT ... RETURNING id - без повторного SELECT)
+    session = SESSIONS.create(
+        query_db_func, refresh_hash, user_type,
+        user_id=user_id, medical_center_id=medical_center_id,
+        device_info=device_info, ip_address=ip_address,
+        platform=platform, expires_at=expires_at
     )
+    session_id = session['id'] if session else None
     
-    # Получаем ID созданной сессии
-    session = query_db_func(
-        "SELECT id FROM user_sessions WHERE refresh_token_hash = %s",
-        (refresh_hash,), one=True
-    )
+    # ID сессии попадает в токен (sid): по нему require_auth отмечает last_used_at
+    entity_id = user_id if user_type == 'donor' else medical_center_id
+    access_token = generate_access_token(entity_id, user_type, {'sid': session_id})
     
-    return access_token, refresh_token, session['id'] if session else None
+    return access_token, refresh_token, session_id
 
 
-def rotate_refresh_token(query_db_func, old_token):
+_refresh_flights = {}     # hash старого токена -> ротация (выполняется или недавно выполнена)
+_refresh_lock = threading.Lock()
+REFRESH_STATS = {'rotations': 0, 'shared': 0}
+
+
+def rotate_refresh_session(query_db_func, old_token):
     """
     Ротация refresh token (создание нового при каждом использовании)
     
+    Single-flight: одновременные запросы с одним и тем же токеном
+    ждут первую ротацию и получают её результат; ещё REFRESH_GRACE_SECONDS
+    после неё повтор старого токена возвращает те же новые токены.
+    
     @param old_token: Текущий refresh token
-    @return: (new_access_token, new_refresh_token) или (None, None)
+    @return: (new_access_token, new_refresh_token, session) или (None, None, None)
     """
     old_hash = hash_token(old_token)
+    now = time.monotonic()
+    
+    with _refresh_lock:
+        for key in [k for k, f in _refresh_flights.items()
+                    if f['done_at'] is not None and now - f['done_at'] > REFRESH_GRACE_SECONDS]:
+            del _refresh_flights[key]
+        flight = _refresh_flights.get(old_hash)
+        leader = flight is None
+        if leader:
+            flight = _refresh_flights[old_hash] = {
+                'event': threading.Event(), 'result': None, 'done_at': None
+            }
+    
+    if not leader:
+        flight['event'].wait(REFRESH_GRACE_SECONDS)
+        if flight['result'] is not None:
+            REFRESH_STATS['shared'] += 1
+            return flight['result']
+        # Первая ротация не удалась - проверяем токен сами
+        return _rotate_refresh_session(query_db_func, old_hash)
+    
+    result = None
+    try:
+        result = _rotate_refresh_session(query_db_func, old_hash)
+        return result
+    finally:
+        with _refresh_lock:
+            if result is not None and result[0]:
+                flight['result'] = result
+                flight['done_at'] = time.monotonic()
+            else:
+                # Неудачи не запоминаем: токен и так недействителен
+                _refresh_flights.pop(old_hash, None)
+        flight['event'].set()
+
+
+def _drop_refresh_flights(match):
+    """
+    Забыть завершённые ротации, для которых match(old_hash, result) истинно
     
-    # Находим сессию
-    session = query_db_func(
-        """SELECT * FROM user_sessions 
-           WHERE refresh_token_hash = %s 
-             AND is_active = TRUE 
-             AND expires_at > NOW()""",
-        (old_hash,), one=True
+    @return: [(old_hash, result)] удалённых
+    """
+    dropped = []
+    with _refresh_lock:
+        for old_hash, flight in list(_refresh_flights.items()):
+            if flight['result'] is not None and match(old_hash, flight['result']):
+                del _refresh_flights[old_hash]
+                dropped.append((old_hash, flight['result']))
+    return dropped
+
+
+def _rotate_refresh_session(query_db_func, old_hash):
+    new_refresh_token = generate_refresh_token()
+    new_expires_at = datetime.utcnow() + REFRESH_TOKEN_EXPIRES
+    
+    # Поиск и обновление сессии одним запросом (token rotation)
+    session = SESSIONS.rotate(
+        query_db_func, old_hash, hash_token(new_refresh_token), new_expires_at
     )
     
     if not session:
-        return None, None
+        return None, None, None
     
-    # Генерируем новые токены
     user_type = session['user_type']
     entity_id = session['user_id'] if user_type == 'donor' else session['medical_center_id']
+    new_access_token = generate_access_token(entity_id, user_type, {'sid': session['id']})
+    REFRESH_STATS['rotations'] += 1
     
-    new_access_token = generate_access_token(entity_id, user_type)
-    new_refresh_token = generate_refresh_token()
-    new_refresh_hash = hash_token(new_refresh_token)
-    
-    # Обновляем сессию (token rotation)
-    new_expires_at = datetime.utcnow() + REFRESH_TOKEN_EXPIRES
-    
-    query_db_func(
-        """UPDATE user_sessions 
-           SET refresh_token_hash = %s, 
-               expires_at = %s,
-               last_used_at = NOW()
-           WHERE id = %s""",
-        (new_refresh_hash, new_expires_at, session['id']),
-        commit=True
-    )
+    return new_access_token, new_refresh_token, session
+
+
+def rotate_refresh_token(query_db_func, old_token):
+    """
+    Ротация refresh token
     
+    @return: (new_access_token, new_refresh_token) или (None, None)
+    """
+    new_access_token, new_refresh_token, _ = rotate_refresh_session(query_db_func, old_token)
     return new_access_token, new_refresh_token
 
 
+def revoke_sessions_query(where):
+    """
+    UPDATE user_sessions для logout: revoked_at ставится, только если
+    миграция add_session_revoked_at.sql применена (иначе logout падал бы с 500)
+    """
+    columns = "is_active = FALSE"
+    if REVOCATIONS.revoked_at_available():
+        columns += ", revoked_at = NOW()"
+    return f"UPDATE user_sessions SET {columns} WHERE {where} RETURNING id"
+
+
 def invalidate_session(query_db_func, refresh_token):
     """
     Инвалидация сессии (logout)
@@ -231,28 +409,48 @@ def invalidate_session(query_db_func, refresh_token):
     """
     token_hash = hash_token(refresh_token)
     
-    rows = query_db_func(
-        "UPDATE user_sessions SET is_active = FALSE WHERE refresh_token_hash = %s",
-        (token_hash,), commit=True
-    )
+    # Старый токен в grace-окне ротации указывает на ту же сессию, что и новый
+    hashes = [token_hash]
+    for old_hash, result in _drop_refresh_flights(
+            lambda old_hash, result: token_hash in (old_hash, hash_token(result[1]))):
+        hashes += [old_hash, hash_token(result[1])]
+    
+    revoked = query_db_func(revoke_sessions_query("refresh_token_hash = ANY(%s)"),
+                            (list(set(hashes)),), commit=True)
+    
+    # Access token этой сессии перестают действовать сразу
+    for row in revoked or []:
+        REVOCATIONS.revoke_session(row['id'])
     
-    return rows > 0 if rows else False
+    return bool(revoked)
 
 
 def invalidate_all_sessions(query_db_func, user_id=None, medical_center_id=None):
     """
     Инвалидация всех сессий пользователя (logout-all)
     """
+    _drop_refresh_flights(lambda old_hash, result: (
+        result[2]['user_id'] == user_id if user_id
+        else result[2]['medical_center_id'] == medical_center_id
+    ))
+    
     if user_id:
-        query_db_func(
-            "UPDATE user_sessions SET is_active = FALSE WHERE user_id = %s",
-            (user_id,), commit=True
-        )
+        subject = ('donor', user_id)
+        revoked = query_db_func(revoke_sessions_query("user_id = %s AND is_active = TRUE"),
+                                (user_id,), commit=True)
     elif medical_center_id:
-        query_db_func(
-            "UPDATE user_sessions SET is_active = FALSE WHERE medical_center_id = %s",
-            (medical_center_id,), commit=True
-        )
+        subject = ('medcenter', medical_center_id)
+        revoked = query_db_func(revoke_sessions_query("medical_center_id = %s AND is_active = TRUE"),
+                                (medical_center_id,), commit=True)
+    else:
+        return
+    
+    # Все выпущенные access token пользователя перестают действовать сразу
+    REVOCATIONS.revoke_subject(subject)
+    for row in revoked or []:
+        REVOCATIONS.revoke_session(row['id'])
+    ACCESS_TOKENS.discard_subject(subject)
+    LEGACY_SESSIONS.discard_subject(subject)
 
 
 def get_active_sessions(query_db_func, user_id=None, medical_center_id=None):
@@ -405,11 +603,14 @@ def get_client_info():
     }
 
 
-def cleanup_expired_sessions(query_db_func):
+def cleanup_expired_sessions(query_db_func=None):
     """
-    Очистка истекших сессий (запускать периодически)
+    Очистка истекших сессий
+
+    Выполняется пачками под advisory lock (session_compaction.py);
+    по расписанию её запускает SESSION_COMPACTOR.ensure_started().
+    query_db_func не используется - оставлен для совместимости вызовов.
+
+    @return: число удалённых строк или None, если очистка уже идёт в другом процессе
     """
-    query_db_func(
-        "DELETE FROM user_sessions WHERE expires_at < NOW() OR is_active = FALSE",
-        commit=True
-    )
+    return SESSION_COMPACTOR.run_once()
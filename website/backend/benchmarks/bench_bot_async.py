@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк: пропускная способность обработчиков Telegram бота
+
+Сравнивает синхронный query_db внутри async-обработчика (блокирует event loop)
+и database.query_db_async (ограниченный пул потоков) при N одновременных
+пользователях. Показывает апдейты/сек.
+
+Запуск (из website/backend):
+    python benchmarks/bench_bot_async.py --users 50 --updates 10 --latency 0.02
+    python benchmarks/bench_bot_async.py --real   # настоящая БД: SELECT pg_sleep(latency)
+"""
+
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+
+
+def make_simulated_query(latency):
+    """Имитация запроса фиксированной длительности без БД"""
+    def query_db(query, args=(), one=False, commit=False):
+        time.sleep(latency)
+        return {'ok': 1} if one else [{'ok': 1}]
+    return query_db
+
+
+async def handler_blocking(query_sql, args):
+    # Так обработчики работали раньше: синхронный вызов внутри корутины
+    database.query_db(query_sql, args, one=True)
+    await asyncio.sleep(0)
+
+
+async def handler_async(query_sql, args):
+    await database.query_db_async(query_sql, args, one=True)
+    await asyncio.sleep(0)
+
+
+async def simulate_user(handler, updates, query_sql, args):
+    for _ in range(updates):
+        await handler(query_sql, args)
+
+
+async def run(handler, users, updates, query_sql, args):
+    started = time.perf_counter()
+    await asyncio.gather(*(
+        simulate_user(handler, updates, query_sql, args) for _ in range(users)
+    ))
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=50, help='одновременных пользователей')
+    parser.add_argument('--updates', type=int, default=10, help='апдейтов на пользователя')
+    parser.add_argument('--latency', type=float, default=0.02, help='длительность запроса, сек')
+    parser.add_argument('--real', action='store_true', help='использовать настоящую БД из .env')
+    opts = parser.parse_args()
+
+    if opts.real:
+        query_sql, args = "SELECT pg_sleep(%s) AS ok", (opts.latency,)
+        database.get_service_pool().prefill()
+    else:
+        database.query_db = make_simulated_query(opts.latency)
+        query_sql, args = "SELECT 1 AS ok", ()
+
+    total = opts.users * opts.updates
+    print("=" * 50)
+    print(f"Пользователей: {opts.users}, апдейтов: {total}, запрос: {opts.latency * 1000:.0f} мс")
+    print(f"Потоков БД: {database.DB_ASYNC_WORKERS}")
+    print("=" * 50)
+
+    for name, handler in (("sync query_db", handler_blocking), ("query_db_async", handler_async)):
+        elapsed = asyncio.run(run(handler, opts.users, opts.updates, query_sql, args))
+        print(f"{name:<16} {elapsed:8.2f} с  {total / elapsed:10.1f} апдейтов/с")
+
+    database.get_executor().shutdown(wait=True)
+
+
+if __name__ == '__main__':
+    main()
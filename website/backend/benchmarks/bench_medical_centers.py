@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк: /api/medical-centers - N+1 против одного запроса и кэша
+
+Сравнивает три способа собрать список медцентров с потребностью в крови:
+- n+1: медцентры, затем blood_needs каждого (прежняя реализация);
+- join: один запрос с LEFT JOIN blood_needs (center_needs.fetch_centers);
+- cache: join + кэш по району (center_needs.CenterNeedsCache), тёплый.
+
+По умолчанию БД синтетическая: --centers медцентров по 8 групп крови,
+каждый запрос стоит --rtt мс (сетевой круг до Postgres). С --real
+запросы идут в БД из .env через database.query_db.
+
+Запуск (из website/backend):
+    python benchmarks/bench_medical_centers.py --centers 500 --rtt 0.5
+    python benchmarks/bench_medical_centers.py --real
+"""
+
+import os
+import sys
+import time
+import argparse
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from center_needs import CenterNeedsCache, fetch_centers
+
+BLOOD_TYPES = ('A+', 'A-', 'AB+', 'AB-', 'B+', 'B-', 'O+', 'O-')
+STATUSES = ('normal', 'needed', 'urgent', 'critical')
+
+
+class SyntheticDB:
+    """Таблицы medical_centers/blood_needs в памяти; каждый запрос ждёт rtt"""
+
+    def __init__(self, centers, districts, rtt):
+        self.rtt = rtt
+        self.queries = 0
+        base = datetime(2026, 1, 1)
+        self.centers = sorted((
+            {'id': i, 'name': f'Медцентр {i:04d}', 'address': f'ул. Тестовая, {i}',
+             'phone': f'+375170{i:06d}', 'email': f'mc{i}@example.by',
+             'district_id': i % districts + 1, 'district_name': f'Район {i % districts + 1}',
+             'region_name': 'Минская область'}
+            for i in range(1, centers + 1)
+        ), key=lambda c: (c['name'], c['id']))
+        self.needs = {
+            c['id']: [{'blood_type': bt, 'status': STATUSES[(c['id'] + k) % 4],
+                       'last_updated': base + timedelta(minutes=c['id'] * 8 + k)}
+                      for k, bt in enumerate(BLOOD_TYPES)]
+            for c in self.centers
+        }
+
+    def query(self, sql, args=(), one=False):
+        self.queries += 1
+        if self.rtt:
+            time.sleep(self.rtt)
+
+        if 'LEFT JOIN blood_needs' in sql:
+            rows = []
+            for c in self._centers(args[0] if args else None):
+                for need in self.needs[c['id']]:
+                    rows.append(dict(c, **need))
+            return rows
+        if 'FROM blood_needs' in sql:
+            return list(self.needs.get(args[0], []))
+        return [dict(c) for c in self._centers(args[0] if args else None)]
+
+    def _centers(self, district_id):
+        return [c for c in self.centers if district_id is None or c['district_id'] == district_id]
+
+
+def n_plus_one(query_func, district_id=None):
+    """Прежний get_medical_centers_with_needs"""
+    query = """
+        SELECT mc.id, mc.name, mc.address, mc.phone, mc.email, mc.district_id,
+               d.name as district_name, r.name as region_name
+        FROM medical_centers mc
+        LEFT JOIN districts d ON mc.district_id = d.id
+        LEFT JOIN regions r ON d.region_id = r.id
+        WHERE mc.is_active = TRUE
+    """
+    params = []
+    if district_id:
+        query += " AND mc.district_id = %s"
+        params.append(district_id)
+    query += " ORDER BY mc.name"
+
+    centers = query_func(query, tuple(params))
+    for center in centers:
+        center['blood_needs'] = query_func(
+            """SELECT blood_type, status, last_updated
+               FROM blood_needs
+               WHERE medical_center_id = %s
+               ORDER BY blood_type""",
+            (center['id'],)
+        ) or []
+    return centers
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+def run(title, fn, requests, counter):
+    timings = []
+    queries_before = counter()
+    for _ in range(requests):
+        started = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - started) * 1000)
+    per_request = (counter() - queries_before) / requests
+    print(f"{title:<22} {per_request:>12.1f} {percentile(timings, 0.5):>10.2f} {percentile(timings, 0.95):>10.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--centers', type=int, default=500)
+    parser.add_argument('--districts', type=int, default=25)
+    parser.add_argument('--rtt', type=float, default=0.5, help='мс на запрос к синтетической БД')
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--real', action='store_true', help='запросы к БД из .env')
+    opts = parser.parse_args()
+
+    if opts.real:
+        import database
+        queries = [0]
+
+        def query_func(sql, args=(), one=False):
+            queries[0] += 1
+            return [dict(row) for row in database.query_db(sql, args, one=one)]
+        counter = lambda: queries[0]
+        source = 'БД'
+    else:
+        db = SyntheticDB(opts.centers, opts.districts, opts.rtt / 1000)
+        query_func = db.query
+        counter = lambda: db.queries
+        source = f'синтетика, {opts.centers} медцентров, rtt {opts.rtt} мс'
+
+    cache = CenterNeedsCache(ttl=3600)
+    print(f"Источник: {source}, запросов на вариант: {opts.requests}")
+    for district_id, scope in ((None, 'все медцентры'), (1, 'один район')):
+        print("=" * 58)
+        print(f"{scope:<22} {'запросов/req':>12} {'p50, мс':>10} {'p95, мс':>10}")
+        print("=" * 58)
+        run('n+1', lambda: n_plus_one(query_func, district_id), opts.requests, counter)
+        run('join', lambda: cache.encode(fetch_centers(query_func, district_id)), opts.requests, counter)
+        cache.get_json(district_id, query_func)
+        run('join + кэш', lambda: cache.get_json(district_id, query_func), opts.requests, counter)
+
+
+if __name__ == '__main__':
+    main()
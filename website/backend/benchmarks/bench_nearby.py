@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк: поиск ближайших медучреждений (geo_index.GridIndex)
+
+Сравнивает сетку с полным перебором на случайных точках внутри Беларуси:
+время построения индекса, p50/p95/p99 одного запроса и совпадение
+результатов (перебор - эталон).
+
+По умолчанию набор синтетический: --points учреждений, сгущённых вокруг
+областных центров (как в выгрузке OSM). С --file берутся учреждения
+с координатами из medcenters.json, собранного build_medical_json.py.
+
+Запуск (из website/backend):
+    python benchmarks/bench_nearby.py --points 8000 --queries 2000
+    python benchmarks/bench_nearby.py --file ../data/medcenters.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from geo_index import GridIndex, haversine_km, institutions_from_json
+
+# Границы Беларуси и областные центры (lat, lon)
+BBOX = (51.26, 56.17, 23.18, 32.78)
+CITIES = [(53.90, 27.56), (52.09, 23.69), (52.44, 30.98), (53.68, 23.83),
+          (55.19, 30.20), (53.90, 30.33), (53.13, 29.22), (52.11, 26.10)]
+
+
+def synthetic(n, seed=1):
+    rnd = random.Random(seed)
+    items = []
+    for i in range(n):
+        if rnd.random() < 0.6:
+            lat, lon = rnd.choice(CITIES)
+            lat, lon = rnd.gauss(lat, 0.12), rnd.gauss(lon, 0.2)
+        else:
+            lat, lon = rnd.uniform(BBOX[0], BBOX[1]), rnd.uniform(BBOX[2], BBOX[3])
+        items.append({'id': i, 'name': f'Учреждение {i}', 'lat': lat, 'lon': lon})
+    return items
+
+
+def brute_force(items, lat, lon, k, radius_km):
+    found = ((haversine_km(lat, lon, it['lat'], it['lon']), it) for it in items)
+    return sorted(((d, it) for d, it in found if d <= radius_km), key=lambda pair: pair[0])[:k]
+
+
+def percentiles(samples):
+    ordered = sorted(samples)
+    pick = lambda p: ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+    return pick(0.5), pick(0.95), pick(0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--points', type=int, default=8000)
+    parser.add_argument('--file', help='medcenters.json с координатами')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--radius', type=float, default=25, help='км')
+    parser.add_argument('--cell', type=float, default=0.1, help='размер ячейки, градусы')
+    opts = parser.parse_args()
+
+    if opts.file:
+        with open(opts.file, encoding='utf-8') as f:
+            items = institutions_from_json(json.load(f))
+        source = f'{opts.file}'
+    else:
+        items = synthetic(opts.points)
+        source = 'синтетика'
+    if not items:
+        sys.exit('Нет учреждений с координатами (запустите geocode_medcenters.py или build_medical_json.py)')
+
+    started = time.perf_counter()
+    index = GridIndex(items, cell_deg=opts.cell)
+    build_ms = (time.perf_counter() - started) * 1000
+
+    rnd = random.Random(2)
+    points = [(rnd.uniform(BBOX[0], BBOX[1]), rnd.uniform(BBOX[2], BBOX[3])) for _ in range(opts.queries)]
+
+    grid_us, brute_us, mismatches = [], [], 0
+    for lat, lon in points:
+        started = time.perf_counter()
+        got = index.nearest(lat, lon, opts.k, opts.radius)
+        grid_us.append((time.perf_counter() - started) * 1e6)
+
+        started = time.perf_counter()
+        expected = brute_force(items, lat, lon, opts.k, opts.radius)
+        brute_us.append((time.perf_counter() - started) * 1e6)
+
+        if [round(d, 6) for d, _ in got] != [round(d, 6) for d, _ in expected]:
+            mismatches += 1
+
+    print(f"Учреждений: {len(items)} ({source}), ячеек: {len(index.cells)}, построение: {build_ms:.1f} мс")
+    print(f"Запросов: {opts.queries}, k={opts.k}, радиус {opts.radius} км")
+    print("=" * 52)
+    print(f"{'способ':<12} {'p50, мкс':>12} {'p95, мкс':>12} {'p99, мкс':>12}")
+    print("=" * 52)
+    for title, samples in (('сетка', grid_us), ('перебор', brute_us)):
+        p50, p95, p99 = percentiles(samples)
+        print(f"{title:<12} {p50:>12.1f} {p95:>12.1f} {p99:>12.1f}")
+    print(f"Расхождений с перебором: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк: накладные расходы планирования для горячих запросов
+
+Для каждого горячего запроса сравнивает:
+- среднее время выполнения через обычный query (разбор + план каждый раз)
+  и через PREPARE/EXECUTE из prepared.PREPARED;
+- Planning Time из EXPLAIN ANALYZE до и после подготовки.
+
+Нужна настоящая БД из .env. Запуск (из website/backend):
+    python benchmarks/bench_prepared.py --iterations 2000
+"""
+
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from prepared import PreparedStatementCache
+
+
+def hot_queries(conn):
+    """Горячие запросы API с реальными значениями параметров из БД"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT id FROM users ORDER BY id LIMIT 1")
+        row = cur.fetchone()
+        user_id = row[0] if row else 1
+        cur.execute("SELECT id, medical_center_id FROM conversations ORDER BY id LIMIT 1")
+        row = cur.fetchone()
+        conv_id, mc_id = row if row else (1, 1)
+    conn.rollback()
+
+    return [
+        ("require_auth legacy session",
+         """SELECT * FROM user_sessions 
+            WHERE session_token = %s AND is_active = TRUE AND expires_at > NOW()""",
+         ('bench-nonexistent-token',)),
+        ("users by id",
+         "SELECT * FROM users WHERE id = %s",
+         (user_id,)),
+        ("conversation membership",
+         "SELECT * FROM conversations WHERE id = %s AND medical_center_id = %s",
+         (conv_id, mc_id)),
+        ("donor blood-request feed",
+         """SELECT br.*, mc.name as medical_center_name
+            FROM blood_requests br
+            JOIN medical_centers mc ON br.medical_center_id = mc.id
+            WHERE br.status = 'active' AND br.expires_at > NOW()
+            ORDER BY br.created_at DESC""",
+         ()),
+    ]
+
+
+def timed(conn, query, args, iterations):
+    started = time.perf_counter()
+    for _ in range(iterations):
+        database.execute(conn, query, args)
+    return (time.perf_counter() - started) / iterations * 1e6
+
+
+def planning_time(conn, query, args):
+    """Planning Time (мс) из EXPLAIN ANALYZE для запроса или EXECUTE"""
+    with conn.cursor() as cur:
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query, args or None)
+        plan = cur.fetchone()[0][0]
+    conn.rollback()
+    return plan.get('Planning Time', 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=2000)
+    opts = parser.parse_args()
+
+    pool = database.get_pool()
+    with pool.connection() as conn:
+        queries = hot_queries(conn)
+
+        print("=" * 78)
+        print(f"{'запрос':<30} {'обычный, мкс':>13} {'EXECUTE, мкс':>13} {'план до, мс':>11} {'после, мс':>9}")
+        print("=" * 78)
+
+        for title, query, args in queries:
+            # Без подготовки
+            database.PREPARED.enabled = False
+            plain_us = timed(conn, query, args, opts.iterations)
+            plan_before = planning_time(conn, query, args)
+
+            # С подготовкой (порог 1 - сразу PREPARE)
+            cache = PreparedStatementCache(enabled=True, threshold=1)
+            database.PREPARED = cache
+            prepared_us = timed(conn, query, args, opts.iterations)
+            exec_sql, exec_args = cache.rewrite(conn, query, args)
+            plan_after = planning_time(conn, exec_sql, exec_args)
+            conn.commit()
+
+            print(f"{title:<30} {plain_us:13.1f} {prepared_us:13.1f} {plan_before:11.3f} {plan_after:9.3f}")
+
+            with conn.cursor() as cur:
+                cur.execute("DEALLOCATE ALL")
+            conn.commit()
+
+
+if __name__ == '__main__':
+    main()
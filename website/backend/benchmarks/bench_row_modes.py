@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк: RealDictCursor против CompactCursor на массовых выборках
+
+Для двух горячих путей - истории сообщений (format_message) и списка
+доноров медцентра (потоковый JSON из stream_json) - сравнивает время
+и пиковую память (tracemalloc) на 10k строк:
+- dict: строки как RealDictRow (как отдаёт RealDictCursor);
+- compact: строки как Record (compact_rows.CompactCursor).
+
+По умолчанию строки синтетические - измеряется только стоимость
+представления строки на стороне Python. С --real строки читаются из БД
+(.env) через database.execute(compact=...).
+
+Запуск (из website/backend):
+    python benchmarks/bench_row_modes.py --rows 10000
+    python benchmarks/bench_row_modes.py --real
+"""
+
+import os
+import sys
+import gc
+import time
+import argparse
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from psycopg2.extras import RealDictRow
+
+from compact_rows import record_class
+from messaging_api import format_message
+from app import app, encode_row
+
+MESSAGE_COLUMNS = ('id', 'conversation_id', 'sender_type', 'sender_id', 'message_text',
+                   'message_type', 'is_read', 'read_at', 'created_at', 'deleted_at')
+
+DONOR_COLUMNS = ('id', 'full_name', 'blood_type', 'phone', 'email', 'birth_date',
+                 'last_donation_date', 'total_donations', 'is_honorary_donor', 'created_at')
+
+
+def synthetic_messages(n):
+    base = datetime(2025, 1, 1)
+    return [
+        (i, i % 300, 'donor' if i % 2 else 'medcenter', i % 5000,
+         f'Сообщение номер {i}: напоминание о донации', 'text', i % 3 == 0,
+         None, base + timedelta(minutes=i), None)
+        for i in range(n)
+    ]
+
+
+def synthetic_donors(n):
+    base = datetime(2024, 1, 1)
+    types = ('O+', 'O-', 'A+', 'A-', 'B+', 'B-', 'AB+', 'AB-')
+    return [
+        (i, f'Донор Тестовый {i}', types[i % 8], f'+7700{i:07d}', f'donor{i}@example.kz',
+         base.date() - timedelta(days=8000 + i), base.date() + timedelta(days=i % 365),
+         i % 40, i % 40 >= 20, base + timedelta(hours=i))
+        for i in range(n)
+    ]
+
+
+def as_dicts(columns, tuples):
+    return [RealDictRow(zip(columns, t)) for t in tuples]
+
+
+def as_records(columns, tuples):
+    make = record_class(columns)
+    return [make(t) for t in tuples]
+
+
+def measure(fn):
+    """(секунды, пик памяти в КБ) для fn()"""
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak / 1024
+
+
+def messages_path(build):
+    rows = build()
+    return [format_message(row) for row in rows]
+
+
+def donors_path(build):
+    rows = build()
+    return ''.join(encode_row(row) for row in rows)
+
+
+def real_rows(compact, query, args):
+    import database
+    with database.get_pool().connection() as conn:
+        rows = database.execute(conn, query, args, compact=compact)
+        conn.rollback()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000)
+    parser.add_argument('--real', action='store_true', help='читать строки из БД')
+    opts = parser.parse_args()
+
+    if opts.real:
+        paths = [
+            ("сообщения (format_message)", messages_path,
+             lambda compact: real_rows(compact, "SELECT * FROM chat_messages ORDER BY id DESC LIMIT %s", (opts.rows,))),
+            ("доноры (stream_json)", donors_path,
+             lambda compact: real_rows(compact, "SELECT * FROM users ORDER BY id LIMIT %s", (opts.rows,))),
+        ]
+    else:
+        messages = synthetic_messages(opts.rows)
+        donors = synthetic_donors(opts.rows)
+        paths = [
+            ("сообщения (format_message)", messages_path,
+             lambda compact: (as_records if compact else as_dicts)(MESSAGE_COLUMNS, messages)),
+            ("доноры (stream_json)", donors_path,
+             lambda compact: (as_records if compact else as_dicts)(DONOR_COLUMNS, donors)),
+        ]
+
+    print(f"Строк: {opts.rows}, источник: {'БД' if opts.real else 'синтетика'}")
+    print("=" * 78)
+    print(f"{'путь':<28} {'режим':<8} {'время, мс':>10} {'пик памяти, КБ':>15} {'на строку, Б':>13}")
+    print("=" * 78)
+
+    with app.app_context():
+        for title, path, build in paths:
+            for compact in (False, True):
+                elapsed, peak_kb = measure(lambda: path(lambda: build(compact)))
+                mode = 'compact' if compact else 'dict'
+                per_row = peak_kb * 1024 / max(opts.rows, 1)
+                print(f"{title:<28} {mode:<8} {elapsed * 1000:10.1f} {peak_kb:15.0f} {per_row:13.0f}")
+
+
+if __name__ == '__main__':
+    main()
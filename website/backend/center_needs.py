@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Медцентры с потребностью в крови (/api/medical-centers)
+
+Раньше список собирался как 1 + N запросов: медцентры, затем blood_needs
+для каждого. Теперь - один запрос с LEFT JOIN blood_needs, строки
+группируются по медцентру в Python (типы полей и JSON не меняются).
+
+Готовый JSON кэшируется по district_id. Изменение светофора сбрасывает
+записи с этим медцентром (invalidate(mc_id)), изменение самого медцентра
+(район, активность) - все записи (invalidate(mc_id, moved=True)).
+"""
+
+import os
+import json
+import time
+import threading
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Страховочное время жизни записи (секунды)
+CENTER_NEEDS_CACHE_TTL = int(os.getenv('CENTER_NEEDS_CACHE_TTL', 300))
+
+CENTERS_WITH_NEEDS_QUERY = """
+    SELECT mc.id, mc.name, mc.address, mc.phone, mc.email, mc.district_id,
+           d.name as district_name, r.name as region_name,
+           bn.blood_type, bn.status, bn.last_updated
+    FROM medical_centers mc
+    LEFT JOIN districts d ON mc.district_id = d.id
+    LEFT JOIN regions r ON d.region_id = r.id
+    LEFT JOIN blood_needs bn ON bn.medical_center_id = mc.id
+    WHERE mc.is_active = TRUE {district_filter}
+    ORDER BY mc.name, mc.id, bn.blood_type
+"""
+
+CENTER_FIELDS = ('id', 'name', 'address', 'phone', 'email', 'district_id',
+                 'district_name', 'region_name')
+NEED_FIELDS = ('blood_type', 'status', 'last_updated')
+
+
+def group_centers(rows):
+    """Строки JOIN -> медцентры с вложенным списком blood_needs"""
+    centers = []
+    current = None
+    for row in rows:
+        if current is None or current['id'] != row['id']:
+            current = {field: row[field] for field in CENTER_FIELDS}
+            current['blood_needs'] = []
+            centers.append(current)
+        if row['blood_type'] is not None:
+            current['blood_needs'].append({field: row[field] for field in NEED_FIELDS})
+    return centers
+
+
+def fetch_centers(query_func, district_id=None):
+    """Медцентры района (или все) с потребностью в крови - один запрос"""
+    if district_id:
+        query = CENTERS_WITH_NEEDS_QUERY.format(district_filter="AND mc.district_id = %s")
+        return group_centers(query_func(query, (district_id,)))
+    return group_centers(query_func(CENTERS_WITH_NEEDS_QUERY.format(district_filter="")))
+
+
+def default_encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class CenterNeedsCache:
+    """
+    Кэш ответа /api/medical-centers по району
+
+    @param ttl: время жизни записи (секунды)
+    """
+
+    def __init__(self, ttl=CENTER_NEEDS_CACHE_TTL, encode=default_encode):
+        self.ttl = ttl
+        self.encode = encode
+        # Вызываются с тем же mc_id (статические снимки светофора)
+        self.on_invalidate = []
+
+        self._lock = threading.Lock()
+        self._entries = {}     # district_id -> (body, ids медцентров, expires_at)
+
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get_json(self, district_id, query_func):
+        """
+        @param query_func: функция запросов к основному серверу (database.query_db) -
+                           generation не защищает от устаревших строк реплики
+        """
+        key = district_id or None
+        entry = self._entries.get(key)
+        if entry is not None and entry[2] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+
+        self.misses += 1
+        with self._lock:
+            generation = self.invalidations
+        centers = fetch_centers(query_func, key)
+        body = self.encode(centers)
+
+        with self._lock:
+            # Пока шёл запрос, данные могли измениться - такой ответ не кэшируем
+            if generation == self.invalidations:
+                ids = frozenset(center['id'] for center in centers)
+                self._entries[key] = (body, ids, time.monotonic() + self.ttl)
+        return body
+
+    def invalidate(self, mc_id=None, moved=False):
+        """
+        Сбросить записи, в которые входит медцентр mc_id
+
+        Медцентр, которого нет ни в одной записи (новый или ставший
+        активным), может попасть в любую - тогда сбрасывается всё.
+
+        @param moved: могли измениться район или активность медцентра -
+                      он мог появиться в записи, где его ещё нет, поэтому
+                      сбрасывается всё (изменения medical_centers; светофор - False)
+        """
+        with self._lock:
+            self.invalidations += 1
+            keys = [key for key, entry in self._entries.items() if mc_id in entry[1]]
+            if mc_id is None or moved or not keys:
+                self._entries.clear()
+            else:
+                for key in keys:
+                    del self._entries[key]
+        for callback in self.on_invalidate:
+            callback(mc_id)
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations
+        }
+
+
+CENTER_NEEDS = CenterNeedsCache()
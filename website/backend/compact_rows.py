@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Компактные строки результата
+
+RealDictCursor создаёт на каждую строку отдельный словарь с повторяющимися
+ключами. CompactCursor отдаёт кортежи (Record) с общим на весь результат
+индексом колонок: row['id'] и row.get('name') работают как у словаря,
+но строка занимает место обычного кортежа.
+"""
+
+from psycopg2.extensions import cursor as _cursor
+
+
+class Record(tuple):
+    """Строка результата: кортеж + общий для всех строк индекс колонок"""
+
+    __slots__ = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            key = self._index[key]
+        return tuple.__getitem__(self, key)
+
+    def get(self, key, default=None):
+        i = self._index.get(key)
+        return default if i is None else tuple.__getitem__(self, i)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def keys(self):
+        return self._index.keys()
+
+    def as_dict(self):
+        return {name: tuple.__getitem__(self, i) for name, i in self._index.items()}
+
+
+_record_classes = {}
+
+
+def record_class(columns):
+    """Класс строки для набора колонок (кэшируется: тексты запросов статичны)"""
+    cls = _record_classes.get(columns)
+    if cls is None:
+        # При повторе имени побеждает последняя колонка - как в RealDictCursor
+        index = {name: i for i, name in enumerate(columns)}
+        cls = type('Record', (Record,), {'__slots__': (), '_index': index})
+        if len(_record_classes) < 1000:
+            _record_classes[columns] = cls
+    return cls
+
+
+class CompactCursor(_cursor):
+    """Курсор, возвращающий Record вместо словарей"""
+
+    def _record(self):
+        return record_class(tuple(col.name for col in self.description))
+
+    def fetchone(self):
+        row = super().fetchone()
+        return None if row is None else self._record()(row)
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        if not rows:
+            return rows
+        return list(map(self._record(), rows))
+
+    def fetchall(self):
+        rows = super().fetchall()
+        if not rows:
+            return rows
+        return list(map(self._record(), rows))
+
+    def __iter__(self):
+        it = super().__iter__()
+        first = next(it, None)
+        if first is None:
+            return
+        make = self._record()
+        yield make(first)
+        for row in it:
+            yield make(row)
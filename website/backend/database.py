@@ -0,0 +1,357 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Общий доступ к БД
+
+Единая конфигурация PostgreSQL и пулы соединений
+для Flask API (app.py) и Telegram бота (telegram_bot.py):
+- get_pool() - соединения Flask-запросов (g.db);
+- get_service_pool() - небольшой отдельный пул для query_db вне запроса
+  (бот, фоновые потоки, ленивые загрузки справочников), чтобы служебный
+  запрос никогда не ждал соединение, занятое ожидающим его Flask-запросом.
+"""
+
+import os
+import re
+import time
+import asyncio
+import threading
+import uuid
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+from psycopg2.extras import RealDictCursor
+from dotenv import load_dotenv
+
+try:
+    from flask import g, has_app_context
+except ImportError:
+    g = has_app_context = None
+
+load_dotenv()
+
+# Импорт после load_dotenv: размеры пула читаются из окружения
+from db_pool import ConnectionPool, DB_POOL_MAX
+from compact_rows import CompactCursor
+from prepared import PREPARED
+
+# ============================================
+# Конфигурация
+# ============================================
+
+DB_CONFIG = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'database': os.getenv('DB_NAME', 'your_donor'),
+    'user': os.getenv('DB_USER', 'postgres'),
+    'password': os.getenv('DB_PASSWORD', 'vadamahjkl'),
+    'port': os.getenv('DB_PORT', 5432)
+}
+
+# Реплика для чтения (необязательно): если DB_REPLICA_HOST не задан,
+# все запросы идут на основной сервер
+DB_REPLICA_CONFIG = {
+    'host': os.getenv('DB_REPLICA_HOST'),
+    'database': os.getenv('DB_REPLICA_NAME', DB_CONFIG['database']),
+    'user': os.getenv('DB_REPLICA_USER', DB_CONFIG['user']),
+    'password': os.getenv('DB_REPLICA_PASSWORD', DB_CONFIG['password']),
+    'port': os.getenv('DB_REPLICA_PORT', DB_CONFIG['port'])
+}
+
+# Максимальное отставание реплики (секунды), при котором на неё ещё идут чтения
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', 5))
+
+# Как часто перепроверять отставание реплики (секунды)
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', 5))
+
+# Сколько строк за раз читать из серверного курсора при потоковой выдаче
+DB_STREAM_FETCH_SIZE = int(os.getenv('DB_STREAM_FETCH_SIZE', 500))
+
+# Размер пула служебных запросов (query_db вне Flask-запроса)
+DB_SERVICE_POOL_MAX = int(os.getenv('DB_SERVICE_POOL_MAX', 4))
+
+# Потоки для асинхронных запросов: не больше, чем соединений в служебном пуле,
+# чтобы поток никогда не ждал свободное соединение
+DB_ASYNC_WORKERS = int(os.getenv('DB_ASYNC_WORKERS', DB_SERVICE_POOL_MAX))
+
+_pool = None
+_service_pool = None
+_replica_pool = None
+_replica_monitor = None
+_executor = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Пул соединений процесса (создаётся при первом обращении)"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(DB_CONFIG)
+    return _pool
+
+
+def get_service_pool():
+    """Пул для query_db вне Flask-запроса (создаётся при первом обращении)"""
+    global _service_pool
+    if _service_pool is None:
+        with _pool_lock:
+            if _service_pool is None:
+                _service_pool = ConnectionPool(DB_CONFIG, minconn=0, maxconn=DB_SERVICE_POOL_MAX)
+    return _service_pool
+
+
+def get_replica_pool():
+    """Пул соединений к реплике или None, если реплика не настроена"""
+    global _replica_pool
+    if not DB_REPLICA_CONFIG['host']:
+        return None
+    if _replica_pool is None:
+        with _pool_lock:
+            if _replica_pool is None:
+                _replica_pool = ConnectionPool(DB_REPLICA_CONFIG)
+    return _replica_pool
+
+
+def get_replica_monitor():
+    """Монитор отставания реплики или None, если реплика не настроена"""
+    global _replica_monitor
+    pool = get_replica_pool()
+    if pool is None:
+        return None
+    if _replica_monitor is None:
+        with _pool_lock:
+            if _replica_monitor is None:
+                _replica_monitor = ReplicaMonitor(pool)
+    return _replica_monitor
+
+
+def get_executor():
+    """Ограниченный пул потоков для query_db_async"""
+    global _executor
+    if _executor is None:
+        with _pool_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=DB_ASYNC_WORKERS,
+                    thread_name_prefix='db-async'
+                )
+    return _executor
+
+
+# ============================================
+# Реплика
+# ============================================
+
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ReplicaMonitor:
+    """
+    Следит за отставанием реплики
+
+    Отставание проверяется не чаще раза в DB_REPLICA_CHECK_INTERVAL;
+    при ошибке соединения реплика считается недоступной до следующей проверки.
+    """
+
+    def __init__(self, pool, max_lag=DB_REPLICA_MAX_LAG, check_interval=DB_REPLICA_CHECK_INTERVAL):
+        self.pool = pool
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+
+        self._lock = threading.Lock()
+        self._checked_at = 0.0
+        self._healthy = False
+        self.lag = None
+        self.last_error = None
+        self.routed = 0
+        self.fallbacks = 0
+
+    def is_available(self):
+        """Можно ли сейчас читать с реплики"""
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._healthy
+        # Проверяет один поток, остальные пока используют прошлый результат
+        if not self._lock.acquire(blocking=False):
+            return self._healthy
+        try:
+            self._checked_at = now
+            with self.pool.connection(timeout=1) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_QUERY)
+                    self.lag = float(cur.fetchone()[0])
+                conn.rollback()
+            self._healthy = self.lag <= self.max_lag
+            self.last_error = None
+        except Exception as e:
+            self._healthy = False
+            self.last_error = str(e)
+        finally:
+            self._lock.release()
+        return self._healthy
+
+    def mark_failed(self, error):
+        """Ошибка при чтении с реплики: не использовать её до следующей проверки"""
+        self._healthy = False
+        self._checked_at = time.monotonic()
+        self.last_error = str(error)
+        self.fallbacks += 1
+
+    def stats(self):
+        return {
+            'healthy': self._healthy,
+            'lag_seconds': self.lag,
+            'max_lag_seconds': self.max_lag,
+            'routed': self.routed,
+            'fallbacks': self.fallbacks,
+            'last_error': self.last_error,
+            'pool': self.pool.stats()
+        }
+
+
+# ============================================
+# Выполнение запросов
+# ============================================
+
+_RE_WRITE = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|NEXTVAL|SETVAL|FOR\s+SHARE)\b', re.I)
+
+
+def is_read_only(sql):
+    """Чистый SELECT/WITH без изменения данных и блокировок строк"""
+    stripped = sql.lstrip()
+    if not stripped:
+        return False
+    head = stripped.split(None, 1)[0].upper()
+    if head not in ('SELECT', 'WITH'):
+        return False
+    return _RE_WRITE.search(sql) is None
+
+
+def execute(conn, query, args=(), one=False, commit=False, compact=False):
+    """
+    Выполнить SQL запрос на переданном соединении
+
+    @param one: вернуть только первую строку
+    @param commit: зафиксировать транзакцию
+    @param compact: строки - Record (кортежи с общим индексом колонок) вместо словарей
+    @return: список строк / одна строка; rowcount для запросов без результата
+    """
+    cur = conn.cursor(cursor_factory=CompactCursor if compact else RealDictCursor)
+    # Повтор после ошибки безопасен, только если до запроса транзакция не была открыта
+    idle = conn.info.transaction_status == TRANSACTION_STATUS_IDLE
+    try:
+        # Горячие запросы выполняются через PREPARE/EXECUTE
+        sql, params = PREPARED.rewrite(conn, query, args)
+        try:
+            return _fetch(conn, cur, sql, params, one, commit)
+        except Exception as e:
+            conn.rollback()
+            if sql is query or not PREPARED.on_error(conn, query, e) or not idle:
+                raise
+
+        # Подготовленный запрос сброшен (например, после ALTER TABLE) - один повтор без PREPARE
+        try:
+            return _fetch(conn, cur, query, args, one, commit)
+        except Exception:
+            conn.rollback()
+            raise
+    finally:
+        cur.close()
+
+
+def _fetch(conn, cur, sql, args, one, commit):
+    cur.execute(sql, args)
+    if commit:
+        conn.commit()
+    if cur.description is None:
+        return cur.rowcount
+    rv = cur.fetchall()
+    return (rv[0] if rv else None) if one else rv
+
+
+def iter_rows(conn, query, args=(), fetch_size=DB_STREAM_FETCH_SIZE, compact=False):
+    """
+    Построчное чтение большого результата через именованный (серверный) курсор
+
+    В памяти одновременно не больше fetch_size строк, сколько бы их ни было всего.
+    Запрос выполняется при первом next().
+    """
+    cur = conn.cursor(
+        name=f"stream_{uuid.uuid4().hex[:12]}",
+        cursor_factory=CompactCursor if compact else RealDictCursor
+    )
+    cur.itersize = fetch_size
+    try:
+        cur.execute(query, args)
+        while True:
+            rows = cur.fetchmany(fetch_size)
+            if not rows:
+                break
+            yield from rows
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if not cur.closed and not conn.closed:
+            try:
+                cur.close()
+            except Exception:
+                pass
+
+
+def request_connection():
+    """
+    Соединение текущего Flask-запроса (g.db), если оно открыто и вне транзакции
+
+    Внутри транзакции запроса не используется: служебное чтение увидело бы
+    незафиксированные записи и закэшировало их.
+    """
+    if has_app_context is None or not has_app_context():
+        return None
+    conn = g.get('db')
+    if conn is None or conn.closed or conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+        return None
+    return conn
+
+
+def query_db(query, args=(), one=False, commit=False):
+    """
+    Выполнить SQL запрос вне транзакции Flask-запроса
+
+    Во Flask-запросе с открытым g.db (after_commit, ленивые загрузки) запрос
+    идёт по соединению запроса: второе соединение из того же пула при
+    DB_POOL_MAX одновременных запросах означало бы взаимное ожидание до
+    PoolTimeout. Иначе соединение берётся из служебного пула.
+    """
+    conn = request_connection()
+    if conn is not None:
+        try:
+            return execute(conn, query, args, one=one, commit=commit)
+        finally:
+            if not commit and not conn.closed:
+                # Вернуть соединение запроса в прежнее состояние - вне транзакции
+                conn.rollback()
+    with get_service_pool().connection() as conn:
+        return execute(conn, query, args, one=one, commit=commit)
+
+
+async def query_db_async(query, args=(), one=False, commit=False):
+    """
+    Выполнить SQL запрос, не блокируя event loop
+
+    Запрос уходит в ограниченный пул потоков (DB_ASYNC_WORKERS);
+    если все потоки заняты, корутина ждёт в очереди, не блокируя цикл.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_executor(),
+        partial(query_db, query, args, one=one, commit=commit)
+    )
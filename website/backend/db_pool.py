@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Пул соединений PostgreSQL
+
+Потокобезопасный пул psycopg2-соединений:
+- настраиваемые min/max размеры
+- таймаут ожидания свободного соединения
+- проверка соединения при выдаче (health-check on borrow)
+- отдельный пул на каждый процесс (безопасно для gunicorn pre-fork)
+- статистика для /api/debug/health
+"""
+
+import os
+import time
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import extensions
+from psycopg2.pool import PoolError
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 5))
+
+# Соединения, простаивавшие дольше этого времени, перед выдачей
+# проверяются запросом SELECT 1 (секунды)
+DB_POOL_HEALTH_CHECK_IDLE = float(os.getenv('DB_POOL_HEALTH_CHECK_IDLE', 30))
+
+
+class PoolTimeout(PoolError):
+    """Не удалось получить соединение из пула за отведённое время"""
+
+
+# ============================================
+# Пул соединений
+# ============================================
+
+class ConnectionPool:
+    """
+    Пул соединений с ожиданием, health-check и статистикой
+
+    @param db_config: параметры для psycopg2.connect
+    @param minconn: сколько соединений держать открытыми всегда
+    @param maxconn: максимум одновременно открытых соединений
+    @param timeout: сколько ждать свободного соединения (секунды)
+    """
+
+    def __init__(self, db_config, minconn=DB_POOL_MIN, maxconn=DB_POOL_MAX,
+                 timeout=DB_POOL_TIMEOUT, health_check_idle=DB_POOL_HEALTH_CHECK_IDLE):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError(f"Некорректные размеры пула: min={minconn}, max={maxconn}")
+
+        self.db_config = db_config
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+
+        self._lock = threading.Condition(threading.Lock())
+        self._inherited = []
+        self._reset_state()
+
+    def _reset_state(self):
+        """Сброс внутреннего состояния (при создании и после fork)"""
+        self._pid = os.getpid()
+        self._idle = deque()      # [(conn, время возврата в пул)]
+        self._in_use = set()      # id() выданных соединений
+        self._size = 0            # всего открытых соединений
+        self._waiting = 0
+        self._closed = False
+
+        self._checkouts = 0
+        self._timeouts = 0
+        self._discarded = 0
+        self._checkout_time_total = 0.0
+        self._checkout_time_max = 0.0
+
+    def _check_pid(self):
+        """
+        Соединения, унаследованные от родительского процесса, использовать нельзя:
+        после fork каждый воркер открывает свои
+        """
+        if self._pid != os.getpid():
+            # Не закрываем чужие соединения: PQfinish оборвал бы их и у родителя
+            self._inherited.extend(conn for conn, _ in self._idle)
+            self._lock = threading.Condition(threading.Lock())
+            self._reset_state()
+
+    def _connect(self):
+        return psycopg2.connect(**self.db_config)
+
+    def _is_healthy(self, conn, idle_since):
+        """Проверка соединения перед выдачей"""
+        if conn.closed:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.monotonic() - idle_since < self.health_check_idle:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def prefill(self):
+        """Открыть minconn соединений заранее"""
+        self._check_pid()
+        while True:
+            with self._lock:
+                if self._size >= self.minconn:
+                    return
+                self._size += 1
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._lock:
+                    self._size -= 1
+                    self._lock.notify()
+                raise
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+                self._lock.notify()
+
+    def getconn(self, timeout=None):
+        """
+        Взять соединение из пула
+
+        @param timeout: переопределить таймаут ожидания (секунды)
+        @raise PoolTimeout: если свободное соединение не появилось вовремя
+        """
+        self._check_pid()
+        timeout = self.timeout if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+
+        while True:
+            conn = None
+            idle_since = None
+            with self._lock:
+                if self._closed:
+                    raise PoolError("Пул соединений закрыт")
+
+                while not self._idle and self._size >= self.maxconn:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Нет свободных соединений за {timeout:.1f}с "
+                            f"(max={self.maxconn}, в работе={len(self._in_use)})"
+                        )
+                    self._waiting += 1
+                    try:
+                        self._lock.wait(remaining)
+                    finally:
+                        self._waiting -= 1
+
+                if self._idle:
+                    conn, idle_since = self._idle.pop()
+                else:
+                    # Резервируем место под новое соединение
+                    self._size += 1
+
+            if conn is None:
+                try:
+                    conn = self._connect()
+                except Exception:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+            elif not self._is_healthy(conn, idle_since):
+                self._close_quietly(conn)
+                with self._lock:
+                    self._size -= 1
+                    self._discarded += 1
+                    self._lock.notify()
+                continue
+
+            elapsed = time.monotonic() - started
+            with self._lock:
+                self._in_use.add(id(conn))
+                self._checkouts += 1
+                self._checkout_time_total += elapsed
+                self._checkout_time_max = max(self._checkout_time_max, elapsed)
+            return conn
+
+    def putconn(self, conn, close=False):
+        """
+        Вернуть соединение в пул
+
+        Незавершённая транзакция откатывается; сломанное соединение закрывается.
+        """
+        if self._pid != os.getpid():
+            # Соединение выдано до fork - не трогаем его
+            self._inherited.append(conn)
+            return
+
+        if not close and not conn.closed:
+            try:
+                if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+            except psycopg2.Error:
+                close = True
+
+        with self._lock:
+            if id(conn) not in self._in_use:
+                raise PoolError("Соединение не принадлежит пулу")
+            self._in_use.discard(id(conn))
+
+            if close or conn.closed or self._closed:
+                self._size -= 1
+                self._discarded += 1
+                to_close = conn
+            else:
+                self._idle.append((conn, time.monotonic()))
+                to_close = None
+            self._lock.notify()
+
+        if to_close is not None:
+            self._close_quietly(to_close)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        """
+        Контекстный менеджер: соединение возвращается в пул автоматически
+
+        Использование:
+            with pool.connection() as conn:
+                ...
+        """
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        except Exception:
+            self.putconn(conn, close=conn.closed != 0)
+            raise
+        else:
+            self.putconn(conn)
+
+    def closeall(self):
+        """Закрыть все простаивающие соединения и запретить выдачу новых"""
+        with self._lock:
+            self._closed = True
+            idle = [conn for conn, _ in self._idle]
+            self._idle.clear()
+            self._size -= len(idle)
+            self._lock.notify_all()
+        for conn in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        """Статистика пула для мониторинга"""
+        with self._lock:
+            checkouts = self._checkouts
+            avg_ms = (self._checkout_time_total / checkouts * 1000) if checkouts else 0.0
+            return {
+                'pid': self._pid,
+                'min': self.minconn,
+                'max': self.maxconn,
+                'size': self._size,
+                'idle': len(self._idle),
+                'in_use': len(self._in_use),
+                'waiting': self._waiting,
+                'checkouts': checkouts,
+                'timeouts': self._timeouts,
+                'discarded': self._discarded,
+                'checkout_avg_ms': round(avg_ms, 3),
+                'checkout_max_ms': round(self._checkout_time_max * 1000, 3),
+            }
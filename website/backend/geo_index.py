@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Поиск ближайших медучреждений
+
+Учреждения из website/data/medcenters.json (build_medical_json.py пишет
+lat/lon каждого) раскладываются по ячейкам сетки GEO_CELL_DEG градусов.
+Запрос "k ближайших к (lat, lon) в радиусе R" обходит ячейки кольцами
+от точки пользователя и останавливается, как только следующее кольцо
+заведомо дальше k-го найденного - обычно это несколько ячеек из тысяч.
+
+Записи без координат в индекс не попадают; ручному базовому набору их
+проставляет geocode_medcenters.py.
+Файл перечитывается при изменении mtime (проверка не чаще GEO_RELOAD_CHECK секунд).
+"""
+
+import os
+import json
+import math
+import time
+import heapq
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Размер ячейки сетки (градусы широты/долготы; 0.1° ≈ 11 км по широте)
+GEO_CELL_DEG = float(os.getenv('GEO_CELL_DEG', 0.1))
+
+# Файл учреждений (build_medical_json.py)
+MEDCENTERS_JSON = os.getenv(
+    'MEDCENTERS_JSON',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'medcenters.json')
+)
+
+# Как часто проверять mtime medcenters.json (секунды)
+GEO_RELOAD_CHECK = float(os.getenv('GEO_RELOAD_CHECK', 60))
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG_LAT = math.pi * EARTH_RADIUS_KM / 180
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def institutions_from_json(data):
+    """Плоский список учреждений с координатами из структуры medcenters.json"""
+    items = []
+    for region, districts in data.get('regions', {}).items():
+        for district, entries in districts.items():
+            for entry in entries:
+                if entry.get('lat') is None or entry.get('lon') is None:
+                    continue
+                items.append({
+                    'id': entry.get('id'),
+                    'name': entry.get('name'),
+                    'type': entry.get('type'),
+                    'address': entry.get('address'),
+                    'is_blood_center': bool(entry.get('isBloodCenter')),
+                    'region': region,
+                    'district': district,
+                    'lat': float(entry['lat']),
+                    'lon': float(entry['lon'])
+                })
+    return items
+
+
+class GridIndex:
+    """
+    Сетка lat/lon -> список учреждений
+
+    @param items: словари с ключами lat, lon
+    @param cell_deg: размер ячейки в градусах
+    """
+
+    def __init__(self, items, cell_deg=GEO_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.items = items
+        self.cells = {}
+        self.max_abs_lat = 0.0
+        for item in items:
+            self.cells.setdefault(self._cell(item['lat'], item['lon']), []).append(item)
+            self.max_abs_lat = max(self.max_abs_lat, abs(item['lat']))
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_deg)), int(math.floor(lon / self.cell_deg))
+
+    def _ring(self, ci, cj, r):
+        """Ячейки на расстоянии ровно r колец от (ci, cj)"""
+        if r == 0:
+            yield ci, cj
+            return
+        for dj in range(-r, r + 1):
+            yield ci - r, cj + dj
+            yield ci + r, cj + dj
+        for di in range(-r + 1, r):
+            yield ci + di, cj - r
+            yield ci + di, cj + r
+
+    def nearest(self, lat, lon, k=10, radius_km=50):
+        """
+        k ближайших учреждений в радиусе radius_km
+
+        @return: [(расстояние в км, учреждение)] по возрастанию расстояния
+        """
+        if not self.items or k <= 0:
+            return []
+
+        # Минимальный размер ячейки в км в зоне поиска (долгота сжимается к полюсу)
+        lat_reach = min(89.0, max(abs(lat), self.max_abs_lat) + radius_km / KM_PER_DEG_LAT)
+        cell_km = self.cell_deg * KM_PER_DEG_LAT * min(1.0, math.cos(math.radians(lat_reach)))
+        max_ring = int(radius_km / cell_km) + 1 if cell_km > 0 else 0
+
+        ci, cj = self._cell(lat, lon)
+        heap = []   # max-heap по расстоянию: (-distance, порядковый номер, item)
+        seq = 0
+        for r in range(max_ring + 1):
+            # Всё в кольце r и дальше - не ближе (r - 1) * cell_km
+            if len(heap) == k and (r - 1) * cell_km > -heap[0][0]:
+                break
+            for cell in self._ring(ci, cj, r):
+                for item in self.cells.get(cell, ()):
+                    distance = haversine_km(lat, lon, item['lat'], item['lon'])
+                    if distance > radius_km:
+                        continue
+                    seq += 1
+                    if len(heap) < k:
+                        heapq.heappush(heap, (-distance, seq, item))
+                    elif distance < -heap[0][0]:
+                        heapq.heapreplace(heap, (-distance, seq, item))
+        return sorted(((-d, item) for d, _, item in heap), key=lambda pair: pair[0])
+
+
+class NearbyIndex:
+    """
+    Индекс ближайших учреждений по medcenters.json с перечитыванием файла
+
+    @param path: путь к medcenters.json
+    """
+
+    def __init__(self, path=MEDCENTERS_JSON, reload_check=GEO_RELOAD_CHECK):
+        self.path = path
+        self.reload_check = reload_check
+
+        self._lock = threading.Lock()
+        self._index = None
+        self._mtime = None
+        self._checked_at = 0
+
+        self.loads = 0
+        self.queries = 0
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self._index is not None and now - self._checked_at < self.reload_check:
+            return
+        with self._lock:
+            if self._index is not None and now - self._checked_at < self.reload_check:
+                return
+            self._checked_at = now
+            mtime = os.stat(self.path).st_mtime
+            if self._index is not None and mtime == self._mtime:
+                return
+
+            with open(self.path, encoding='utf-8') as f:
+                items = institutions_from_json(json.load(f))
+            self._index = GridIndex(items)
+            self._mtime = mtime
+            self.loads += 1
+        logger.info(f"[GEO] Индекс построен: {len(items)} учреждений с координатами, "
+                    f"{len(self._index.cells)} ячеек")
+
+    def ensure_loaded(self):
+        self._maybe_reload()
+
+    def nearest(self, lat, lon, k=10, radius_km=50):
+        self._maybe_reload()
+        self.queries += 1
+        return self._index.nearest(lat, lon, k, radius_km)
+
+    def stats(self):
+        index = self._index
+        return {
+            'institutions': len(index.items) if index else 0,
+            'cells': len(index.cells) if index else 0,
+            'loads': self.loads,
+            'queries': self.queries
+        }
+
+
+NEARBY = NearbyIndex()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для проставления координат учреждениям в medcenters.json.
+
+Ручной базовый набор хранит только адреса, а /api/medcenters/nearby
+(geo_index.py) видит лишь записи с lat/lon. Скрипт находит координаты
+по адресу (а без адреса - по названию и району) через Nominatim
+(OpenStreetMap) и записывает их в тот же файл. Записи, у которых
+координаты уже есть, не трогаются - повторный запуск догеокодирует
+только оставшиеся.
+
+Nominatim разрешает не больше 1 запроса в секунду; для своего
+экземпляра укажите GEOCODER_URL и --delay 0.
+
+Запуск (из website/backend):
+python geocode_medcenters.py
+python geocode_medcenters.py --file ../data/medcenters.json --dry-run
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import requests
+
+# Поиск Nominatim (можно указать свой экземпляр)
+GEOCODER_URL = os.getenv('GEOCODER_URL', 'https://nominatim.openstreetmap.org/search')
+
+# Nominatim требует User-Agent, по которому можно связаться с автором запросов
+GEOCODER_USER_AGENT = os.getenv('GEOCODER_USER_AGENT', 'YourDonor-medcenters-geocoder/1.0')
+
+DEFAULT_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'medcenters.json')
+
+
+def build_queries(region, district, entry):
+    """Варианты строки поиска: сначала по адресу, затем по названию"""
+    queries = []
+    address = entry.get('address')
+    if address:
+        if address.startswith('г. '):
+            queries.append(f"{address}, Беларусь")
+        elif region.startswith('город '):
+            # Адреса Минска записаны без города
+            queries.append(f"{region[len('город '):]}, {address}, Беларусь")
+        else:
+            queries.append(f"{address}, {district}, {region}, Беларусь")
+    if entry.get('name'):
+        queries.append(f"{entry['name']}, {district}, {region}, Беларусь")
+    return queries
+
+
+def geocode(session, query):
+    """Координаты (lat, lon) первого результата или None"""
+    response = session.get(GEOCODER_URL, params={
+        'q': query,
+        'format': 'json',
+        'limit': 1,
+        'countrycodes': 'by',
+        'accept-language': 'ru'
+    }, timeout=30)
+    response.raise_for_status()
+    results = response.json()
+    if not results:
+        return None
+    return round(float(results[0]['lat']), 6), round(float(results[0]['lon']), 6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--file', default=DEFAULT_FILE, help='путь к medcenters.json')
+    parser.add_argument('--delay', type=float, default=1.0, help='пауза между запросами, сек')
+    parser.add_argument('--dry-run', action='store_true', help='только показать найденное, файл не менять')
+    opts = parser.parse_args()
+
+    with open(opts.file, encoding='utf-8') as f:
+        data = json.load(f)
+
+    pending = [
+        (region, district, entry)
+        for region, districts in data.get('regions', {}).items()
+        for district, entries in districts.items()
+        for entry in entries
+        if entry.get('lat') is None or entry.get('lon') is None
+    ]
+
+    print("=" * 60)
+    print(f"Учреждений без координат: {len(pending)}")
+    print("=" * 60)
+
+    session = requests.Session()
+    session.headers['User-Agent'] = GEOCODER_USER_AGENT
+
+    found, missed = 0, []
+    for region, district, entry in pending:
+        coords = None
+        for query in build_queries(region, district, entry):
+            try:
+                coords = geocode(session, query)
+            except (requests.RequestException, ValueError) as e:
+                print(f"❌ Ошибка геокодера: {e}")
+                coords = None
+            time.sleep(opts.delay)
+            if coords:
+                break
+
+        if coords:
+            entry['lat'], entry['lon'] = coords
+            found += 1
+            print(f"📍 {entry.get('id')}: {coords[0]}, {coords[1]}")
+        else:
+            missed.append(entry.get('id'))
+            print(f"⚠️ {entry.get('id')}: не найдено")
+
+    if found and not opts.dry_run:
+        data.setdefault('metadata', {})['coordinates'] = 'Nominatim (OpenStreetMap)'
+        tmp = opts.file + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write('\n')
+        # Атомарная замена: geo_index перечитывает файл по mtime
+        os.replace(tmp, opts.file)
+
+    print("\n" + "=" * 60)
+    print(f"✅ Найдено: {found}, без координат: {len(missed)}")
+    if missed:
+        print("   " + ", ".join(str(item) for item in missed))
+    if opts.dry_run:
+        print("   (--dry-run: файл не изменён)")
+    return 0 if not missed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
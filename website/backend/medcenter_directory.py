@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Справочник медцентров в памяти
+
+/api/medcenters и /api/medcenters/<id> отдаются из копии medical_centers
+с индексами по id, району, области и статусу подтверждения:
+- список медцентров читается одним запросом при первом обращении;
+- после регистрации, подтверждения, отклонения и правки профиля
+  вызывается invalidate(mc_id) - перечитывается только эта строка;
+- готовый JSON каждого варианта списка хранится до следующего изменения.
+
+Изменения в обход API (ручные UPDATE) подхватываются полной
+перезагрузкой раз в MEDCENTER_DIRECTORY_TTL секунд.
+"""
+
+import os
+import json
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Страховочная полная перезагрузка (секунды)
+MEDCENTER_DIRECTORY_TTL = int(os.getenv('MEDCENTER_DIRECTORY_TTL', 300))
+
+# master_password в справочник не попадает
+DIRECTORY_QUERY = """
+    SELECT mc.id, mc.name, mc.district_id, mc.address, mc.phone, mc.email,
+           mc.is_blood_center, mc.is_active, mc.approval_status,
+           mc.created_by_telegram_id, mc.approved_by_telegram_id, mc.approved_at,
+           mc.rejection_reason, mc.created_at, mc.updated_at,
+           d.name as district_name, r.name as region_name, r.id as region_id
+    FROM medical_centers mc
+    LEFT JOIN districts d ON mc.district_id = d.id
+    LEFT JOIN regions r ON d.region_id = r.id
+"""
+
+# Поля элемента списка /api/medcenters
+LIST_FIELDS = ('id', 'name', 'address', 'email', 'is_blood_center',
+               'district_id', 'district_name', 'region_name', 'region_id')
+
+
+def sort_key(mc):
+    """Порядок списка - по названию (регистр и ё/е не различаются)"""
+    return ((mc['name'] or '').casefold().replace('ё', 'е'), mc['id'])
+
+
+def is_listed(mc, include_pending):
+    if not mc['is_active']:
+        return False
+    return include_pending or mc['approval_status'] in ('approved', None)
+
+
+def default_encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class MedcenterDirectory:
+    """
+    Индексированная копия medical_centers
+
+    @param ttl: период полной перезагрузки (секунды)
+    """
+
+    def __init__(self, ttl=MEDCENTER_DIRECTORY_TTL):
+        self.ttl = ttl
+        self.query_func = None
+        self.encode = default_encode
+        # Вызываются с тем же mc_id (зависимые кэши, например center_needs)
+        self.on_invalidate = []
+
+        self._lock = threading.Lock()
+        self._by_id = None
+        self._by_district = {}
+        self._by_region = {}
+        self._ordered = []
+        self._bodies = {}
+        self._stale = {}          # mc_id -> номер инвалидации
+        self._invalidations = 0
+        self._full_invalidation = 0
+        self._loaded_at = 0
+
+        self.loads = 0
+        self.refreshes = 0
+        self.hits = 0
+        self.misses = 0
+
+    # --------------------------------------------
+    # Загрузка и инвалидация
+    # --------------------------------------------
+
+    def _rebuild(self, by_id):
+        """Вторичные индексы из by_id (в памяти, без запросов)"""
+        ordered = sorted(by_id.values(), key=sort_key)
+        by_district, by_region = {}, {}
+        for mc in ordered:
+            by_district.setdefault(mc['district_id'], []).append(mc)
+            by_region.setdefault(mc['region_id'], []).append(mc)
+
+        self._by_id = by_id
+        self._ordered = ordered
+        self._by_district = by_district
+        self._by_region = by_region
+        self._bodies = {}
+
+    def _clear_stale(self, stale):
+        """Снять отметки, которые были до запроса (под self._lock)"""
+        for mc_id, generation in stale.items():
+            if self._stale.get(mc_id) == generation:
+                del self._stale[mc_id]
+
+    def load(self):
+        with self._lock:
+            stale, generation = dict(self._stale), self._invalidations
+        rows = self.query_func(DIRECTORY_QUERY)
+        with self._lock:
+            self._rebuild({row['id']: dict(row) for row in rows})
+            # Инвалидации во время запроса остаются в силе
+            self._clear_stale(stale)
+            self._loaded_at = time.time() if self._full_invalidation <= generation else 0
+            self.loads += 1
+        logger.info(f"[MEDCENTERS] Справочник загружен: {len(rows)} медцентров")
+
+    def _refresh_stale(self):
+        """
+        Перечитать медцентры из _stale
+
+        Отметки снимаются только после перестройки индексов: пока идёт
+        запрос, другие потоки тоже видят медцентр устаревшим, а при ошибке
+        запроса он перечитается при следующем обращении.
+        """
+        with self._lock:
+            stale = dict(self._stale)
+        ids = list(stale)
+        rows = self.query_func(DIRECTORY_QUERY + " WHERE mc.id = ANY(%s)", (ids,))
+
+        with self._lock:
+            by_id = dict(self._by_id)
+            for mc_id in ids:
+                by_id.pop(mc_id, None)
+            for row in rows:
+                by_id[row['id']] = dict(row)
+            self._rebuild(by_id)
+            self._clear_stale(stale)
+            self.refreshes += 1
+
+    def invalidate(self, mc_id=None):
+        """
+        Сбросить медцентр mc_id (или весь справочник)
+
+        Вызывать после любого изменения medical_centers
+        """
+        with self._lock:
+            self._invalidations += 1
+            if mc_id is None:
+                self._full_invalidation = self._invalidations
+                self._loaded_at = 0
+            else:
+                self._stale[mc_id] = self._invalidations
+        for callback in self.on_invalidate:
+            callback(mc_id)
+
+    def ensure_loaded(self, query_func=None, encode=None):
+        """
+        @param query_func: функция запросов (по умолчанию database.query_db)
+        @param encode: сериализация в JSON-строку (как у jsonify)
+        """
+        if query_func is not None:
+            self.query_func = query_func
+        if encode is not None:
+            self.encode = encode
+        if self.query_func is None:
+            import database
+            self.query_func = database.query_db
+
+        if self._by_id is None or time.time() - self._loaded_at > self.ttl:
+            self.load()
+        elif self._stale:
+            self._refresh_stale()
+
+    # --------------------------------------------
+    # Чтение
+    # --------------------------------------------
+
+    def get(self, mc_id):
+        """Медцентр по id (включая неактивные) или None"""
+        mc = self._by_id.get(mc_id)
+        return dict(mc) if mc else None
+
+    def list(self, district_id=None, region_id=None, include_pending=False):
+        """Список как у /api/medcenters: район важнее области"""
+        if district_id is not None:
+            candidates = self._by_district.get(district_id, [])
+        elif region_id is not None:
+            candidates = self._by_region.get(region_id, [])
+        else:
+            candidates = self._ordered
+        return [
+            {field: mc[field] for field in LIST_FIELDS}
+            for mc in candidates if is_listed(mc, include_pending)
+        ]
+
+    def list_json(self, district_id=None, region_id=None, include_pending=False):
+        """Готовый JSON списка (кэшируется до следующего изменения)"""
+        key = (district_id, region_id, include_pending)
+        bodies = self._bodies
+        body = bodies.get(key)
+        if body is not None:
+            self.hits += 1
+            return body
+
+        self.misses += 1
+        body = self.encode(self.list(district_id, region_id, include_pending))
+        bodies[key] = body
+        return body
+
+    def stats(self):
+        return {
+            'medcenters': len(self._by_id or ()),
+            'loads': self.loads,
+            'refreshes': self.refreshes,
+            'cached_lists': len(self._bodies),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+
+MEDCENTERS = MedcenterDirectory()
@@ -0,0 +1,22 @@
+-- ============================================
+-- Миграция: уведомление об изменении регионов и районов
+-- ============================================
+-- Процессы API держат справочник в памяти (reference_data.py)
+-- и перечитывают его по NOTIFY reference_data.
+
+CREATE OR REPLACE FUNCTION notify_reference_data() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('reference_data', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_regions_notify ON regions;
+CREATE TRIGGER trg_regions_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON regions
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
+
+DROP TRIGGER IF EXISTS trg_districts_notify ON districts;
+CREATE TRIGGER trg_districts_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON districts
+    FOR EACH STATEMENT EXECUTE FUNCTION notify_reference_data();
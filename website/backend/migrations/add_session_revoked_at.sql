@@ -0,0 +1,10 @@
+-- ============================================
+-- Миграция: Время отзыва сессии
+-- ============================================
+-- revoked_at ставится при logout / logout-all. По нему процессы API
+-- синхронизируют фильтр отозванных access token (revocation.py)
+
+ALTER TABLE user_sessions ADD COLUMN IF NOT EXISTS revoked_at TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_sess_revoked_at ON user_sessions(revoked_at)
+    WHERE revoked_at IS NOT NULL;
@@ -0,0 +1,70 @@
+-- ============================================
+-- Миграция (необязательная): секции user_sessions по expires_at
+-- ============================================
+-- После перевода истёкшие сессии удаляются целиком секциями
+-- (DROP TABLE вместо DELETE), см. session_compaction.py - там же
+-- заранее создаются секции на следующие месяцы.
+--
+-- Ограничения секционированной таблицы:
+-- - первичный ключ включает ключ секционирования: (id, expires_at);
+-- - session_token больше не UNIQUE (уникальность обеспечивает генерация токена).
+-- Запускать в окно обслуживания: таблица копируется целиком.
+
+BEGIN;
+
+LOCK TABLE user_sessions IN ACCESS EXCLUSIVE MODE;
+
+ALTER TABLE user_sessions RENAME TO user_sessions_old;
+ALTER INDEX IF EXISTS user_sessions_pkey RENAME TO user_sessions_old_pkey;
+
+CREATE TABLE user_sessions (
+    LIKE user_sessions_old INCLUDING DEFAULTS INCLUDING CONSTRAINTS,
+    PRIMARY KEY (id, expires_at)
+) PARTITION BY RANGE (expires_at);
+
+ALTER SEQUENCE user_sessions_id_seq OWNED BY user_sessions.id;
+
+ALTER TABLE user_sessions
+    ADD FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (medical_center_id) REFERENCES medical_centers(id) ON DELETE CASCADE;
+
+-- Секции по месяцам: от самой ранней живой сессии до +2 месяцев
+DO $$
+DECLARE
+    month_start DATE := date_trunc('month', LEAST(
+        NOW(), (SELECT MIN(expires_at) FROM user_sessions_old WHERE expires_at >= NOW() - INTERVAL '1 day')
+    ))::date;
+    last_month DATE := (date_trunc('month', NOW()) + INTERVAL '2 months')::date;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF user_sessions FOR VALUES FROM (%L) TO (%L)',
+            'user_sessions_p' || to_char(month_start, 'YYYYMM'),
+            month_start, (month_start + INTERVAL '1 month')::date
+        );
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+END $$;
+
+-- Всё, что не попало в месячные секции (например, далёкий expires_at)
+CREATE TABLE IF NOT EXISTS user_sessions_default PARTITION OF user_sessions DEFAULT;
+
+-- Переносим только живые сессии и отозванные за последние сутки
+INSERT INTO user_sessions
+SELECT * FROM user_sessions_old
+WHERE expires_at >= NOW() - INTERVAL '1 day';
+
+-- Индексы старой таблицы освобождают имена
+DROP TABLE user_sessions_old;
+
+CREATE INDEX IF NOT EXISTS idx_sess_token ON user_sessions(session_token);
+CREATE INDEX IF NOT EXISTS idx_sess_refresh_hash ON user_sessions(refresh_token_hash);
+CREATE INDEX IF NOT EXISTS idx_sess_user ON user_sessions(user_id);
+CREATE INDEX IF NOT EXISTS idx_sess_mc ON user_sessions(medical_center_id);
+CREATE INDEX IF NOT EXISTS idx_sess_user_active ON user_sessions(user_id) WHERE is_active = TRUE;
+CREATE INDEX IF NOT EXISTS idx_sess_mc_active ON user_sessions(medical_center_id) WHERE is_active = TRUE;
+CREATE INDEX IF NOT EXISTS idx_sess_expires ON user_sessions(expires_at);
+CREATE INDEX IF NOT EXISTS idx_sess_revoked_at ON user_sessions(revoked_at)
+    WHERE revoked_at IS NOT NULL;
+
+COMMIT;
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Хэширование паролей
+
+bcrypt (адаптивная стоимость PASSWORD_BCRYPT_ROUNDS) в отдельном пуле
+процессов: потоки запросов не заняты хэшированием, а число одновременных
+хэширований ограничено - всплеск логинов не забирает CPU у остального API.
+
+Старые форматы (sha256 у доноров, открытый текст у медцентров)
+проверяются как раньше, и при успешном входе пароль перехэшируется.
+"""
+
+import os
+import re
+import hmac
+import base64
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Стоимость bcrypt (2^rounds итераций); при увеличении старые хэши обновятся при входе
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv('PASSWORD_BCRYPT_ROUNDS', 12))
+
+# Процессов для хэширования
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1)))
+
+# Сколько хэширований может ждать/выполняться одновременно; остальные - 503
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', PASSWORD_HASH_WORKERS * 4))
+
+# Сколько секунд ждать места в очереди
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 2))
+
+# Без bcrypt - PBKDF2 из стандартной библиотеки
+PBKDF2_ITERATIONS = int(os.getenv('PBKDF2_ITERATIONS', 260000))
+
+
+class PasswordHasherBusy(Exception):
+    """Очередь хэширования заполнена - клиенту стоит повторить позже"""
+
+
+# ============================================
+# Функции, выполняемые в процессах пула
+# ============================================
+
+def _noop():
+    """Прогрев: процесс пула создан и отвечает"""
+    return os.getpid()
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _hash(password, rounds, iterations):
+    if bcrypt is not None:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('ascii')
+    # base64 вместо hex: хэш ~87 символов помещается в medical_centers.master_password VARCHAR(100)
+    salt = os.urandom(16)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"pbkdf2_sha256${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def _check(password, stored):
+    if stored.startswith('$2'):
+        return bcrypt.checkpw(password.encode('utf-8'), stored.encode('ascii'))
+    _, iterations, salt, digest = stored.split('$')
+    # Первые pbkdf2-хэши записаны в hex (32 + 64 символа)
+    decode = bytes.fromhex if len(digest) == 64 else _unb64
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), decode(salt), int(iterations))
+    return hmac.compare_digest(candidate, decode(digest))
+
+
+# ============================================
+# Сервис
+# ============================================
+
+def is_legacy_sha256(stored):
+    return len(stored) == 64 and all(c in '0123456789abcdef' for c in stored)
+
+
+_RE_BCRYPT = re.compile(r'\$2[abxy]?\$\d{2}\$[./A-Za-z0-9]{53}')
+_RE_PBKDF2 = re.compile(r'pbkdf2_sha256\$\d+\$[0-9A-Za-z_-]+\$[0-9A-Za-z_-]+')
+
+
+def is_adaptive(stored):
+    """
+    Строка - хэш bcrypt/pbkdf2 (проверяется формат целиком: открытый пароль
+    медцентра может случайно начинаться с "$2" или "pbkdf2_sha256$")
+    """
+    return bool(_RE_BCRYPT.fullmatch(stored) or _RE_PBKDF2.fullmatch(stored))
+
+
+class PasswordHasher:
+    """
+    Хэширование и проверка паролей в ограниченном пуле процессов
+    """
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_pending=PASSWORD_HASH_MAX_PENDING,
+                 queue_timeout=PASSWORD_HASH_QUEUE_TIMEOUT, rounds=PASSWORD_BCRYPT_ROUNDS):
+        self.workers = workers
+        self.queue_timeout = queue_timeout
+        self.rounds = rounds
+
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+        self.hashed = 0
+        self.verified = 0
+        self.rehashed = 0
+        self.rejected_busy = 0
+        self.restarts = 0
+
+    def start(self):
+        """
+        Запустить процессы пула и дождаться их готовности
+
+        ProcessPoolExecutor создаёт процессы только под первую задачу, поэтому
+        пул прогревается пустыми задачами - иначе fork случился бы при первом
+        входе, когда в процессе уже работают потоки запросов и фоновые потоки
+        (fork многопоточного процесса может зависнуть на чужой блокировке).
+        Вызывать при инициализации приложения, до запуска фоновых служб.
+        """
+        executor = self._get_executor()
+        for future in [executor.submit(_noop) for _ in range(self.workers)]:
+            future.result()
+
+    def _get_executor(self):
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    context = multiprocessing.get_context(
+                        'fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn'
+                    )
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self.rejected_busy += 1
+            raise PasswordHasherBusy()
+        try:
+            executor = self._get_executor()
+            try:
+                return executor.submit(fn, *args).result()
+            except BrokenProcessPool:
+                # Процесс пула убит (OOM killer) - без нового пула падали бы все следующие входы
+                self._reset_executor(executor)
+                return self._get_executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _reset_executor(self, broken):
+        """Заменить сломанный пул (один раз, даже если его заметили несколько потоков)"""
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.restarts += 1
+        logger.error("[PASSWORDS] Пул процессов сломан - пересоздаём")
+        broken.shutdown(wait=False, cancel_futures=True)
+
+    def hash(self, password):
+        """Новый хэш пароля"""
+        self.hashed += 1
+        return self._run(_hash, password, self.rounds, PBKDF2_ITERATIONS)
+
+    def verify(self, password, stored, allow_plaintext=False):
+        """
+        Проверить пароль
+
+        @param stored: хэш из БД (bcrypt, pbkdf2, старый sha256 hex)
+        @param allow_plaintext: stored может быть паролем в открытом виде (медцентры)
+        @return: (ok, new_hash) - new_hash не None, если хэш нужно обновить в БД
+        """
+        if not stored:
+            return False, None
+        self.verified += 1
+
+        if is_adaptive(stored):
+            if stored.startswith('$2') and bcrypt is None:
+                logger.error("[PASSWORDS] bcrypt не установлен - bcrypt-хэш не проверить")
+                return False, None
+            ok = self._run(_check, password, stored)
+            return ok, (self.hash(password) if ok and self.needs_rehash(stored) else None)
+
+        if is_legacy_sha256(stored):
+            candidate = hashlib.sha256(password.encode()).hexdigest()
+            ok = hmac.compare_digest(candidate, stored)
+        elif allow_plaintext:
+            ok = hmac.compare_digest(password.encode('utf-8'), stored.encode('utf-8'))
+        else:
+            ok = False
+
+        if not ok:
+            return False, None
+        self.rehashed += 1
+        return True, self.hash(password)
+
+    def needs_rehash(self, stored):
+        """Хэш слабее текущих настроек"""
+        if stored.startswith('$2'):
+            if bcrypt is None:
+                return False
+            try:
+                return int(stored.split('$')[2]) < self.rounds
+            except (IndexError, ValueError):
+                return True
+        if stored.startswith('pbkdf2_sha256$'):
+            # Появился bcrypt или выросло число итераций
+            return bcrypt is not None or int(stored.split('$')[1]) < PBKDF2_ITERATIONS
+        return True
+
+    def stats(self):
+        return {
+            'algorithm': 'bcrypt' if bcrypt is not None else 'pbkdf2_sha256',
+            'rounds': self.rounds,
+            'workers': self.workers,
+            'hashed': self.hashed,
+            'verified': self.verified,
+            'rehashed': self.rehashed,
+            'rejected_busy': self.rejected_busy,
+            'restarts': self.restarts
+        }
+
+
+PASSWORDS = PasswordHasher()
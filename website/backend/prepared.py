@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Кэш подготовленных запросов
+
+Горячие запросы (выполненные не меньше DB_PREPARE_THRESHOLD раз)
+подготавливаются через PREPARE на каждом соединении и дальше вызываются
+как EXECUTE: PostgreSQL не разбирает и не планирует их заново.
+На соединение хранится не больше DB_PREPARED_CACHE_SIZE запросов (LRU).
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import weakref
+from collections import OrderedDict
+
+from psycopg2 import errors
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', 'true').lower() == 'true'
+
+# После скольких выполнений запрос считается горячим
+DB_PREPARE_THRESHOLD = int(os.getenv('DB_PREPARE_THRESHOLD', 5))
+
+# Сколько подготовленных запросов держать на одном соединении
+DB_PREPARED_CACHE_SIZE = int(os.getenv('DB_PREPARED_CACHE_SIZE', 64))
+
+_PREPARABLE = ('SELECT', 'WITH', 'INSERT', 'UPDATE', 'DELETE')
+
+
+def statement_key(query):
+    """Отпечаток запроса: хэш текста без лишних пробелов"""
+    normalized = ' '.join(query.split())
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()[:16]
+
+
+def to_positional(query, count):
+    """Замена %s на $1..$n для PREPARE"""
+    parts = query.split('%s')
+    if len(parts) - 1 != count:
+        return None
+    out = [parts[0]]
+    for i, part in enumerate(parts[1:], start=1):
+        out.append(f'${i}')
+        out.append(part)
+    return ''.join(out)
+
+
+def is_preparable(query, args):
+    """Подходит ли запрос для PREPARE (позиционные %s, без кортежей в параметрах)"""
+    if not isinstance(args, (tuple, list)):
+        return False
+    if '%%' in query or '%(' in query:
+        return False
+    if any(isinstance(arg, tuple) for arg in args):
+        # tuple адаптируется в (a, b, c) для IN %s - в EXECUTE так нельзя
+        return False
+    stripped = query.lstrip()
+    if not stripped:
+        return False
+    return stripped.split(None, 1)[0].upper() in _PREPARABLE
+
+
+# ============================================
+# Кэш
+# ============================================
+
+class PreparedStatementCache:
+    """
+    Подготовленные запросы по соединениям
+
+    Состояние каждого соединения хранится в WeakKeyDictionary:
+    закрытое и выброшенное пулом соединение уносит свой кэш с собой.
+    """
+
+    def __init__(self, enabled=DB_PREPARED_STATEMENTS, threshold=DB_PREPARE_THRESHOLD,
+                 size=DB_PREPARED_CACHE_SIZE):
+        self.enabled = enabled
+        self.threshold = threshold
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._connections = weakref.WeakKeyDictionary()  # conn -> OrderedDict(key -> name)
+        self._calls = {}            # key -> сколько раз выполнялся
+        self._unpreparable = set()  # запросы, на которых PREPARE не удался
+
+        self.prepared = 0
+        self.hits = 0
+        self.evictions = 0
+        self.failures = 0
+        self.resets = 0
+
+    def rewrite(self, conn, query, args):
+        """
+        Вернуть (sql, args) для выполнения: EXECUTE для горячего запроса,
+        либо исходный запрос без изменений
+        """
+        if not self.enabled or not is_preparable(query, args):
+            return query, args
+
+        key = statement_key(query)
+        with self._lock:
+            if key in self._unpreparable:
+                return query, args
+            calls = self._calls.get(key, 0) + 1
+            if len(self._calls) < 10000 or key in self._calls:
+                self._calls[key] = calls
+        if calls < self.threshold:
+            return query, args
+
+        statements = self._connections.get(conn)
+        if statements is None:
+            statements = self._connections[conn] = OrderedDict()
+
+        name = statements.get(key)
+        if name is not None:
+            statements.move_to_end(key)
+            self.hits += 1
+        else:
+            name = self._prepare(conn, statements, key, query, len(args))
+            if name is None:
+                return query, args
+
+        if args:
+            return f"EXECUTE {name} ({', '.join(['%s'] * len(args))})", args
+        return f"EXECUTE {name}", None
+
+    def _prepare(self, conn, statements, key, query, count):
+        positional = to_positional(query, count)
+        if positional is None:
+            with self._lock:
+                self._unpreparable.add(key)
+            return None
+
+        name = f"ps_{key}"
+        cur = conn.cursor()
+        try:
+            # Точка сохранения: неудачный PREPARE не должен ломать транзакцию запроса
+            cur.execute(f"SAVEPOINT prepare_stmt; PREPARE {name} AS {positional}; RELEASE SAVEPOINT prepare_stmt")
+        except errors.DuplicatePreparedStatement:
+            cur.execute("ROLLBACK TO SAVEPOINT prepare_stmt; RELEASE SAVEPOINT prepare_stmt")
+        except Exception as e:
+            cur.execute("ROLLBACK TO SAVEPOINT prepare_stmt; RELEASE SAVEPOINT prepare_stmt")
+            self.failures += 1
+            with self._lock:
+                self._unpreparable.add(key)
+            logger.info(f"[PREPARED] Запрос не подготовлен ({e.__class__.__name__}): {' '.join(query.split())[:200]}")
+            return None
+        finally:
+            cur.close()
+
+        statements[key] = name
+        self.prepared += 1
+        if len(statements) > self.size:
+            self._evict(conn, statements)
+        return name
+
+    def _evict(self, conn, statements):
+        _, old_name = statements.popitem(last=False)
+        with conn.cursor() as cur:
+            cur.execute(f"DEALLOCATE {old_name}")
+        self.evictions += 1
+
+    def on_error(self, conn, query, error):
+        """
+        Ошибка при выполнении EXECUTE (транзакция уже откачена)
+
+        - подготовленные запросы пропали (DISCARD ALL, пулер) - забыть все
+          запросы соединения, они подготовятся заново;
+        - любая другая ошибка, в т.ч. FeatureNotSupported после ALTER TABLE
+          ("cached plan must not change result type") - DEALLOCATE этого
+          запроса, иначе он падал бы на соединении до его закрытия.
+
+        @return: True, если запрос выполнялся как EXECUTE и его стоит повторить без PREPARE
+        """
+        statements = self._connections.get(conn)
+        key = statement_key(query)
+        if statements is None or key not in statements:
+            return False
+
+        self.resets += 1
+        if isinstance(error, errors.InvalidSqlStatementName):
+            self._connections.pop(conn, None)
+            return not conn.closed
+
+        name = statements.pop(key)
+        if conn.closed:
+            return False
+        try:
+            with conn.cursor() as cur:
+                cur.execute(f"DEALLOCATE {name}")
+            conn.rollback()
+        except Exception as e:
+            conn.rollback()
+            logger.info(f"[PREPARED] Не удалось выполнить DEALLOCATE {name}: {e}")
+        logger.info(f"[PREPARED] {name} сброшен после {error.__class__.__name__}")
+        return True
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'threshold': self.threshold,
+            'size_per_connection': self.size,
+            'connections': len(self._connections),
+            'prepared': self.prepared,
+            'hits': self.hits,
+            'evictions': self.evictions,
+            'failures': self.failures,
+            'resets': self.resets,
+            'unpreparable': len(self._unpreparable)
+        }
+
+
+PREPARED = PreparedStatementCache()
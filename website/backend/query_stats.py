@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Инструментирование SQL-запросов
+
+Для каждого API-запроса записывает все выполненные SQL:
+отпечаток (fingerprint), длительность, число строк, endpoint.
+Находит N+1 (один и тот же запрос много раз за один API-запрос)
+и превышение бюджета запросов на endpoint.
+"""
+
+import os
+import re
+import threading
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Сколько одинаковых по форме запросов за один API-запрос считается N+1
+QUERY_N1_THRESHOLD = int(os.getenv('QUERY_N1_THRESHOLD', 5))
+
+# Бюджет запросов на один API-запрос: по умолчанию и для отдельных endpoint
+# QUERY_BUDGETS="get_medical_centers_with_needs=3,get_conversations=5"
+QUERY_BUDGET_DEFAULT = int(os.getenv('QUERY_BUDGET_DEFAULT', 30))
+
+
+def parse_budgets(raw):
+    """Разбор строки вида 'endpoint=N,endpoint=N'"""
+    budgets = {}
+    for item in (raw or '').split(','):
+        if '=' not in item:
+            continue
+        endpoint, _, limit = item.partition('=')
+        try:
+            budgets[endpoint.strip()] = int(limit)
+        except ValueError:
+            continue
+    return budgets
+
+
+QUERY_BUDGETS = parse_budgets(os.getenv('QUERY_BUDGETS', ''))
+
+
+# ============================================
+# Отпечаток запроса
+# ============================================
+
+_RE_COMMENT = re.compile(r'--[^\n]*|/\*.*?\*/', re.S)
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r'\b\d+(?:\.\d+)?\b')
+_RE_PARAM = re.compile(r'%\(\w+\)s|%s')
+_RE_IN_LIST = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_RE_SPACES = re.compile(r'\s+')
+
+_fingerprint_cache = {}
+
+
+def fingerprint(sql):
+    """
+    Нормализованная форма запроса: литералы и параметры заменены на ?,
+    списки IN (?, ?, ...) свёрнуты, пробелы схлопнуты
+    """
+    cached = _fingerprint_cache.get(sql)
+    if cached is not None:
+        return cached
+
+    fp = _RE_COMMENT.sub(' ', sql)
+    fp = _RE_STRING.sub('?', fp)
+    fp = _RE_PARAM.sub('?', fp)
+    fp = _RE_NUMBER.sub('?', fp)
+    fp = _RE_IN_LIST.sub('(...)', fp)
+    fp = _RE_SPACES.sub(' ', fp).strip()
+
+    # Тексты запросов в коде статичны, кэш не растёт бесконечно
+    if len(_fingerprint_cache) < 5000:
+        _fingerprint_cache[sql] = fp
+    return fp
+
+
+# ============================================
+# Журнал одного API-запроса
+# ============================================
+
+class RequestQueryLog:
+    """Все SQL одного API-запроса"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint or 'unknown'
+        self.entries = []   # [(fingerprint, duration_ms, rows)]
+
+    def record(self, sql, duration_ms, rows):
+        self.entries.append((fingerprint(sql), duration_ms, rows))
+
+    @property
+    def count(self):
+        return len(self.entries)
+
+    @property
+    def total_ms(self):
+        return sum(duration for _, duration, _ in self.entries)
+
+    @property
+    def budget(self):
+        return QUERY_BUDGETS.get(self.endpoint, QUERY_BUDGET_DEFAULT)
+
+    def repeated(self, threshold=None):
+        """Запросы, выполненные >= threshold раз (подозрение на N+1)"""
+        threshold = QUERY_N1_THRESHOLD if threshold is None else threshold
+        counts = {}
+        for fp, _, _ in self.entries:
+            counts[fp] = counts.get(fp, 0) + 1
+        return {fp: n for fp, n in counts.items() if n >= threshold}
+
+    def report(self):
+        """Отчёт по запросу (для отладки)"""
+        return {
+            'endpoint': self.endpoint,
+            'queries': self.count,
+            'total_ms': round(self.total_ms, 3),
+            'budget': self.budget,
+            'over_budget': self.count > self.budget,
+            'repeated': self.repeated(),
+            'statements': [
+                {'fingerprint': fp, 'ms': round(duration, 3), 'rows': rows}
+                for fp, duration, rows in self.entries
+            ]
+        }
+
+
+# ============================================
+# Счётчики процесса
+# ============================================
+
+class QueryStats:
+    """Накопленная статистика по endpoint и отпечаткам запросов (потокобезопасно)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.endpoints = {}
+            self.fingerprints = {}
+
+    def finish_request(self, log):
+        """
+        Учесть завершённый API-запрос
+
+        @return: (repeated, over_budget) - найденные N+1 и превышение бюджета
+        """
+        repeated = log.repeated()
+        over_budget = log.count > log.budget
+
+        with self._lock:
+            ep = self.endpoints.setdefault(log.endpoint, {
+                'requests': 0, 'queries': 0, 'total_ms': 0.0, 'max_queries': 0,
+                'n_plus_one': 0, 'budget_violations': 0
+            })
+            ep['requests'] += 1
+            ep['queries'] += log.count
+            ep['total_ms'] += log.total_ms
+            ep['max_queries'] = max(ep['max_queries'], log.count)
+            ep['n_plus_one'] += 1 if repeated else 0
+            ep['budget_violations'] += 1 if over_budget else 0
+
+            for fp, duration, rows in log.entries:
+                st = self.fingerprints.setdefault(fp, {
+                    'calls': 0, 'total_ms': 0.0, 'max_ms': 0.0, 'rows': 0,
+                    'endpoints': set(), 'n_plus_one': 0
+                })
+                st['calls'] += 1
+                st['total_ms'] += duration
+                st['max_ms'] = max(st['max_ms'], duration)
+                st['rows'] += rows
+                st['endpoints'].add(log.endpoint)
+            for fp in repeated:
+                self.fingerprints[fp]['n_plus_one'] += 1
+
+        return repeated, over_budget
+
+    def report(self, top=20):
+        """Сводка: endpoint и самые тяжёлые запросы"""
+        with self._lock:
+            endpoints = {
+                name: dict(ep, total_ms=round(ep['total_ms'], 3),
+                           avg_queries=round(ep['queries'] / ep['requests'], 2))
+                for name, ep in self.endpoints.items()
+            }
+            heaviest = sorted(self.fingerprints.items(),
+                              key=lambda item: item[1]['total_ms'], reverse=True)[:top]
+            queries = [
+                {
+                    'fingerprint': fp,
+                    'calls': st['calls'],
+                    'total_ms': round(st['total_ms'], 3),
+                    'avg_ms': round(st['total_ms'] / st['calls'], 3),
+                    'max_ms': round(st['max_ms'], 3),
+                    'rows': st['rows'],
+                    'n_plus_one': st['n_plus_one'],
+                    'endpoints': sorted(st['endpoints'])
+                }
+                for fp, st in heaviest
+            ]
+        return {
+            'n1_threshold': QUERY_N1_THRESHOLD,
+            'budget_default': QUERY_BUDGET_DEFAULT,
+            'budgets': QUERY_BUDGETS,
+            'endpoints': endpoints,
+            'queries': queries
+        }
+
+
+QUERY_STATS = QueryStats()
@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Ограничение частоты запросов (token bucket)
+
+Ведро на ключ (IP, аккаунт, refresh token): ёмкость burst, пополняется
+со скоростью limit/period. Проверка выполняется до любой работы с БД
+и хэширования; при пустом ведре - 429 с Retry-After.
+
+Хранилище ведер:
+- MemoryBackend - в памяти процесса (один воркер);
+- RedisBackend - общее для всех воркеров (атомарный Lua-скрипт).
+  Без Redis на месте общего хранилища работает MemoryBackend.
+"""
+
+import os
+import math
+import time
+import hashlib
+import logging
+import threading
+from functools import wraps
+from collections import OrderedDict
+
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+
+# memory | redis
+RATE_LIMIT_BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')
+
+# Сколько ведер держать в памяти (самые старые вытесняются)
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 50000))
+
+
+def parse_rule(raw):
+    """
+    Правило 'limit/period[/burst]': '5/60' - 5 запросов в минуту,
+    '20/60/10' - 20 в минуту, но не больше 10 подряд
+    """
+    parts = [float(p) for p in raw.split('/')]
+    limit, period = parts[0], parts[1]
+    burst = parts[2] if len(parts) > 2 else limit
+    return limit / period, burst
+
+
+def rule(name, default):
+    """Правило из RATE_LIMIT_<NAME> или значение по умолчанию"""
+    return parse_rule(os.getenv(f'RATE_LIMIT_{name.upper()}', default))
+
+
+# ============================================
+# Хранилища
+# ============================================
+
+class MemoryBackend:
+    """Ведра в памяти процесса (LRU по ключам)"""
+
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._buckets = OrderedDict()   # key -> (tokens, updated_at)
+
+    def take(self, key, rate, burst, cost=1):
+        """
+        Взять cost токенов из ведра
+
+        @return: (allowed, retry_after_seconds)
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated_at) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else (cost - tokens) / rate
+
+
+TOKEN_BUCKET_LUA = """
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local rate, burst, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    """
+    Ведра в Redis - общие для всех воркеров
+
+    @param client: клиент с методом register_script (redis-py)
+    """
+
+    def __init__(self, client, prefix='ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_LUA)
+
+    def take(self, key, rate, burst, cost=1):
+        allowed, tokens = self._script(keys=[self.prefix + key], args=[rate, burst, cost, time.time()])
+        tokens = float(tokens)
+        return bool(allowed), 0 if allowed else (cost - tokens) / rate
+
+
+def create_backend(kind=RATE_LIMIT_BACKEND):
+    """Хранилище по настройке; без Redis - в памяти процесса"""
+    if kind == 'redis':
+        try:
+            import redis
+            client = redis.Redis.from_url(RATE_LIMIT_REDIS_URL)
+            client.ping()
+            return RedisBackend(client)
+        except Exception as e:
+            logger.warning(f"[RATE LIMIT] Redis недоступен ({e}), лимиты считаются в памяти воркера")
+    return MemoryBackend()
+
+
+# ============================================
+# Ограничитель
+# ============================================
+
+def client_ip():
+    """
+    IP клиента за nginx
+
+    Первый адрес X-Forwarded-For задаёт сам клиент ($proxy_add_x_forwarded_for
+    только дописывает реальный адрес в конец) - по нему каждый запрос получал бы
+    новое ведро. Поэтому берётся X-Real-IP ($remote_addr в NGINX_CONFIG.md),
+    без него - последний адрес X-Forwarded-For, добавленный самим nginx.
+    """
+    real_ip = request.headers.get('X-Real-IP')
+    if real_ip:
+        return real_ip.strip()
+    forwarded = request.headers.get('X-Forwarded-For')
+    if forwarded:
+        return forwarded.rsplit(',', 1)[-1].strip()
+    return request.remote_addr or 'unknown'
+
+
+def digest(value):
+    """Короткий отпечаток идентификатора (токены и имена не храним как есть)"""
+    return hashlib.sha256(str(value).encode('utf-8')).hexdigest()[:24]
+
+
+class RateLimiter:
+    """
+    Декоратор лимитов для endpoint
+
+    Использование:
+        @app.route('/api/donor/login', methods=['POST'])
+        @RATE_LIMITER.limit('donor_login', ip='20/60/10', account=('5/300', donor_account))
+    """
+
+    def __init__(self, backend=None, enabled=RATE_LIMIT_ENABLED):
+        self.backend = backend
+        self.enabled = enabled
+        self.allowed = 0
+        self.limited = {}
+
+    def _backend(self):
+        if self.backend is None:
+            self.backend = create_backend()
+        return self.backend
+
+    def check(self, name, checks):
+        """
+        Проверить все ведра запроса
+
+        @param checks: [(scope, key, (rate, burst))]
+        @return: None или секунды до повтора
+        """
+        retry_after = None
+        for scope, key, (rate, burst) in checks:
+            if key is None:
+                continue
+            allowed, wait = self._backend().take(f'{name}:{scope}:{key}', rate, burst)
+            if not allowed:
+                retry_after = max(retry_after or 0, wait)
+        return retry_after
+
+    def limit(self, name, ip=None, account=None):
+        """
+        @param ip: правило на IP ('limit/period[/burst]')
+        @param account: (правило, функция -> идентификатор аккаунта или None)
+        """
+        ip_rule = rule(f'{name}_ip', ip) if ip else None
+        account_rule = rule(f'{name}_account', account[0]) if account else None
+
+        def decorator(f):
+            @wraps(f)
+            def decorated(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+
+                checks = []
+                if ip_rule:
+                    checks.append(('ip', client_ip(), ip_rule))
+                if account_rule:
+                    identifier = account[1]()
+                    checks.append(('account', digest(identifier) if identifier else None, account_rule))
+
+                retry_after = self.check(name, checks)
+                if retry_after is None:
+                    self.allowed += 1
+                    return f(*args, **kwargs)
+
+                self.limited[name] = self.limited.get(name, 0) + 1
+                seconds = max(1, math.ceil(retry_after))
+                logger.warning(f"[RATE LIMIT] {name}: отказ для {client_ip()}, повтор через {seconds} с")
+                response = jsonify({
+                    'error': 'Слишком много попыток. Повторите позже.',
+                    'code': 'RATE_LIMITED',
+                    'retry_after': seconds
+                })
+                response.headers['Retry-After'] = str(seconds)
+                return response, 429
+            return decorated
+        return decorator
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'backend': type(self._backend()).__name__,
+            'allowed': self.allowed,
+            'limited': dict(self.limited)
+        }
+
+
+RATE_LIMITER = RateLimiter()
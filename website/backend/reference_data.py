@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Справочник регионов и районов в памяти
+
+Регионы и районы меняются только миграциями, а читаются на каждой
+странице регистрации. Снимок загружается один раз на процесс:
+- ответы хранятся готовым JSON, ETag - хэш содержимого;
+- If-None-Match с тем же ETag получает 304 без тела;
+- после изменения таблиц триггер (migrations/add_reference_data_notify.sql)
+  шлёт NOTIFY reference_data, и снимок перечитывается.
+"""
+
+import os
+import json
+import time
+import select
+import hashlib
+import logging
+import threading
+
+import psycopg2
+from flask import Response, request
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# max-age ответов (секунды); после перезагрузки клиенты получат новый ETag
+REFERENCE_DATA_MAX_AGE = int(os.getenv('REFERENCE_DATA_MAX_AGE', 3600))
+
+# Слушать NOTIFY об изменении таблиц
+REFERENCE_DATA_LISTEN = os.getenv('REFERENCE_DATA_LISTEN', 'true').lower() == 'true'
+
+NOTIFY_CHANNEL = 'reference_data'
+
+REGIONS_QUERY = "SELECT id, name FROM regions ORDER BY id"
+DISTRICTS_QUERY = "SELECT id, name, region_id FROM districts ORDER BY region_id, name"
+
+
+def default_encode(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':'), default=str)
+
+
+class ReferenceData:
+    """
+    Снимок regions/districts с готовыми ответами
+
+    @param max_age: Cache-Control max-age
+    @param listen: перечитывать снимок по NOTIFY
+    """
+
+    def __init__(self, max_age=REFERENCE_DATA_MAX_AGE, listen=REFERENCE_DATA_LISTEN):
+        self.max_age = max_age
+        self.listen = listen
+        self.query_func = None
+        self.encode = default_encode
+        # Вызываются после каждой перезагрузки (зависимые кэши с названиями районов)
+        self.on_reload = []
+
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._entries = None     # ключ -> (body, etag)
+        self.district_rows = []  # районы с названием области (для поиска)
+        self._empty = None
+        self._worker = None
+        self._pid = None
+
+        self.loads = 0
+        self.loaded_at = None
+        self.served = 0
+        self.not_modified = 0
+        self.listen_errors = 0
+
+    # --------------------------------------------
+    # Загрузка
+    # --------------------------------------------
+
+    def _entry(self, value):
+        body = self.encode(value).encode('utf-8')
+        return body, hashlib.sha256(body).hexdigest()[:32]
+
+    def load(self, query_func=None, encode=None):
+        """
+        Загрузить снимок (при старте воркера и по NOTIFY)
+
+        @param query_func: функция запросов (по умолчанию database.query_db)
+        @param encode: сериализация в JSON-строку (как у jsonify)
+        """
+        if query_func is not None:
+            self.query_func = query_func
+        if encode is not None:
+            self.encode = encode
+        if self.query_func is None:
+            import database
+            self.query_func = database.query_db
+
+        regions = [dict(row) for row in self.query_func(REGIONS_QUERY)]
+        region_names = {region['id']: region['name'] for region in regions}
+        by_region = {}
+        district_rows = []
+        for row in self.query_func(DISTRICTS_QUERY):
+            by_region.setdefault(row['region_id'], []).append({'id': row['id'], 'name': row['name']})
+            district_rows.append({'id': row['id'], 'name': row['name'], 'region_id': row['region_id'],
+                                  'region_name': region_names.get(row['region_id'])})
+
+        entries = {'regions': self._entry(regions)}
+        for region_id, districts in by_region.items():
+            entries[('districts', region_id)] = self._entry(districts)
+
+        with self._lock:
+            self._entries = entries
+            self._empty = self._entry([])
+            self.district_rows = district_rows
+            self.loads += 1
+            self.loaded_at = time.time()
+        logger.info(f"[REFERENCE] Справочник загружен: {len(regions)} регионов, "
+                    f"{sum(len(d) for d in by_region.values())} районов")
+        for callback in self.on_reload:
+            callback()
+
+    def ensure_loaded(self, query_func=None, encode=None):
+        if self._entries is None:
+            with self._load_lock:
+                if self._entries is None:
+                    self.load(query_func, encode)
+        self._ensure_listener()
+
+    # --------------------------------------------
+    # Ответы
+    # --------------------------------------------
+
+    def respond(self, key):
+        """JSON-ответ из снимка с ETag и Cache-Control (304, если ETag совпал)"""
+        body, etag = self._entries.get(key) or self._empty
+        self.served += 1
+
+        response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = f'public, max-age={self.max_age}'
+        response.make_conditional(request)
+        if response.status_code == 304:
+            self.not_modified += 1
+        return response
+
+    def regions(self):
+        return self.respond('regions')
+
+    def body(self, key):
+        """Готовый JSON из снимка (bytes)"""
+        return (self._entries.get(key) or self._empty)[0]
+
+    def districts(self, region_id):
+        return self.respond(('districts', region_id))
+
+    # --------------------------------------------
+    # Перезагрузка по NOTIFY
+    # --------------------------------------------
+
+    def _ensure_listener(self):
+        if not self.listen:
+            return
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='reference-data-listen', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        import database
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**database.DB_CONFIG)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Пока слушателя не было, таблицы могли измениться
+                if self.listen_errors:
+                    self.load()
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        tables = {n.payload for n in conn.notifies}
+                        conn.notifies.clear()
+                        logger.info(f"[REFERENCE] Изменены {', '.join(sorted(tables))} - перезагрузка")
+                        self.load()
+            except Exception as e:
+                self.listen_errors += 1
+                logger.error(f"[REFERENCE] Ошибка LISTEN {NOTIFY_CHANNEL}: {e}")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self):
+        return {
+            'loaded': self._entries is not None,
+            'loads': self.loads,
+            'loaded_at': self.loaded_at,
+            'version': self._entries['regions'][1] if self._entries else None,
+            'served': self.served,
+            'not_modified': self.not_modified,
+            'listen_errors': self.listen_errors
+        }
+
+
+REFERENCE_DATA = ReferenceData()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Фильтр отозванных access token
+
+JWT живёт до exp, даже если сессию закрыли. Чтобы logout и logout-all
+действовали сразу и без запроса к БД на каждый API-запрос, процесс
+держит в памяти:
+- отозванные сессии (sid из токена) - из user_sessions.revoked_at;
+- "not before" по пользователю: токены, выпущенные раньше, недействительны.
+
+Своё отзывание процесс применяет мгновенно, чужое (другой воркер)
+подтягивает фоновой синхронизацией раз в REVOCATION_SYNC_INTERVAL секунд.
+Запись хранится, пока не истекут все токены, выпущенные до неё.
+
+Колонка revoked_at появляется миграцией migrations/add_session_revoked_at.sql.
+Без неё logout работает как раньше (is_active = FALSE), а синхронизация
+между процессами отключается с ошибкой в логе.
+"""
+
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Как часто подтягивать отзывы из user_sessions (секунды)
+REVOCATION_SYNC_INTERVAL = float(os.getenv('REVOCATION_SYNC_INTERVAL', 5))
+
+SYNC_START_QUERY = """
+    SELECT NOW()::timestamp - %s * INTERVAL '1 second' AS since
+"""
+
+# Перекрытие окна: отзыв из транзакции, которая фиксировалась дольше
+# обычного, получит revoked_at раньше уже прочитанных
+REVOKED_AFTER_QUERY = """
+    SELECT id, revoked_at FROM user_sessions
+    WHERE revoked_at >= %s::timestamp - INTERVAL '30 seconds'
+"""
+
+REVOKED_AT_COLUMN_QUERY = """
+    SELECT EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'user_sessions' AND column_name = 'revoked_at'
+    ) AS present
+"""
+
+
+class RevocationFilter:
+    """
+    Отозванные сессии и пользователи; проверка токена - O(1)
+
+    @param ttl: сколько секунд помнить отзыв (время жизни access token)
+    @param query_func: функция запросов для синхронизации (по умолчанию database.query_db)
+    """
+
+    def __init__(self, ttl, query_func=None, sync_interval=REVOCATION_SYNC_INTERVAL):
+        self.ttl = ttl
+        self.query_func = query_func
+        self.sync_interval = sync_interval
+
+        self._lock = threading.Lock()
+        self._sessions = {}      # session_id -> когда узнали (time.time())
+        self._not_before = {}    # ('donor', id) -> unix time отзыва
+        self._synced_until = None
+        self._has_revoked_at = None
+        self._worker = None
+        self._pid = os.getpid()
+
+        self.rejected = 0
+        self.syncs = 0
+        self.sync_errors = 0
+
+    # --------------------------------------------
+    # Отзыв
+    # --------------------------------------------
+
+    def revoke_session(self, session_id):
+        if session_id:
+            with self._lock:
+                self._sessions[session_id] = time.time()
+
+    def revoke_subject(self, subject):
+        """Все токены пользователя, выпущенные до этого момента включительно (logout-all)"""
+        with self._lock:
+            self._not_before[subject] = time.time()
+
+    # --------------------------------------------
+    # Проверка
+    # --------------------------------------------
+
+    def is_revoked(self, subject, session_id=None, issued_at=None):
+        """
+        Отозван ли токен
+
+        @param subject: ('donor', id) | ('medcenter', id)
+        @param session_id: sid из токена
+        @param issued_at: iat из токена (unix time; дробный - с точностью до мс)
+        """
+        self._ensure_worker()
+        revoked = session_id is not None and session_id in self._sessions
+        if not revoked and issued_at is not None:
+            not_before = self._not_before.get(subject)
+            # Целый iat старых токенов той же секунды тоже считается отозванным
+            revoked = not_before is not None and issued_at <= not_before
+        if revoked:
+            self.rejected += 1
+        return revoked
+
+    def is_session_revoked(self, session_id):
+        return session_id in self._sessions
+
+    # --------------------------------------------
+    # Синхронизация с user_sessions
+    # --------------------------------------------
+
+    def _query(self):
+        if self.query_func is None:
+            import database
+            self.query_func = database.query_db
+        return self.query_func
+
+    def revoked_at_available(self):
+        """Есть ли колонка user_sessions.revoked_at (проверяется один раз на процесс)"""
+        if self._has_revoked_at is None:
+            present = bool(self._query()(REVOKED_AT_COLUMN_QUERY, one=True)['present'])
+            if not present:
+                logger.error(
+                    "[REVOCATION] Нет колонки user_sessions.revoked_at - примените "
+                    "migrations/add_session_revoked_at.sql. До этого отзыв access token "
+                    "действует только в процессе, где выполнен logout"
+                )
+            self._has_revoked_at = present
+        return self._has_revoked_at
+
+    def sync(self):
+        """Подтянуть отзывы, сделанные другими процессами"""
+        if not self.revoked_at_available():
+            return
+
+        if self._synced_until is None:
+            self._synced_until = self._query()(SYNC_START_QUERY, (self.ttl,), one=True)['since']
+        rows = self._query()(REVOKED_AFTER_QUERY, (self._synced_until,))
+
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                self._sessions.setdefault(row['id'], now)
+                if row['revoked_at'] > self._synced_until:
+                    self._synced_until = row['revoked_at']
+            self._prune(now)
+        self.syncs += 1
+
+    def _prune(self, now):
+        expired = now - self.ttl
+        for session_id in [s for s, at in self._sessions.items() if at < expired]:
+            del self._sessions[session_id]
+        for subject in [s for s, at in self._not_before.items() if at < expired]:
+            del self._not_before[subject]
+
+    def _ensure_worker(self):
+        if self._pid != os.getpid():
+            # После fork - свой поток синхронизации
+            self._pid = os.getpid()
+            self._worker = None
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='revocation-sync', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                self.sync_errors += 1
+                logger.error(f"[REVOCATION] Ошибка синхронизации: {e}")
+            time.sleep(self.sync_interval)
+
+    def stats(self):
+        return {
+            'revoked_sessions': len(self._sessions),
+            'revoked_subjects': len(self._not_before),
+            'rejected': self.rejected,
+            'syncs': self.syncs,
+            'sync_errors': self.sync_errors,
+            'revoked_at_column': self._has_revoked_at,
+            'sync_interval': self.sync_interval
+        }
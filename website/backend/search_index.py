@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Поиск по названиям медцентров и районов
+
+Поиск по мере ввода без запросов к БД:
+- названия нормализуются: регистр (casefold), ё -> е, пунктуация -> пробел;
+- префиксный индекс: префикс слова -> документы; запрос "гор бол" находит
+  "Городская клиническая больница" (каждое слово запроса - префикс слова);
+- если префиксных совпадений мало - нечёткий поиск по триграммам
+  (опечатки: "баранавичи" -> "Барановичи").
+
+Документы трёх видов: медцентры (medcenter_directory.MEDCENTERS),
+районы (reference_data.REFERENCE_DATA) и учреждения из medcenters.json.
+Изменение медцентра перестраивает только его документ.
+"""
+
+import os
+import re
+import json
+import time
+import heapq
+import threading
+
+from medcenter_directory import MEDCENTERS, is_listed
+from reference_data import REFERENCE_DATA
+from geo_index import MEDCENTERS_JSON, GEO_RELOAD_CHECK
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Минимальная длина запроса и длина индексируемого префикса
+SEARCH_MIN_QUERY = int(os.getenv('SEARCH_MIN_QUERY', 2))
+SEARCH_MAX_PREFIX = int(os.getenv('SEARCH_MAX_PREFIX', 12))
+
+# Доля общих триграмм для нечёткого совпадения
+SEARCH_FUZZY_THRESHOLD = float(os.getenv('SEARCH_FUZZY_THRESHOLD', 0.5))
+
+# Медцентры выше районов, районы выше учреждений из справочника OSM
+KIND_RANK = {'medcenter': 0, 'district': 1, 'institution': 2}
+
+_RE_SEPARATORS = re.compile(r'[\W_]+')
+
+
+def normalize(text):
+    """'Ёлочка «Минская» ЦРБ' -> 'елочка минская црб'"""
+    text = (text or '').casefold().replace('ё', 'е')
+    return ' '.join(_RE_SEPARATORS.sub(' ', text).split())
+
+
+def trigrams(token):
+    padded = f' {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SearchIndex:
+    """
+    Префиксный и триграммный индекс документов
+
+    Документ - словарь с ключами key (уникальный), kind, name;
+    остальные поля возвращаются в результатах как есть.
+    """
+
+    def __init__(self, max_prefix=SEARCH_MAX_PREFIX):
+        self.max_prefix = max_prefix
+        self._docs = {}       # key -> (doc, normalized, tokens, trigrams)
+        self._prefixes = {}   # префикс слова -> {key}
+        self._trigrams = {}   # триграмма -> {key}
+
+    def __len__(self):
+        return len(self._docs)
+
+    def add(self, doc):
+        key = doc['key']
+        if key in self._docs:
+            self.remove(key)
+        normalized = normalize(doc['name'])
+        tokens = normalized.split()
+        grams = set()
+        for token in tokens:
+            for length in range(1, min(len(token), self.max_prefix) + 1):
+                self._prefixes.setdefault(token[:length], set()).add(key)
+            grams |= trigrams(token)
+        for gram in grams:
+            self._trigrams.setdefault(gram, set()).add(key)
+        self._docs[key] = (doc, normalized, tokens, grams)
+
+    def remove(self, key):
+        entry = self._docs.pop(key, None)
+        if entry is None:
+            return
+        _, _, tokens, grams = entry
+        for token in tokens:
+            for length in range(1, min(len(token), self.max_prefix) + 1):
+                self._discard(self._prefixes, token[:length], key)
+        for gram in grams:
+            self._discard(self._trigrams, gram, key)
+
+    @staticmethod
+    def _discard(postings, term, key):
+        keys = postings.get(term)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del postings[term]
+
+    def remove_kind(self, kind):
+        for key in [key for key, entry in self._docs.items() if entry[0]['kind'] == kind]:
+            self.remove(key)
+
+    # --------------------------------------------
+    # Поиск
+    # --------------------------------------------
+
+    def _prefix_candidates(self, tokens):
+        """Документы, где каждое слово запроса - префикс какого-то слова"""
+        postings = []
+        for token in tokens:
+            keys = self._prefixes.get(token[:self.max_prefix])
+            if not keys:
+                return set()
+            postings.append(keys)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for keys in postings[1:]:
+            candidates &= keys
+        # Слова длиннее max_prefix проверяем целиком
+        long_tokens = [t for t in tokens if len(t) > self.max_prefix]
+        if long_tokens:
+            candidates = {
+                key for key in candidates
+                if all(any(word.startswith(t) for word in self._docs[key][2]) for t in long_tokens)
+            }
+        return candidates
+
+    def _fuzzy_candidates(self, tokens, threshold):
+        grams = set()
+        for token in tokens:
+            grams |= trigrams(token)
+        counts = {}
+        for gram in grams:
+            for key in self._trigrams.get(gram, ()):
+                counts[key] = counts.get(key, 0) + 1
+        needed = threshold * len(grams)
+        return {key: shared / len(grams) for key, shared in counts.items() if shared >= needed}
+
+    def search(self, query, limit=10, kinds=None, fuzzy_threshold=SEARCH_FUZZY_THRESHOLD):
+        """
+        @param kinds: виды документов (None - все)
+        @return: [doc + {'score': ...}] - лучшие совпадения первыми
+        """
+        normalized = normalize(query)
+        tokens = normalized.split()
+        if not tokens:
+            return []
+
+        ranked = []
+        seen = set()
+        for key in self._prefix_candidates(tokens):
+            doc, name, _, _ = self._docs[key]
+            if kinds and doc['kind'] not in kinds:
+                continue
+            seen.add(key)
+            # Название начинается с запроса - выше остальных префиксных совпадений
+            match_rank = 0 if name.startswith(normalized) else 1
+            ranked.append(((match_rank, KIND_RANK.get(doc['kind'], 9), len(name), name), 1.0, doc))
+
+        if len(ranked) < limit and len(normalized) >= 3:
+            for key, similarity in self._fuzzy_candidates(tokens, fuzzy_threshold).items():
+                doc, name, _, _ = self._docs[key]
+                if key in seen or (kinds and doc['kind'] not in kinds):
+                    continue
+                ranked.append(((2, -similarity, KIND_RANK.get(doc['kind'], 9), name), similarity, doc))
+
+        best = heapq.nsmallest(limit, ranked, key=lambda item: item[0])
+        return [dict(doc, score=round(score, 3)) for _, score, doc in best]
+
+
+# ============================================
+# Источники документов
+# ============================================
+
+def medcenter_doc(mc):
+    return {
+        'key': f"medcenter:{mc['id']}", 'kind': 'medcenter', 'id': mc['id'], 'name': mc['name'],
+        'address': mc.get('address'), 'is_blood_center': bool(mc.get('is_blood_center')),
+        'district_id': mc.get('district_id'), 'district_name': mc.get('district_name'),
+        'region_name': mc.get('region_name')
+    }
+
+
+def district_doc(district):
+    return {
+        'key': f"district:{district['id']}", 'kind': 'district', 'id': district['id'],
+        'name': district['name'], 'region_id': district.get('region_id'),
+        'region_name': district.get('region_name')
+    }
+
+
+def institution_docs(data):
+    """Учреждения из medcenters.json (с координатами и без)"""
+    docs = []
+    for region, districts in data.get('regions', {}).items():
+        for district, entries in districts.items():
+            for entry in entries:
+                if not entry.get('name'):
+                    continue
+                docs.append({
+                    'key': f"institution:{entry.get('id')}", 'kind': 'institution', 'id': entry.get('id'),
+                    'name': entry['name'], 'address': entry.get('address'),
+                    'is_blood_center': bool(entry.get('isBloodCenter')),
+                    'district_name': district, 'region_name': region,
+                    'lat': entry.get('lat'), 'lon': entry.get('lon')
+                })
+    return docs
+
+
+class DirectorySearch:
+    """
+    Поиск по медцентрам, районам и medcenters.json с инкрементальным обновлением
+
+    @param medcenters: MedcenterDirectory
+    @param reference: ReferenceData
+    @param json_path: путь к medcenters.json
+    """
+
+    def __init__(self, medcenters, reference, json_path, reload_check=GEO_RELOAD_CHECK):
+        self.medcenters = medcenters
+        self.reference = reference
+        self.json_path = json_path
+        self.reload_check = reload_check
+
+        self.index = SearchIndex()
+        self._lock = threading.Lock()
+        self._pending = set()           # медцентры, изменённые после последнего поиска
+        self._medcenter_loads = None    # MEDCENTERS.loads на момент полной сборки
+        self._reference_loads = None
+        self._json_mtime = None
+        self._json_checked_at = 0
+
+        self.queries = 0
+        self.updates = 0
+        self.rebuilds = 0
+
+    def invalidate(self, mc_id=None):
+        """Подписка на MEDCENTERS.on_invalidate"""
+        with self._lock:
+            self._pending.add(mc_id)
+
+    def _sync(self):
+        """Применить изменения источников (под self._lock)"""
+        medcenters = self.medcenters
+        medcenters.ensure_loaded()
+
+        if self._medcenter_loads != medcenters.loads or None in self._pending:
+            self.index.remove_kind('medcenter')
+            for mc in medcenters.list():
+                self.index.add(medcenter_doc(mc))
+            self._medcenter_loads = medcenters.loads
+            self._pending.clear()
+            self.rebuilds += 1
+        elif self._pending:
+            for mc_id in self._pending:
+                mc = medcenters.get(mc_id)
+                if mc and is_listed(mc, include_pending=False):
+                    self.index.add(medcenter_doc(mc))
+                else:
+                    self.index.remove(f'medcenter:{mc_id}')
+                self.updates += 1
+            self._pending.clear()
+
+        if self._reference_loads != self.reference.loads:
+            self.index.remove_kind('district')
+            for district in self.reference.district_rows:
+                self.index.add(district_doc(district))
+            self._reference_loads = self.reference.loads
+
+        now = time.monotonic()
+        if now - self._json_checked_at >= self.reload_check:
+            self._json_checked_at = now
+            try:
+                mtime = os.stat(self.json_path).st_mtime
+            except OSError:
+                mtime = None
+            if mtime is not None and mtime != self._json_mtime:
+                with open(self.json_path, encoding='utf-8') as f:
+                    docs = institution_docs(json.load(f))
+                self.index.remove_kind('institution')
+                for doc in docs:
+                    self.index.add(doc)
+                self._json_mtime = mtime
+
+    def search(self, query, limit=10, kinds=None):
+        if len(normalize(query)) < SEARCH_MIN_QUERY:
+            return []
+        with self._lock:
+            self._sync()
+            self.queries += 1
+            return self.index.search(query, limit=limit, kinds=kinds)
+
+    def stats(self):
+        return {
+            'documents': len(self.index),
+            'queries': self.queries,
+            'updates': self.updates,
+            'rebuilds': self.rebuilds
+        }
+
+
+SEARCH = DirectorySearch(MEDCENTERS, REFERENCE_DATA, MEDCENTERS_JSON)
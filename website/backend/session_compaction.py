@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Фоновая очистка user_sessions
+
+Истёкшие и закрытые сессии удаляются пачками по SESSION_COMPACTION_BATCH
+строк с паузой между пачками, чтобы не держать долгих блокировок
+и не нагружать диск одним огромным DELETE. Задание выполняет только
+один процесс: остальные не получают advisory lock и пропускают запуск.
+
+Если таблица переведена на секции по expires_at
+(migrations/partition_user_sessions.sql), старые секции удаляются
+целиком через DROP TABLE, а будущие создаются заранее.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from datetime import date
+
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+SESSION_COMPACTION_ENABLED = os.getenv('SESSION_COMPACTION_ENABLED', 'true').lower() == 'true'
+
+# Как часто запускать очистку (секунды)
+SESSION_COMPACTION_INTERVAL = float(os.getenv('SESSION_COMPACTION_INTERVAL', 3600))
+
+# Строк в одной пачке и пауза между пачками (секунды)
+SESSION_COMPACTION_BATCH = int(os.getenv('SESSION_COMPACTION_BATCH', 1000))
+SESSION_COMPACTION_PAUSE = float(os.getenv('SESSION_COMPACTION_PAUSE', 0.2))
+
+# Ключ pg_advisory_lock задания (общий для всех процессов)
+SESSION_COMPACTION_LOCK_KEY = 734_500_019
+
+# На сколько месяцев вперёд держать секции (refresh token живёт 30 дней)
+PARTITION_MONTHS_AHEAD = 2
+
+_RE_PARTITION = re.compile(r'^user_sessions_p(\d{4})(\d{2})$')
+
+DELETE_BATCH_QUERY = """
+    DELETE FROM user_sessions
+    WHERE id = ANY(ARRAY(
+        SELECT id FROM user_sessions
+        WHERE expires_at < NOW()
+           OR (is_active = FALSE
+               AND (revoked_at IS NULL OR revoked_at < NOW() - %s * INTERVAL '1 second'))
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ))
+"""
+
+# Без migrations/add_session_revoked_at.sql отозванные сессии удаляются сразу
+# (межпроцессная синхронизация отзыва без колонки всё равно отключена)
+DELETE_BATCH_QUERY_NO_REVOKED_AT = """
+    DELETE FROM user_sessions
+    WHERE id = ANY(ARRAY(
+        SELECT id FROM user_sessions
+        WHERE expires_at < NOW() OR is_active = FALSE
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ))
+"""
+
+
+def month_start(year, month):
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return date(year, month, 1)
+
+
+class SessionCompactor:
+    """
+    Очистка user_sessions пачками под advisory lock
+
+    @param retention: сколько секунд хранить отозванные сессии
+                      (пока живы их access token - см. revocation.py)
+    @param db_config: параметры подключения (по умолчанию database.DB_CONFIG);
+                      задание держит своё соединение, а не соединение из пула
+    """
+
+    def __init__(self, retention, db_config=None, interval=SESSION_COMPACTION_INTERVAL,
+                 batch_size=SESSION_COMPACTION_BATCH, pause=SESSION_COMPACTION_PAUSE,
+                 enabled=SESSION_COMPACTION_ENABLED):
+        self.db_config = db_config
+        self.retention = retention
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.enabled = enabled
+
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+
+        self.progress = {
+            'running': False,
+            'runs': 0,
+            'skipped_locked': 0,
+            'last_started_at': None,
+            'last_finished_at': None,
+            'last_deleted': 0,
+            'last_batches': 0,
+            'last_dropped_partitions': [],
+            'last_error': None,
+            'total_deleted': 0
+        }
+
+    # --------------------------------------------
+    # Планировщик
+    # --------------------------------------------
+
+    def ensure_started(self):
+        """Запустить фоновый поток (по одному на процесс; app.start_background_services)"""
+        if not self.enabled:
+            return
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='session-compaction', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.run_once()
+            except Exception as e:
+                self.progress['last_error'] = str(e)
+                logger.error(f"[SESSIONS] Ошибка очистки: {e}")
+
+    # --------------------------------------------
+    # Очистка
+    # --------------------------------------------
+
+    def run_once(self, max_batches=None):
+        """
+        Один проход очистки
+
+        @return: число удалённых строк или None, если задание уже выполняет другой процесс
+        """
+        if self.db_config is None:
+            import database
+            self.db_config = database.DB_CONFIG
+
+        conn = psycopg2.connect(**self.db_config)
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (SESSION_COMPACTION_LOCK_KEY,))
+                if not cur.fetchone()[0]:
+                    self.progress['skipped_locked'] += 1
+                    return None
+            try:
+                return self._compact(conn, max_batches)
+            finally:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (SESSION_COMPACTION_LOCK_KEY,))
+        finally:
+            conn.close()
+
+    def _compact(self, conn, max_batches):
+        progress = self.progress
+        progress.update(running=True, last_started_at=time.time(), last_deleted=0,
+                        last_batches=0, last_dropped_partitions=[], last_error=None)
+        started = time.monotonic()
+        try:
+            if self._is_partitioned(conn):
+                progress['last_dropped_partitions'] = self._maintain_partitions(conn)
+            if self._has_revoked_at(conn):
+                query, args = DELETE_BATCH_QUERY, (self.retention, self.batch_size)
+            else:
+                query, args = DELETE_BATCH_QUERY_NO_REVOKED_AT, (self.batch_size,)
+
+            conn.autocommit = False
+            while max_batches is None or progress['last_batches'] < max_batches:
+                with conn.cursor() as cur:
+                    cur.execute(query, args)
+                    deleted = cur.rowcount
+                conn.commit()
+
+                progress['last_batches'] += 1
+                progress['last_deleted'] += deleted
+                progress['total_deleted'] += deleted
+                if progress['last_batches'] % 50 == 0:
+                    logger.info(f"[SESSIONS] Очистка: {progress['last_deleted']} строк, "
+                                f"{progress['last_batches']} пачек")
+                if deleted < self.batch_size:
+                    break
+                time.sleep(self.pause)
+        finally:
+            conn.rollback()
+            conn.autocommit = True
+            progress.update(running=False, last_finished_at=time.time())
+            progress['runs'] += 1
+
+        logger.info(f"[SESSIONS] Очистка завершена: удалено {progress['last_deleted']} строк "
+                    f"за {time.monotonic() - started:.1f} с ({progress['last_batches']} пачек)")
+        return progress['last_deleted']
+
+    # --------------------------------------------
+    # Секции по expires_at
+    # --------------------------------------------
+
+    def _has_revoked_at(self, conn):
+        from revocation import REVOKED_AT_COLUMN_QUERY
+        with conn.cursor() as cur:
+            cur.execute(REVOKED_AT_COLUMN_QUERY)
+            return cur.fetchone()[0]
+
+    def _is_partitioned(self, conn):
+        with conn.cursor() as cur:
+            cur.execute(
+                """SELECT 1 FROM pg_partitioned_table pt
+                   JOIN pg_class c ON c.oid = pt.partrelid
+                   WHERE c.relname = 'user_sessions'"""
+            )
+            return cur.fetchone() is not None
+
+    def _maintain_partitions(self, conn):
+        """Создать секции на PARTITION_MONTHS_AHEAD вперёд, удалить полностью истёкшие"""
+        today = date.today()
+        with conn.cursor() as cur:
+            for ahead in range(PARTITION_MONTHS_AHEAD + 1):
+                start = month_start(today.year, today.month + ahead)
+                end = month_start(start.year, start.month + 1)
+                try:
+                    cur.execute(
+                        f"CREATE TABLE IF NOT EXISTS user_sessions_p{start:%Y%m} "
+                        f"PARTITION OF user_sessions FOR VALUES FROM (%s) TO (%s)",
+                        (start, end)
+                    )
+                except psycopg2.Error as e:
+                    # Например, подходящие строки уже лежат в секции DEFAULT
+                    logger.warning(f"[SESSIONS] Не удалось создать секцию {start:%Y%m}: {e}")
+
+            cur.execute(
+                """SELECT c.relname FROM pg_inherits i
+                   JOIN pg_class c ON c.oid = i.inhrelid
+                   JOIN pg_class p ON p.oid = i.inhparent
+                   WHERE p.relname = 'user_sessions'"""
+            )
+            names = [row[0] for row in cur.fetchall()]
+
+            # Секция целиком истекла, а отозванные в ней старше retention
+            cutoff = time.time() - self.retention
+            dropped = []
+            for name in names:
+                match = _RE_PARTITION.match(name)
+                if not match:
+                    continue
+                end = month_start(int(match.group(1)), int(match.group(2)) + 1)
+                if time.mktime(end.timetuple()) < cutoff and end <= today:
+                    cur.execute(f"DROP TABLE IF EXISTS {name}")
+                    dropped.append(name)
+                    logger.info(f"[SESSIONS] Удалена секция {name}")
+        return dropped
+
+    def stats(self):
+        return dict(self.progress, enabled=self.enabled, interval=self.interval,
+                    batch_size=self.batch_size)
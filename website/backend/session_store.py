@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Хранилище сессий (user_sessions)
+
+Все записи, от которых зависит авторизация (создание, ротация
+refresh token), - одним запросом с RETURNING. Отметки last_used_at
+ни на что не влияют, поэтому копятся в памяти и пишутся одной
+пачкой раз в SESSION_TOUCH_FLUSH_INTERVAL секунд.
+"""
+
+import os
+import time
+import atexit
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Как часто сбрасывать накопленные last_used_at (секунды)
+SESSION_TOUCH_FLUSH_INTERVAL = float(os.getenv('SESSION_TOUCH_FLUSH_INTERVAL', 60))
+
+# При таком числе накопленных сессий сброс выполняется сразу
+SESSION_TOUCH_MAX_PENDING = int(os.getenv('SESSION_TOUCH_MAX_PENDING', 5000))
+
+TOUCH_FLUSH_QUERY = """
+    UPDATE user_sessions AS s
+    SET last_used_at = NOW() - v.age * INTERVAL '1 second'
+    FROM unnest(%s::int[], %s::float8[]) AS v(id, age)
+    WHERE s.id = v.id
+      AND (s.last_used_at IS NULL OR s.last_used_at < NOW() - v.age * INTERVAL '1 second')
+"""
+
+
+class SessionStore:
+    """
+    Запись и чтение user_sessions
+
+    @param flush_query_func: функция запросов для фонового сброса
+                             (вне Flask-запроса; по умолчанию database.query_db)
+    """
+
+    def __init__(self, flush_query_func=None, flush_interval=SESSION_TOUCH_FLUSH_INTERVAL,
+                 max_pending=SESSION_TOUCH_MAX_PENDING):
+        self.flush_query_func = flush_query_func
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pending = {}      # session_id -> time.monotonic() последнего использования
+        self._worker = None
+        self._pid = os.getpid()
+
+        self.touches = 0
+        self.flushes = 0
+        self.flushed_rows = 0
+        self.flush_errors = 0
+
+    # --------------------------------------------
+    # Критичные записи: один запрос с RETURNING
+    # --------------------------------------------
+
+    def create(self, query_db_func, refresh_hash, user_type, user_id=None, medical_center_id=None,
+               device_info=None, ip_address=None, platform='web', expires_at=None):
+        """Новая сессия; возвращает строку с id"""
+        return query_db_func(
+            """INSERT INTO user_sessions
+               (user_id, medical_center_id, refresh_token_hash, user_type,
+                device_info, ip_address, platform, expires_at, last_used_at, is_active)
+               VALUES (%s, %s, %s, %s, %s, %s, %s, %s, NOW(), TRUE)
+               RETURNING id""",
+            (user_id, medical_center_id, refresh_hash, user_type,
+             device_info, ip_address, platform, expires_at),
+            one=True, commit=True
+        )
+
+    def rotate(self, query_db_func, old_hash, new_hash, new_expires_at):
+        """
+        Заменить refresh token активной сессии
+
+        Проверка и замена - один UPDATE: из двух одновременных ротаций
+        одного токена проходит только одна.
+
+        @return: обновлённая строка сессии или None
+        """
+        return query_db_func(
+            """UPDATE user_sessions
+               SET refresh_token_hash = %s,
+                   expires_at = %s,
+                   last_used_at = NOW()
+               WHERE refresh_token_hash = %s
+                 AND is_active = TRUE
+                 AND expires_at > NOW()
+               RETURNING *""",
+            (new_hash, new_expires_at, old_hash),
+            one=True, commit=True
+        )
+
+    # --------------------------------------------
+    # Некритичные записи: last_used_at пачкой
+    # --------------------------------------------
+
+    def touch(self, session_id):
+        """Отметить использование сессии (запишется при следующем сбросе)"""
+        if not session_id:
+            return
+        self._check_fork()
+        with self._lock:
+            self._pending[session_id] = time.monotonic()
+            self.touches += 1
+            pending = len(self._pending)
+        self._ensure_worker()
+        if pending >= self.max_pending:
+            self._wakeup.set()
+
+    def flush(self):
+        """Записать накопленные last_used_at одним UPDATE"""
+        with self._lock:
+            if not self._pending:
+                return 0
+            pending, self._pending = self._pending, {}
+
+        now = time.monotonic()
+        ids = list(pending)
+        ages = [max(now - pending[session_id], 0.0) for session_id in ids]
+        try:
+            rows = self._query_func()(TOUCH_FLUSH_QUERY, (ids, ages), commit=True)
+        except Exception as e:
+            self.flush_errors += 1
+            logger.error(f"[SESSIONS] Не удалось записать last_used_at ({len(ids)} сессий): {e}")
+            return 0
+        self.flushes += 1
+        self.flushed_rows += rows or 0
+        return rows or 0
+
+    def _query_func(self):
+        if self.flush_query_func is None:
+            import database
+            self.flush_query_func = database.query_db
+        return self.flush_query_func
+
+    def _check_fork(self):
+        # Накопленное до fork принадлежит родителю
+        if self._pid != os.getpid():
+            with self._lock:
+                self._pid = os.getpid()
+                self._pending = {}
+                self._worker = None
+                self._wakeup = threading.Event()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='session-touch-flush', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        wakeup = self._wakeup
+        while True:
+            wakeup.wait(self.flush_interval)
+            wakeup.clear()
+            self.flush()
+
+    def stats(self):
+        return {
+            'pending': len(self._pending),
+            'flush_interval': self.flush_interval,
+            'touches': self.touches,
+            'flushes': self.flushes,
+            'flushed_rows': self.flushed_rows,
+            'flush_errors': self.flush_errors
+        }
+
+
+SESSIONS = SessionStore()
+
+# Не терять отметки при штатной остановке воркера
+atexit.register(SESSIONS.flush)
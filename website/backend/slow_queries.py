@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Журнал медленных запросов
+
+Запросы дольше SLOW_QUERY_MS логируются с endpoint и типами параметров
+(значения - только при SLOW_QUERY_LOG_ARGS=true).
+Для выборки медленных SELECT план снимается повторным запуском
+EXPLAIN (ANALYZE, BUFFERS) на отдельном соединении в фоновом потоке
+и дописывается в JSONL-файл для последующего разбора.
+"""
+
+import os
+import json
+import queue
+import random
+import logging
+import threading
+from datetime import datetime
+
+from database import is_read_only
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Порог медленного запроса (мс)
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 500))
+
+# Доля медленных запросов, для которых снимается EXPLAIN ANALYZE (0..1)
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv('SLOW_QUERY_EXPLAIN_SAMPLE', 0.1))
+
+# Куда писать планы (JSON lines)
+SLOW_QUERY_LOG_FILE = os.getenv(
+    'SLOW_QUERY_LOG_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'slow_queries.jsonl')
+)
+
+# Ограничение на время повторного запуска под EXPLAIN ANALYZE (мс)
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('SLOW_QUERY_EXPLAIN_TIMEOUT_MS', 10000))
+
+# Писать значения параметров как есть (только для отладки: среди медленных
+# запросов - проверки токенов, хэши паролей, telegram_id). По умолчанию в лог
+# попадают только тип и длина каждого параметра.
+SLOW_QUERY_LOG_ARGS = os.getenv('SLOW_QUERY_LOG_ARGS', 'false').lower() == 'true'
+
+# Максимум запросов в очереди на EXPLAIN (лишние отбрасываются)
+SLOW_QUERY_QUEUE_SIZE = 100
+
+
+def is_explainable(sql):
+    """
+    EXPLAIN ANALYZE выполняет запрос по-настоящему,
+    поэтому повторяем только запросы без изменения данных
+    """
+    return is_read_only(sql)
+
+
+def describe_arg(value):
+    """Тип и длина параметра без значения: str(64), int, None"""
+    if value is None:
+        return 'None'
+    name = type(value).__name__
+    if isinstance(value, (str, bytes, bytearray, memoryview, list, tuple, dict)):
+        return f'{name}({len(value)})'
+    return name
+
+
+def format_args(args, limit=200, raw=None):
+    """
+    Параметры для лога (длинные значения обрезаются)
+
+    @param raw: значения как есть (по умолчанию SLOW_QUERY_LOG_ARGS),
+                иначе - только тип и длина каждого параметра
+    """
+    if raw is None:
+        raw = SLOW_QUERY_LOG_ARGS
+    if not raw:
+        if isinstance(args, dict):
+            args = {key: describe_arg(value) for key, value in args.items()}
+        elif isinstance(args, (tuple, list)):
+            args = tuple(describe_arg(value) for value in args)
+        elif args is not None:
+            args = describe_arg(args)
+        text = str(args).replace("'", '')
+    else:
+        text = repr(tuple(args) if isinstance(args, list) else args)
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+# ============================================
+# Журнал
+# ============================================
+
+class SlowQueryLog:
+    """
+    Приём медленных запросов и фоновый сбор планов
+
+    @param pool: пул соединений (database.get_service_pool()), из которого берётся
+                 отдельное соединение для EXPLAIN
+    """
+
+    def __init__(self, pool, threshold_ms=SLOW_QUERY_MS, sample_rate=SLOW_QUERY_EXPLAIN_SAMPLE,
+                 log_file=SLOW_QUERY_LOG_FILE):
+        self.pool = pool
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.log_file = log_file
+
+        self._queue = queue.Queue(maxsize=SLOW_QUERY_QUEUE_SIZE)
+        self._worker = None
+        self._lock = threading.Lock()
+
+        self.slow_count = 0
+        self.explained = 0
+        self.dropped = 0
+
+    def observe(self, sql, args, duration_ms, endpoint=None):
+        """Учесть выполненный запрос; медленные - в лог и, возможно, на EXPLAIN"""
+        if duration_ms < self.threshold_ms:
+            return
+
+        self.slow_count += 1
+        logger.warning(
+            f"[SLOW QUERY] {duration_ms:.0f} мс, endpoint={endpoint}, "
+            f"params={format_args(args)}: {' '.join(sql.split())[:500]}"
+        )
+
+        if not is_explainable(sql) or random.random() >= self.sample_rate:
+            return
+
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait({
+                'sql': sql,
+                'args': args,
+                'duration_ms': round(duration_ms, 3),
+                'endpoint': endpoint,
+                'logged_at': datetime.utcnow().isoformat()
+            })
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self):
+        # Поток создаётся лениво: в каждом воркере после fork свой
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name='slow-query-explain', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                item['plan'] = self.explain(item['sql'], item['args'])
+                self._write(item)
+                self.explained += 1
+            except Exception as e:
+                logger.error(f"[SLOW QUERY] Не удалось снять план: {e}")
+            finally:
+                self._queue.task_done()
+
+    def explain(self, sql, args):
+        """EXPLAIN (ANALYZE, BUFFERS) в READ ONLY транзакции, которая затем откатывается"""
+        with self.pool.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute("SET TRANSACTION READ ONLY")
+                    cur.execute("SET LOCAL statement_timeout = %s", (SLOW_QUERY_EXPLAIN_TIMEOUT_MS,))
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, args)
+                    return cur.fetchone()[0]
+            finally:
+                conn.rollback()
+
+    def _write(self, item):
+        record = dict(item, args=format_args(item['args'], limit=2000))
+        with self._lock:
+            with open(self.log_file, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+
+    def stats(self):
+        return {
+            'threshold_ms': self.threshold_ms,
+            'sample_rate': self.sample_rate,
+            'slow': self.slow_count,
+            'explained': self.explained,
+            'dropped': self.dropped,
+            'queued': self._queue.qsize()
+        }
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Статические снимки публичных ответов
+
+Публичные данные одинаковы для всех посетителей, поэтому их отдаёт
+nginx из файлов, а не воркеры Flask (см. NGINX_CONFIG.md):
+
+    website/data/snapshots/
+        blood-needs-public.json        - последняя версия (+ .gz, .br)
+        blood-needs-public.<hash>.json - та же версия по хэшу содержимого
+        manifest.json                  - текущие хэши всех снимков
+
+Снимок переписывается только при изменении содержимого: после правки
+светофора и медцентров (mark_dirty) фоновый поток пересобирает его
+через SNAPSHOT_DEBOUNCE секунд, объединяя серию изменений в одну запись.
+Файлы пишутся во временный файл и заменяются атомарно (os.replace).
+
+Снимки из файлов (medcenters.json) пересобираются при изменении mtime:
+фоновый поток проверяет их раз в SNAPSHOT_WATCH_INTERVAL секунд.
+manifest.json общий для всех процессов: перед записью он перечитывается
+с диска под файловой блокировкой, чтобы не потерять чужие снимки.
+"""
+
+import os
+import re
+import fcntl
+import gzip
+import json
+import time
+import hashlib
+import logging
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+SNAPSHOTS_ENABLED = os.getenv('SNAPSHOTS_ENABLED', 'true').lower() == 'true'
+
+# Каталог снимков (должен быть внутри root сайта в nginx)
+SNAPSHOT_DIR = os.getenv(
+    'SNAPSHOT_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'snapshots')
+)
+
+# URL каталога для manifest
+SNAPSHOT_URL = os.getenv('SNAPSHOT_URL', '/data/snapshots')
+
+# Задержка пересборки после изменения (секунды)
+SNAPSHOT_DEBOUNCE = float(os.getenv('SNAPSHOT_DEBOUNCE', 1))
+
+# Как часто проверять mtime файлов-источников (секунды)
+SNAPSHOT_WATCH_INTERVAL = float(os.getenv('SNAPSHOT_WATCH_INTERVAL', 60))
+
+# Сколько прошлых версий с хэшем в имени хранить
+SNAPSHOT_KEEP_VERSIONS = int(os.getenv('SNAPSHOT_KEEP_VERSIONS', 3))
+
+
+def write_atomic(path, data):
+    tmp = f'{path}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def compressed_variants(body):
+    """{'': body, '.gz': ..., '.br': ...} - .br только при установленном brotli"""
+    variants = {'': body, '.gz': gzip.compress(body, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(body, quality=11)
+    return variants
+
+
+class SnapshotPublisher:
+    """
+    Публикация снимков в SNAPSHOT_DIR
+
+    Источник снимка - функция без аргументов, возвращающая bytes:
+        SNAPSHOTS.register('regions', lambda: REFERENCE_DATA.body('regions'))
+    """
+
+    def __init__(self, directory=SNAPSHOT_DIR, url=SNAPSHOT_URL, debounce=SNAPSHOT_DEBOUNCE,
+                 keep_versions=SNAPSHOT_KEEP_VERSIONS, enabled=SNAPSHOTS_ENABLED,
+                 watch_interval=SNAPSHOT_WATCH_INTERVAL):
+        self.directory = directory
+        self.url = url.rstrip('/')
+        self.debounce = debounce
+        self.keep_versions = keep_versions
+        self.enabled = enabled
+        self.watch_interval = watch_interval
+
+        self._sources = {}
+        self._watched = {}   # имя снимка -> (путь, mtime)
+        self._manifest = {}
+        self._dirty = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._pid = None
+
+        self.published = 0
+        self.unchanged = 0
+        self.errors = 0
+
+    def register(self, name, source, watch_path=None):
+        """
+        @param watch_path: файл, из которого собран снимок - пересобрать при смене его mtime
+        """
+        self._sources[name] = source
+        if watch_path is not None:
+            self._watched[name] = (watch_path, self._mtime(watch_path))
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            return None
+
+    # --------------------------------------------
+    # Публикация
+    # --------------------------------------------
+
+    def publish(self, name, body):
+        """
+        Записать снимок, если содержимое изменилось
+
+        @return: хэш содержимого
+        """
+        digest = hashlib.sha256(body).hexdigest()[:16]
+        if not self._manifest:
+            # Снимки, опубликованные раньше или другими процессами
+            self._manifest.update(self._read_manifest())
+        current = self._manifest.get(name)
+        if current and current['hash'] == digest:
+            self.unchanged += 1
+            return digest
+
+        os.makedirs(self.directory, exist_ok=True)
+        for suffix, data in compressed_variants(body).items():
+            write_atomic(os.path.join(self.directory, f'{name}.{digest}.json{suffix}'), data)
+            write_atomic(os.path.join(self.directory, f'{name}.json{suffix}'), data)
+
+        entry = {
+            'hash': digest,
+            'url': f'{self.url}/{name}.{digest}.json',
+            'latest': f'{self.url}/{name}.json',
+            'size': len(body),
+            'updated_at': int(time.time())
+        }
+        with open(os.path.join(self.directory, 'manifest.json.lock'), 'a') as lock_file:
+            # Перечитать manifest.json под блокировкой: другие процессы могли обновить свои снимки
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            with self._lock:
+                self._manifest.update(self._read_manifest())
+                self._manifest[name] = entry
+                manifest = json.dumps(self._manifest, ensure_ascii=False, sort_keys=True).encode('utf-8')
+            write_atomic(os.path.join(self.directory, 'manifest.json'), manifest)
+
+        self._prune(name)
+        self.published += 1
+        logger.info(f"[SNAPSHOTS] {name}: новая версия {digest} ({len(body)} байт)")
+        return digest
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.directory, 'manifest.json'), encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return manifest if isinstance(manifest, dict) else {}
+
+    def _prune(self, name):
+        """Удалить версии с хэшем в имени, кроме keep_versions последних"""
+        pattern = re.compile(re.escape(name) + r'\.([0-9a-f]{16})\.json')
+        versions = {}
+        for filename in os.listdir(self.directory):
+            match = pattern.fullmatch(filename)
+            if match:
+                versions[match.group(1)] = os.path.getmtime(os.path.join(self.directory, filename))
+        for digest in sorted(versions, key=versions.get, reverse=True)[self.keep_versions:]:
+            for suffix in ('', '.gz', '.br'):
+                path = os.path.join(self.directory, f'{name}.{digest}.json{suffix}')
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def publish_all(self):
+        for name in list(self._sources):
+            self._publish_source(name)
+
+    def _publish_source(self, name):
+        try:
+            self.publish(name, self._sources[name]())
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"[SNAPSHOTS] Ошибка публикации {name}: {e}")
+
+    # --------------------------------------------
+    # Пересборка после изменений
+    # --------------------------------------------
+
+    def mark_dirty(self, *names):
+        """Пересобрать снимки (все зарегистрированные, если names не указаны)"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._dirty.update(names or self._sources)
+        self._ensure_worker()
+        self._wakeup.set()
+
+    def _ensure_worker(self):
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='snapshot-publisher', daemon=True)
+                self._worker.start()
+
+    def _check_watched(self):
+        """Снимки, файл которых изменился с прошлой проверки"""
+        changed = set()
+        for name, (path, mtime) in list(self._watched.items()):
+            current = self._mtime(path)
+            if current is not None and current != mtime:
+                self._watched[name] = (path, current)
+                changed.add(name)
+        return changed
+
+    def _run(self):
+        while True:
+            woken = self._wakeup.wait(self.watch_interval if self._watched else None)
+            if woken:
+                time.sleep(self.debounce)
+                self._wakeup.clear()
+            changed = self._check_watched()
+            with self._lock:
+                names, self._dirty = self._dirty | changed, set()
+            for name in names:
+                if name in self._sources:
+                    self._publish_source(name)
+
+    def manifest(self):
+        """Общий manifest.json всех процессов (этот процесс мог ещё ничего не публиковать)"""
+        manifest = self._read_manifest()
+        manifest.update((name, entry) for name, entry in self._manifest.items() if name not in manifest)
+        return manifest
+
+    def stats(self):
+        return {
+            'enabled': self.enabled,
+            'snapshots': {name: entry['hash'] for name, entry in self._manifest.items()},
+            'brotli': brotli is not None,
+            'published': self.published,
+            'unchanged': self.unchanged,
+            'errors': self.errors
+        }
+
+
+SNAPSHOTS = SnapshotPublisher()
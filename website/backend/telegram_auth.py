@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Быстрая авторизация Telegram Mini App
+
+- secret_key = HMAC("WebAppData", bot_token) считается один раз;
+- проверенный initData кэшируется до конца окна auth_date: повторное
+  открытие Mini App с тем же initData не пересчитывает подпись;
+- telegram_id -> донор кэшируется; привязка идёт в процессе бота, поэтому
+  бот и API после привязки/отвязки шлют NOTIFY telegram_accounts, а каждый
+  процесс API слушает канал и сбрасывает запись.
+"""
+
+import os
+import hmac
+import time
+import select
+import hashlib
+import logging
+import threading
+import urllib.parse
+from functools import lru_cache
+
+import psycopg2
+
+from token_cache import TokenCache
+
+logger = logging.getLogger(__name__)
+
+
+# ============================================
+# Конфигурация
+# ============================================
+
+# Сколько секунд после auth_date initData считается действительным
+TELEGRAM_INIT_DATA_MAX_AGE = int(os.getenv('TELEGRAM_INIT_DATA_MAX_AGE', 86400))
+
+# Сколько помнить привязку telegram_id -> донор (привязка идёт в процессе бота,
+# поэтому запись живёт ограниченное время) и отсутствие привязки
+TELEGRAM_ACCOUNT_CACHE_TTL = int(os.getenv('TELEGRAM_ACCOUNT_CACHE_TTL', 600))
+TELEGRAM_ACCOUNT_NEGATIVE_TTL = int(os.getenv('TELEGRAM_ACCOUNT_NEGATIVE_TTL', 15))
+
+TELEGRAM_CACHE_SIZE = int(os.getenv('TELEGRAM_CACHE_SIZE', 10000))
+
+# Слушать NOTIFY о привязке/отвязке (иначе запись живёт до TTL)
+TELEGRAM_ACCOUNT_LISTEN = os.getenv('TELEGRAM_ACCOUNT_LISTEN', 'true').lower() == 'true'
+
+NOTIFY_CHANNEL = 'telegram_accounts'
+
+# Выполнять с commit=True после UPDATE users SET telegram_id (NOTIFY уходит при COMMIT)
+ACCOUNT_NOTIFY_SQL = f"SELECT pg_notify('{NOTIFY_CHANNEL}', %s)"
+
+
+def account_payload(telegram_id=None, user_id=None):
+    """Payload NOTIFY: 'telegram_id:user_id' (любая часть может быть пустой)"""
+    return f"{telegram_id or ''}:{user_id or ''}"
+
+
+@lru_cache(maxsize=4)
+def webapp_secret(bot_token):
+    """secret_key для проверки initData (зависит только от токена бота)"""
+    return hmac.new(b"WebAppData", bot_token.encode(), hashlib.sha256).digest()
+
+
+# ============================================
+# initData
+# ============================================
+
+class InitDataValidator:
+    """
+    Проверка подписи initData с кэшем уже проверенных строк
+
+    Ключ кэша - хэш всей строки initData, так что подделанные поля
+    при том же hash в кэш не попадут.
+    """
+
+    def __init__(self, max_age=TELEGRAM_INIT_DATA_MAX_AGE, size=TELEGRAM_CACHE_SIZE):
+        self.max_age = max_age
+        self._cache = TokenCache(size, name='telegram_init_data')
+
+    def validate(self, init_data, bot_token):
+        """
+        @return: (True, parsed) или (False, текст ошибки)
+        """
+        parsed = self._cache.get(init_data)
+        if parsed is not None:
+            return True, dict(parsed)
+
+        try:
+            parsed = dict(urllib.parse.parse_qsl(init_data))
+            received_hash = parsed.pop('hash', None)
+            if not received_hash:
+                return False, "hash не найден в initData"
+
+            data_check_string = '\n'.join(f"{k}={v}" for k, v in sorted(parsed.items()))
+            expected_hash = hmac.new(
+                webapp_secret(bot_token), data_check_string.encode(), hashlib.sha256
+            ).hexdigest()
+            if not hmac.compare_digest(expected_hash, received_hash):
+                return False, "Неверная подпись initData"
+
+            expires_at = int(parsed.get('auth_date', 0)) + self.max_age
+            if expires_at <= time.time():
+                return False, "initData устарел"
+        except Exception as e:
+            return False, f"Ошибка валидации: {str(e)}"
+
+        self._cache.put(init_data, parsed, expires_at)
+        return True, dict(parsed)
+
+    def stats(self):
+        return self._cache.stats()
+
+
+# ============================================
+# telegram_id -> донор
+# ============================================
+
+class TelegramAccountIndex:
+    """
+    Кэш поиска донора по telegram_id (положительный и отрицательный)
+
+    @param listen: сбрасывать записи по NOTIFY telegram_accounts
+    """
+
+    def __init__(self, ttl=TELEGRAM_ACCOUNT_CACHE_TTL, negative_ttl=TELEGRAM_ACCOUNT_NEGATIVE_TTL,
+                 size=TELEGRAM_CACHE_SIZE, listen=TELEGRAM_ACCOUNT_LISTEN):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.listen = listen
+        self._cache = TokenCache(size, name='telegram_accounts')
+
+        self._lock = threading.Lock()
+        self._worker = None
+        self._pid = None
+        self.notifications = 0
+        self.listen_errors = 0
+
+    def lookup(self, telegram_id, query_db_func):
+        """Донор (id, full_name, blood_type) или None"""
+        key = str(telegram_id)
+        entry = self._cache.get(key)
+        if entry is not None:
+            return dict(entry['user']) if entry['user'] else None
+
+        user = query_db_func(
+            "SELECT id, full_name, blood_type FROM users WHERE telegram_id = %s AND is_active = TRUE",
+            (telegram_id,), one=True
+        )
+        if user:
+            self._cache.put(key, {'user': dict(user)}, time.time() + self.ttl, subject=('donor', user['id']))
+            return dict(user)
+        self._cache.put(key, {'user': None}, time.time() + self.negative_ttl)
+        return None
+
+    def invalidate(self, telegram_id=None, user_id=None):
+        """Сбросить запись после привязки/отвязки"""
+        if telegram_id is not None:
+            self._cache.discard(str(telegram_id))
+        if user_id is not None:
+            self._cache.discard_subject(('donor', user_id))
+
+    # --------------------------------------------
+    # Сброс по NOTIFY (привязка в процессе бота)
+    # --------------------------------------------
+
+    def start_listener(self):
+        """Запустить поток LISTEN (по одному на процесс)"""
+        if not self.listen:
+            return
+        if self._worker is not None and self._pid == os.getpid() and self._worker.is_alive():
+            return
+        with self._lock:
+            if self._worker is None or self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._worker = threading.Thread(target=self._run, name='telegram-accounts-listen', daemon=True)
+                self._worker.start()
+
+    def _apply(self, payload):
+        telegram_id, _, user_id = payload.partition(':')
+        self.invalidate(
+            telegram_id=telegram_id or None,
+            user_id=int(user_id) if user_id.isdigit() else None
+        )
+        self.notifications += 1
+
+    def _run(self):
+        import database
+
+        while True:
+            conn = None
+            try:
+                conn = psycopg2.connect(**database.DB_CONFIG)
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                # Пока слушателя не было, уведомления могли потеряться
+                if self.listen_errors:
+                    self._cache.clear()
+
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._apply(conn.notifies.pop(0).payload)
+            except Exception as e:
+                self.listen_errors += 1
+                logger.error(f"[TELEGRAM AUTH] Ошибка LISTEN {NOTIFY_CHANNEL}: {e}")
+                time.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self):
+        return dict(self._cache.stats(), notifications=self.notifications,
+                    listen_errors=self.listen_errors)
+
+
+INIT_DATA = InitDataValidator()
+TELEGRAM_ACCOUNTS = TelegramAccountIndex()
@@ -9,10 +9,11 @@ import os
 import logging
 from datetime import datetime
 
-import psycopg2
-from psycopg2.extras import RealDictCursor
 from dotenv import load_dotenv
 
+import database
+from telegram_auth import ACCOUNT_NOTIFY_SQL, account_payload
+
 # Попробуем импортировать python-telegram-bot
 try:
     from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
@@ -32,15 +33,6 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Конфигурация БД
-DB_CONFIG = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'database': os.getenv('DB_NAME', 'your_donor'),
-    'user': os.getenv('DB_USER', 'postgres'),
-    'password': os.getenv('DB_PASSWORD', 'vadamahjkl'),
-    'port': os.getenv('DB_PORT', 5432)
-}
-
 TELEGRAM_BOT_TOKEN = os.getenv('TELEGRAM_BOT_TOKEN', '')
 WEBSITE_URL = os.getenv('WEBSITE_URL', 'http://localhost:8000')
 
@@ -57,28 +49,26 @@ API_URL = os.getenv('APP_URL', 'http://localhost:5001')
 # Работа с базой данных
 # ============================================
 
-def get_db_connection():
-    """Создать подключение к БД"""
-    return psycopg2.connect(**DB_CONFIG)
-
 def query_db(query, args=(), one=False, commit=False):
-    """Выполнить SQL запрос"""
-    conn = get_db_connection()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
+    """Выполнить SQL запрос (соединение из служебного пула database.py)"""
     try:
-        cur.execute(query, args)
-        if commit:
-            conn.commit()
-            return cur.rowcount
-        rv = cur.fetchall()
-        return (rv[0] if rv else None) if one else rv
+        return database.query_db(query, args, one=one, commit=commit)
+    except Exception as e:
+        logger.error(f"Ошибка БД: {e}")
+        raise e
+
+async def query_db_async(query, args=(), one=False, commit=False):
+    """
+    Асинхронный вариант query_db для обработчиков бота
+
+    Запрос выполняется в ограниченном пуле потоков, поэтому медленный
+    запрос не блокирует event loop и обработку апдейтов других пользователей.
+    """
+    try:
+        return await database.query_db_async(query, args, one=one, commit=commit)
     except Exception as e:
-        conn.rollback()
         logger.error(f"Ошибка БД: {e}")
         raise e
-    finally:
-        cur.close()
-        conn.close()
 
 # ============================================
 # Команды бота
@@ -100,19 +90,19 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         is_super_admin = True
         # Сохраняем или обновляем telegram_id админа
         try:
-            existing_admin = query_db(
+            existing_admin = await query_db_async(
                 "SELECT id FROM admin_users WHERE telegram_username = %s",
                 (telegram_username.lower(),), one=True
             )
             
             if existing_admin:
-                query_db(
+                await query_db_async(
                     "UPDATE admin_users SET telegram_id = %s WHERE telegram_username = %s",
                     (telegram_id, telegram_username.lower()), commit=True
                 )
                 logger.info(f"[ADMIN] Супер-админ @{telegram_username} обновил telegram_id: {telegram_id}")
             else:
-                query_db(
+                await query_db_async(
                     """INSERT INTO admin_users (telegram_id, telegram_username, role) 
                        VALUES (%s, %s, 'super_admin')
                        ON CONFLICT (telegram_id) DO UPDATE SET telegram_username = %s""",
@@ -121,7 +111,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 logger.info(f"[ADMIN] Супер-админ @{telegram_username} (ID: {telegram_id}) зарегистрирован в системе")
             
             # Проверяем ожидающие заявки медцентров
-            pending_medcenters = query_db(
+            pending_medcenters = await query_db_async(
                 "SELECT id, name, email FROM medical_centers WHERE approval_status = 'pending' ORDER BY created_at DESC LIMIT 5"
             )
             
@@ -145,7 +135,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
     
     # Проверяем, привязан ли уже аккаунт
-    donor = query_db(
+    donor = await query_db_async(
         "SELECT id, full_name, blood_type FROM users WHERE telegram_id = %s",
         (telegram_id,), one=True
     )
@@ -227,7 +217,7 @@ async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /status - статус привязки"""
     telegram_id = update.effective_user.id
     
-    donor = query_db(
+    donor = await query_db_async(
         """SELECT u.id, u.full_name, u.blood_type, u.last_donation_date,
                   u.total_donations, u.notify_urgent, u.notify_low,
                   mc.name as medical_center_name
@@ -284,7 +274,7 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Команда /unsubscribe - отписаться от уведомлений"""
     telegram_id = update.effective_user.id
     
-    result = query_db(
+    result = await query_db_async(
         "UPDATE users SET notify_urgent = FALSE, notify_low = FALSE WHERE telegram_id = %s",
         (telegram_id,), commit=True
     )
@@ -308,7 +298,7 @@ async def link_by_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_username = update.effective_user.username
     
     # Проверяем, уже привязан ли
-    existing = query_db(
+    existing = await query_db_async(
         "SELECT id, full_name FROM users WHERE telegram_id = %s",
         (telegram_id,), one=True
     )
@@ -344,7 +334,7 @@ async def link_by_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Ищем код в БД
-    link_data = query_db(
+    link_data = await query_db_async(
         """SELECT tlc.user_id, u.full_name, u.blood_type
            FROM telegram_link_codes tlc
            JOIN users u ON tlc.user_id = u.id
@@ -365,16 +355,21 @@ async def link_by_code(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Привязываем
     try:
-        query_db(
+        await query_db_async(
             "UPDATE users SET telegram_id = %s, telegram_username = %s WHERE id = %s",
             (telegram_id, telegram_username, link_data['user_id']), commit=True
         )
         
-        query_db(
+        await query_db_async(
             "UPDATE telegram_link_codes SET is_used = TRUE WHERE user_id = %s",
             (link_data['user_id'],), commit=True
         )
         
+        # API кэширует telegram_id -> донор: сбросить запись во всех процессах
+        await query_db_async(
+            ACCOUNT_NOTIFY_SQL, (account_payload(telegram_id, link_data['user_id']),), commit=True
+        )
+        
         await update.message.reply_html(
             f"✅ <b>Аккаунт успешно привязан!</b>\n\n"
             f"👤 <b>Имя:</b> {link_data['full_name']}\n"
@@ -442,7 +437,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         telegram_id = user.id
         
-        donor = query_db(
+        donor = await query_db_async(
             "SELECT id, full_name, blood_type FROM users WHERE telegram_id = %s",
             (telegram_id,), one=True
         )
@@ -534,7 +529,7 @@ async def handle_medcenter_approval(query, approve: bool):
     
     # Или проверяем в базе данных
     if not is_admin:
-        admin_in_db = query_db(
+        admin_in_db = await query_db_async(
             "SELECT id FROM admin_users WHERE telegram_id = %s AND is_active = TRUE",
             (user_id,), one=True
         )
@@ -648,7 +643,7 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE, code:
     telegram_username = update.effective_user.username
     
     # Проверяем, уже привязан ли
-    existing = query_db(
+    existing = await query_db_async(
         "SELECT id, full_name FROM users WHERE telegram_id = %s",
         (telegram_id,), one=True
     )
@@ -663,7 +658,7 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE, code:
         return
     
     # Ищем код в БД
-    link_data = query_db(
+    link_data = await query_db_async(
         """SELECT tlc.user_id, u.full_name, u.blood_type
            FROM telegram_link_codes tlc
            JOIN users u ON tlc.user_id = u.id
@@ -682,16 +677,21 @@ async def verify_code(update: Update, context: ContextTypes.DEFAULT_TYPE, code:
     
     # Привязываем аккаунт
     try:
-        query_db(
+        await query_db_async(
             "UPDATE users SET telegram_id = %s, telegram_username = %s WHERE id = %s",
             (telegram_id, telegram_username, link_data['user_id']), commit=True
         )
         
-        query_db(
+        await query_db_async(
             "UPDATE telegram_link_codes SET is_used = TRUE WHERE user_id = %s",
             (link_data['user_id'],), commit=True
         )
         
+        # API кэширует telegram_id -> донор: сбросить запись во всех процессах
+        await query_db_async(
+            ACCOUNT_NOTIFY_SQL, (account_payload(telegram_id, link_data['user_id']),), commit=True
+        )
+        
         await update.message.reply_html(
             f"✅ <b>Регистрация подтверждена!</b>\n\n"
             f"Ваш аккаунт успешно привязан.\n\n"
@@ -1047,7 +1047,7 @@ async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     telegram_id = user.id
     
     # Проверяем что это админ
-    admin = query_db(
+    admin = await query_db_async(
         "SELECT id FROM admin_users WHERE telegram_id = %s",
         (telegram_id,), one=True
     )
@@ -1057,7 +1057,7 @@ async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     
     # Получаем ожидающие заявки
-    pending = query_db(
+    pending = await query_db_async(
         """SELECT id, name, email, address, phone, district_id, created_at 
            FROM medical_centers 
            WHERE approval_status = 'pending' 
@@ -1077,7 +1077,7 @@ async def pending_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Получаем название района
         district_name = "Не указан"
         if mc.get('district_id'):
-            district = query_db(
+            district = await query_db_async(
                 "SELECT name FROM districts WHERE id = %s",
                 (mc['district_id'],), one=True
             )
@@ -1143,7 +1143,11 @@ def main():
     
     # Запуск бота
     print("✅ Бот запущен. Ожидание сообщений...")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    try:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    finally:
+        database.get_executor().shutdown(wait=True)
+        database.get_service_pool().closeall()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Твой Донор - Кэш проверенных токенов
+
+Ограниченный LRU-кэш в памяти процесса: токен -> готовая сессия.
+Ключ - SHA-256 от токена (сами токены в памяти не хранятся),
+запись живёт не дольше срока действия токена. Записи можно удалить
+по токену или сразу все записи одного пользователя (logout-all).
+"""
+
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+def token_digest(token):
+    return hashlib.sha256(token.encode('utf-8')).digest()
+
+
+class TokenCache:
+    """
+    Кэш токенов с истечением по времени и вытеснением LRU
+
+    @param maxsize: максимум записей
+    @param name: имя для статистики
+    """
+
+    def __init__(self, maxsize, name='tokens'):
+        self.maxsize = maxsize
+        self.name = name
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # digest -> (value, expires_at, subject)
+        self._subjects = {}             # subject -> set(digest)
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token):
+        """Значение для токена или None (нет в кэше / срок истёк)"""
+        if self.maxsize <= 0:
+            return None
+        key = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at, subject = entry
+            if expires_at <= time.time():
+                self._remove(key, subject)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, token, value, expires_at, subject=None):
+        """
+        Сохранить значение до expires_at (unix time)
+
+        @param subject: владелец токена, например ('donor', 42) - для discard_subject
+        """
+        if self.maxsize <= 0 or expires_at <= time.time():
+            return
+        key = token_digest(token)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._unlink(key, old[2])
+            self._entries[key] = (value, expires_at, subject)
+            if subject is not None:
+                self._subjects.setdefault(subject, set()).add(key)
+            while len(self._entries) > self.maxsize:
+                old_key, (_, _, old_subject) = self._entries.popitem(last=False)
+                self._unlink(old_key, old_subject)
+                self.evictions += 1
+
+    def discard(self, token):
+        """Удалить запись токена (logout)"""
+        key = token_digest(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._remove(key, entry[2])
+                self.invalidations += 1
+
+    def discard_subject(self, subject):
+        """Удалить все записи пользователя (logout-all)"""
+        with self._lock:
+            keys = self._subjects.pop(subject, ())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.invalidations += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._subjects.clear()
+
+    def _remove(self, key, subject):
+        del self._entries[key]
+        self._unlink(key, subject)
+
+    def _unlink(self, key, subject):
+        if subject is None:
+            return
+        keys = self._subjects.get(subject)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._subjects[subject]
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'name': self.name,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': round(self.hits / lookups, 4) if lookups else None,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations
+        }